@@ -0,0 +1,696 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Benchmarks of the sync dialog (SyncForm) at scale, run offscreen against a synthetic
+Perforce depot (see fake_p4.py) and a mockgun site:
+
+    python benchmarks/bench_sync_dialog.py --tk-core /path/to/tk-core
+    python benchmarks/bench_sync_dialog.py --scenario 100000:500 --repeat 5 --json results.json
+    python benchmarks/bench_sync_dialog.py --baseline results.json
+
+Each scenario (FILES:ASSETS) is run --repeat times, every run in a fresh process so that
+memory and the session caches don't carry over.  A run drives the dialog through these
+stages, each inside a running Qt event loop:
+
+    populate          construct the dialog, resolve the assets and run the planned dry run
+    publish_lookup    look up the PublishedFiles of the scanned files for the Step and Type filters
+    filters           switch every filter value off and back on, one toggle per event loop pass
+    sync              sync every file
+
+and reports per stage the wall time, the time the UI thread was blocked (measured as
+the lateness of a 10 ms heartbeat timer), the longest stall, the peak RSS of the process
+and the number of calls of the dialog's slots and of the tree model's signals.  Times
+are reported as the median over the runs.  With --baseline the results are compared to a
+previous --json output and the exit code is 1 if a stage got slower or bigger by more than
+--tolerance.
+
+Requires tk-core (for sgtk, its Qt importer and mockgun, with the mockgun schema fixtures
+from tk-core's tests), PySide2 or PySide6 and P4Python.  ShotGrid template resolution is
+replaced by the synthetic asset roots, as it needs a configured pipeline.
+"""
+
+import argparse
+import copy
+import importlib
+import json
+import os
+import pickle
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PYTHON_DIR = os.path.join(os.path.dirname(BENCH_DIR), "python")
+PACKAGE_NAME = "tk_framework_perforce_bench"
+
+DEFAULT_SCENARIOS = ["10:2", "1000:20", "100000:500"]
+STAGES = ["populate", "publish_lookup", "filters", "sync"]
+
+# metrics compared against a baseline, with the minimum absolute change that counts
+# as a regression so that noise on tiny values doesn't fail a run
+COMPARED_METRICS = {
+    "wall_s": 0.05,
+    "ui_blocked_s": 0.05,
+    "peak_rss_mb": 16,
+}
+
+# dialog slots whose calls are counted
+COUNTED_SLOTS = [
+    "asset_info_handler",
+    "sync_planned",
+    "make_sync_tree_items",
+    "update_available_filters",
+    "iterate_progress",
+    "set_progress_message",
+    "apply_publish_index",
+    "filter_toggled",
+    "sync_in_progress",
+    "item_syncd",
+    "sync_progress_updated",
+    "refresh_sync_counters",
+]
+
+RESULT_PREFIX = "BENCH_RESULT "
+
+
+def peak_rss_mb():
+    """
+    :returns float:    The peak resident set size of this process in MB, if it can be measured
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return round(peak / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024.0 * 1024.0), 1)
+    except (ImportError, AttributeError):
+        return None
+
+
+# ---------------------------------------------------------------------------------------------
+# a single run, in its own process
+# ---------------------------------------------------------------------------------------------
+
+class BenchRun(object):
+    """
+    Sets up the dialog against the synthetic backends and measures it stage by stage
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.work_dir = tempfile.mkdtemp(prefix="p4_sync_bench_")
+        self.errors = []
+        self.slot_calls = {}
+        # slot calls since the start of the run, slot_calls is reset for each stage
+        self.total_slot_calls = {}
+        self.model_signals = {}
+
+    # setup ------------------------------------------------------------------------------------
+
+    def setup(self):
+        # keep the dialog's preferences and caches out of the user's home
+        os.environ["HOME"] = self.work_dir
+        os.environ["USERPROFILE"] = self.work_dir
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        if self.options.tk_core:
+            sys.path.insert(0, os.path.join(self.options.tk_core, "python"))
+
+        import sgtk
+        from tank.util.qt_importer import QtImporter
+        from tank.platform import qt
+
+        # what an engine does when it starts, the framework's modules import Qt from here
+        importer = QtImporter()
+        qt.QtCore = importer.QtCore
+        qt.QtGui = importer.QtGui
+        self.QtCore = importer.QtCore
+        self.QtGui = importer.QtGui
+        self.qt_app = self.QtGui.QApplication.instance() or self.QtGui.QApplication([])
+
+        self.package = self.load_package()
+        self.depot = self.make_depot()
+        self.roots = None
+        self.shotgun = self.make_shotgun(sgtk)
+        self.framework = BenchFramework(self)
+        self.app = BenchApp(self)
+
+        # the framework's connections come from the synthetic depot
+        from fake_p4 import FakeP4
+        latency = self.options.p4_latency_ms / 1000.0
+        transfer_time = self.options.p4_transfer_us / 1000000.0
+        self.package.connection.connection.connect = \
+            lambda **kwargs: FakeP4(self.depot, latency=latency, transfer_time=transfer_time)
+
+        self.form_module = importlib.import_module(PACKAGE_NAME + ".widgets.open_sync_form")
+        self.form_module.TemplateResolver = self.make_resolver
+        self.form_class = self.make_form_class(self.form_module.SyncForm)
+        self.form_class._fw = self.framework
+
+    def load_package(self):
+        """
+        Import the framework's python package without its __init__, which needs a running
+        bundle for the widgets that use other frameworks
+        """
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [PYTHON_DIR]
+        sys.modules[PACKAGE_NAME] = package
+        package.connection = importlib.import_module(PACKAGE_NAME + ".connection")
+        package.connection.connection = importlib.import_module(PACKAGE_NAME + ".connection.connection")
+        return package
+
+    def make_depot(self):
+        from fake_p4 import FakeDepot
+        return FakeDepot(self.options.files, self.options.assets, seed=self.options.seed)
+
+    def make_shotgun(self, sgtk):
+        """
+        Create a mockgun site with the assets, and a PublishedFile for each depot file
+        """
+        from tank_vendor.shotgun_api3.lib import mockgun
+        from fake_p4 import STEPS, PUBLISH_TYPES
+
+        schema_dir = self.options.mockgun_schema or os.path.join(
+            os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sgtk.__file__)))),
+            "tests", "fixtures", "mockgun")
+        schema, schema_entity = mockgun.SchemaFactory.get_schemas(os.path.join(schema_dir, "schema.pickle"),
+                                                                  os.path.join(schema_dir, "schema_entity.pickle"))
+        # the depot path field is specific to this framework's site configuration
+        schema = copy.deepcopy(schema)
+        depot_path_field = copy.deepcopy(schema["PublishedFile"]["code"])
+        depot_path_field["name"]["value"] = "P4 Depot Path"
+        schema["PublishedFile"]["sg_p4_depo_path"] = depot_path_field
+        schema_path = os.path.join(self.work_dir, "schema.pickle")
+        schema_entity_path = os.path.join(self.work_dir, "schema_entity.pickle")
+        for path, data in [(schema_path, schema), (schema_entity_path, schema_entity)]:
+            with open(path, "wb") as file_obj:
+                pickle.dump(data, file_obj, protocol=2)
+        mockgun.Shotgun.set_schema_paths(schema_path, schema_entity_path)
+
+        sg = IndexedMockgun.create_class(mockgun)("https://bench.shotgunstudio.com", "bench", "key")
+        project = sg.create("Project", {"name": "Sync Benchmark"})
+        steps = dict((code, sg.create("Step", {"code": code, "entity_type": "Asset"})) for code in STEPS)
+        publish_types = dict((code, sg.create("PublishedFileType", {"code": code})) for code in PUBLISH_TYPES)
+
+        self.entities = []
+        tasks = {}
+        for asset in self.depot.assets:
+            entity = sg.create("Asset", {"code": asset["code"], "project": project})
+            self.entities.append({"type": "Asset", "id": entity["id"], "code": asset["code"]})
+            for code, step in steps.items():
+                tasks[(asset["code"], code)] = sg.create("Task", {"content": code, "step": step,
+                                                                  "entity": entity, "project": project})
+
+        published = int(len(self.depot.files) * self.options.publish_ratio)
+        for record in list(self.depot.files.values())[:published]:
+            sg.create("PublishedFile", {"code": os.path.basename(record["clientFile"]),
+                                        "sg_p4_depo_path": record["depotFile"],
+                                        "task": tasks[(record["asset"], record["step"])],
+                                        "published_file_type": publish_types[record["type"]],
+                                        "project": project})
+        return sg
+
+    def make_resolver(self, app=None, entity=None, cache=None):
+        if self.roots is None:
+            self.roots = dict((asset["code"], self.depot.root_path(asset)) for asset in self.depot.assets)
+        return SyntheticResolver(entity, self.roots[entity["code"]])
+
+    def make_form_class(self, form_class):
+        """
+        Subclass the dialog to count the calls of its slots.  Signals are connected to the
+        slots when the dialog is built, so the counting has to be in place before that
+        """
+        def counted(name, method):
+            def wrapper(form, *args, **kwargs):
+                self.slot_calls[name] = self.slot_calls.get(name, 0) + 1
+                self.total_slot_calls[name] = self.total_slot_calls.get(name, 0) + 1
+                return method(form, *args, **kwargs)
+            wrapper.__name__ = name
+            return wrapper
+
+        attributes = dict((name, counted(name, getattr(form_class, name))) for name in COUNTED_SLOTS)
+        return type("BenchSyncForm", (form_class,), attributes)
+
+    # measurement ------------------------------------------------------------------------------
+
+    def run_stage(self, name, action, done):
+        """
+        Run an action inside the event loop and wait for the dialog to settle
+
+        :param action:    Callable starting the stage, called from the event loop
+        :param done:      Callable returning True once the stage's work has completed
+        :returns dict:    The stage's metrics
+        """
+        QtCore = self.QtCore
+        self.slot_calls.clear()
+        self.model_signals.clear()
+        errors_before = len(self.errors)
+
+        loop = QtCore.QEventLoop()
+        monitor = UiMonitor(QtCore, self.options.heartbeat_ms)
+        state = {"idle_polls": 0, "calls": None, "timed_out": False, "failed": None}
+
+        def start():
+            try:
+                action()
+            except Exception as e:
+                state["failed"] = repr(e)
+                loop.quit()
+
+        def poll():
+            calls = sum(self.slot_calls.values()) + sum(self.model_signals.values())
+            settled = (done() and self.form_threads_idle() and calls == state["calls"])
+            state["calls"] = calls
+            # the work is done once the workers are idle and their queued signals are handled
+            state["idle_polls"] = state["idle_polls"] + 1 if settled else 0
+            if state["idle_polls"] >= 2:
+                loop.quit()
+
+        def timeout():
+            state["timed_out"] = True
+            loop.quit()
+
+        poller = QtCore.QTimer()
+        poller.setInterval(20)
+        poller.timeout.connect(poll)
+        deadline = QtCore.QTimer()
+        deadline.setSingleShot(True)
+        deadline.timeout.connect(timeout)
+
+        started = time.perf_counter()
+        monitor.start()
+        poller.start()
+        deadline.start(int(self.options.timeout * 1000))
+        QtCore.QTimer.singleShot(0, start)
+        loop.exec_()
+        wall = time.perf_counter() - started
+        monitor.stop()
+        poller.stop()
+        deadline.stop()
+
+        return {
+            "stage": name,
+            "wall_s": round(wall, 4),
+            "ui_blocked_s": round(monitor.blocked, 4),
+            "max_stall_ms": round(monitor.max_stall * 1000, 1),
+            "stalls": monitor.stalls,
+            "peak_rss_mb": peak_rss_mb(),
+            "slot_calls": dict(self.slot_calls),
+            "model_signals": dict(self.model_signals),
+            "errors": self.errors[errors_before:],
+            "timed_out": state["timed_out"],
+            "failed": state["failed"],
+        }
+
+    def form_threads_idle(self):
+        return self.form is not None and self.form.threadpool.activeThreadCount() == 0
+
+    def count_model_signals(self, model):
+        def counter(name):
+            def count(*args):
+                self.model_signals[name] = self.model_signals.get(name, 0) + 1
+            return count
+        for name in ["rowsInserted", "dataChanged", "modelReset", "layoutChanged"]:
+            getattr(model, name).connect(counter(name))
+
+    # stages -----------------------------------------------------------------------------------
+
+    def run(self):
+        self.form = None
+        results = {"setup_rss_mb": peak_rss_mb(), "stages": []}
+
+        def populate():
+            self.form = self.form_class(self.app, self.entities, [])
+            self.count_model_signals(self.form._sync_model)
+            self.form.resize(1200, 800)
+            self.form.show()
+
+        # the scan starts once the dialog has looked for an interrupted sync
+        results["stages"].append(self.run_stage(
+            "populate", populate, lambda: self.form is not None and bool(self.form._asset_items)
+            and not self.form._scanning))
+
+        results["stages"].append(self.run_stage(
+            "publish_lookup", lambda: None,
+            lambda: self.form._publish_lookup_worker is None or self.total_slot_calls.get("apply_publish_index")))
+
+        toggles = []
+        for filter_type in ["step", "type", "ext"]:
+            for value in sorted(getattr(self.form, "_{}_actions".format(filter_type)).keys()):
+                toggles.append((filter_type, value, False))
+                toggles.append((filter_type, value, True))
+        remaining = list(toggles)
+
+        def toggle_next():
+            # one toggle per pass of the event loop, like a user clicking through the menus
+            if remaining:
+                filter_type, value, checked = remaining.pop(0)
+                self.form.filter_toggled(filter_type, value, checked)
+                self.QtCore.QTimer.singleShot(0, toggle_next)
+
+        stage = self.run_stage("filters", toggle_next, lambda: not remaining)
+        stage["toggles"] = len(toggles)
+        results["stages"].append(stage)
+
+        results["stages"].append(self.run_stage("sync", self.form.start_sync, lambda: not self.form._syncing))
+        results["files_synced"] = sum(1 for record in self.depot.files.values()
+                                      if not self.depot.needs_sync(record))
+
+        self.form.close()
+        return results
+
+    def cleanup(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class UiMonitor(object):
+    """
+    Measures how long the UI thread is blocked from the lateness of a heartbeat timer
+    """
+
+    # a heartbeat this late counts as a stall the user would notice
+    STALL_THRESHOLD = 0.05
+
+    def __init__(self, QtCore, interval_ms):
+        self.interval = interval_ms / 1000.0
+        self.timer = QtCore.QTimer()
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.beat)
+        self.blocked = 0.0
+        self.max_stall = 0.0
+        self.stalls = 0
+        self._last = None
+
+    def start(self):
+        self._last = time.perf_counter()
+        self.timer.start()
+
+    def beat(self):
+        now = time.perf_counter()
+        late = now - self._last - self.interval
+        if late > 0:
+            self.blocked += late
+            self.max_stall = max(self.max_stall, late)
+            if late >= self.STALL_THRESHOLD:
+                self.stalls += 1
+        self._last = now
+
+    def stop(self):
+        self.timer.stop()
+        self.beat()
+
+
+class SyntheticResolver(object):
+    """
+    Resolves an asset straight to its synthetic root, in place of a TemplateResolver
+    """
+
+    def __init__(self, entity, root_path):
+        self.entity = entity
+        self.root_path = root_path
+
+    @property
+    def entity_info(self):
+        return {"entity": self.entity, "context": None, "root_path": self.root_path}
+
+
+class IndexedMockgun(object):
+    """
+    mockgun evaluates every row of an entity type for every find, which makes the publish
+    lookup of a large scan spend its time in mockgun rather than in the code being
+    measured.  This narrows single 'in' queries on indexed fields down to the rows that
+    can match before mockgun evaluates them.
+    """
+
+    INDEXED_FIELDS = ["sg_p4_depo_path"]
+
+    @classmethod
+    def create_class(cls, mockgun):
+        class Shotgun(mockgun.Shotgun):
+
+            def __init__(self, *args, **kwargs):
+                mockgun.Shotgun.__init__(self, *args, **kwargs)
+                self._bench_index = {}
+                self._bench_lock = threading.Lock()
+
+            def create(self, entity_type, data, return_fields=None):
+                result = mockgun.Shotgun.create(self, entity_type, data, return_fields)
+                for field in cls.INDEXED_FIELDS:
+                    if data.get(field):
+                        index = self._bench_index.setdefault((entity_type, field), {})
+                        index.setdefault(data[field], []).append(result["id"])
+                return result
+
+            def find(self, entity_type, filters, fields=None, *args, **kwargs):
+                index = None
+                if isinstance(filters, list) and len(filters) == 1 and len(filters[0]) == 3 \
+                        and filters[0][1] == "in":
+                    index = self._bench_index.get((entity_type, filters[0][0]))
+                if index is None:
+                    return mockgun.Shotgun.find(self, entity_type, filters, fields, *args, **kwargs)
+
+                with self._bench_lock:
+                    rows = self._db[entity_type]
+                    ids = [i for value in filters[0][2] for i in index.get(value, [])]
+                    self._db[entity_type] = dict((i, rows[i]) for i in ids if i in rows)
+                    try:
+                        return mockgun.Shotgun.find(self, entity_type, filters, fields, *args, **kwargs)
+                    finally:
+                        self._db[entity_type] = rows
+
+        return Shotgun
+
+
+class BenchFramework(object):
+    """
+    The parts of the framework bundle the dialog uses
+    """
+
+    def __init__(self, bench):
+        self._bench = bench
+        self._settings = {
+            "sync_max_threads": bench.options.threads,
+            "sync_max_transfers": bench.options.transfers,
+            "sync_bandwidth_limit": 0,
+            "sync_type_priority": [],
+        }
+        self.cache_location = os.path.join(bench.work_dir, "cache")
+        self.connection = bench.package.connection
+
+    def get_setting(self, name, default=None):
+        return self._settings.get(name, default)
+
+    def log_debug(self, msg):
+        if self._bench.options.verbose:
+            sys.stderr.write("DEBUG: %s\n" % msg)
+
+    def log_info(self, msg):
+        if self._bench.options.verbose:
+            sys.stderr.write("INFO: %s\n" % msg)
+
+    def log_warning(self, msg):
+        sys.stderr.write("WARNING: %s\n" % msg)
+
+    def log_error(self, msg):
+        self._bench.errors.append(str(msg))
+        sys.stderr.write("ERROR: %s\n" % msg)
+
+
+class BenchApp(object):
+    """
+    The parts of the app the dialog is launched from that it uses
+    """
+
+    def __init__(self, bench):
+        self.shotgun = bench.shotgun
+        self._fw = bench.framework
+
+    def log_error(self, msg):
+        self._fw.log_error(msg)
+
+
+def run_once(options):
+    bench = BenchRun(options)
+    try:
+        bench.setup()
+        results = bench.run()
+    finally:
+        bench.cleanup()
+    sys.stdout.write(RESULT_PREFIX + json.dumps(results) + "\n")
+    sys.stdout.flush()
+
+
+# ---------------------------------------------------------------------------------------------
+# the runner
+# ---------------------------------------------------------------------------------------------
+
+def parse_scenario(value):
+    try:
+        files, assets = value.split(":")
+        return int(files), int(assets)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected FILES:ASSETS, e.g. 1000:20, got '%s'" % value)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the sync dialog offscreen at scale")
+    parser.add_argument("--scenario", action="append", type=parse_scenario, default=[],
+                        help="Files and assets to benchmark with, as FILES:ASSETS.  Can be repeated "
+                             "(default: %s)" % " ".join(DEFAULT_SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario (default: 3)")
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Compare the results with a previous --json output")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Relative increase over the baseline that counts as a regression (default: 0.25)")
+    parser.add_argument("--tk-core", help="Path to tk-core, if sgtk isn't importable already")
+    parser.add_argument("--mockgun-schema", help="Directory with mockgun's schema.pickle and schema_entity.pickle "
+                                                 "(default: tk-core's tests/fixtures/mockgun)")
+    parser.add_argument("--threads", type=int, default=8, help="sync_max_threads setting (default: 8)")
+    parser.add_argument("--transfers", type=int, default=4, help="sync_max_transfers setting (default: 4)")
+    parser.add_argument("--p4-latency-ms", type=float, default=10, help="Latency of each P4 command (default: 10)")
+    parser.add_argument("--p4-transfer-us", type=float, default=20,
+                        help="Time to sync a single file, in microseconds (default: 20)")
+    parser.add_argument("--publish-ratio", type=float, default=1.0,
+                        help="Fraction of the files that have a PublishedFile (default: 1.0)")
+    parser.add_argument("--heartbeat-ms", type=int, default=10, help="UI heartbeat interval (default: 10)")
+    parser.add_argument("--timeout", type=float, default=900, help="Maximum seconds per stage (default: 900)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic depot (default: 0)")
+    parser.add_argument("--verbose", action="store_true", help="Show the dialog's log output")
+    # internal: run a single scenario in this process
+    parser.add_argument("--run-once", nargs=2, type=int, metavar=("FILES", "ASSETS"), help=argparse.SUPPRESS)
+    return parser
+
+
+def run_scenario(args, files, assets):
+    """
+    Run a scenario args.repeat times, each in a new process
+
+    :returns list:    The results of each run
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--run-once", str(files), str(assets)]
+    for option in ["tk_core", "mockgun_schema", "threads", "transfers", "p4_latency_ms", "p4_transfer_us",
+                   "publish_ratio", "heartbeat_ms", "timeout", "seed"]:
+        value = getattr(args, option)
+        if value is not None:
+            command.extend(["--" + option.replace("_", "-"), str(value)])
+    if args.verbose:
+        command.append("--verbose")
+
+    runs = []
+    for run_index in range(args.repeat):
+        process = subprocess.run(command, stdout=subprocess.PIPE, universal_newlines=True, cwd=BENCH_DIR)
+        result_lines = [line for line in process.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+        if process.returncode or not result_lines:
+            raise RuntimeError("Benchmark run %d of %d:%d failed with exit code %d"
+                               % (run_index + 1, files, assets, process.returncode))
+        runs.append(json.loads(result_lines[-1][len(RESULT_PREFIX):]))
+    return runs
+
+
+def summarize(runs):
+    """
+    Combine the runs of a scenario into the median of each stage's metrics
+    """
+    summary = {"runs": len(runs), "setup_rss_mb": max(run["setup_rss_mb"] or 0 for run in runs),
+               "files_synced": min(run["files_synced"] for run in runs), "stages": {}}
+    for stage in STAGES:
+        stage_runs = [s for run in runs for s in run["stages"] if s["stage"] == stage]
+        summary["stages"][stage] = {
+            "wall_s": round(statistics.median(s["wall_s"] for s in stage_runs), 4),
+            "wall_min_s": round(min(s["wall_s"] for s in stage_runs), 4),
+            "ui_blocked_s": round(statistics.median(s["ui_blocked_s"] for s in stage_runs), 4),
+            "max_stall_ms": max(s["max_stall_ms"] for s in stage_runs),
+            "peak_rss_mb": max(s["peak_rss_mb"] or 0 for s in stage_runs),
+            # the signal counts are deterministic apart from timing-driven batching
+            "slot_calls": stage_runs[-1]["slot_calls"],
+            "model_signals": stage_runs[-1]["model_signals"],
+            "errors": sum(len(s["errors"]) for s in stage_runs),
+            "timed_out": any(s["timed_out"] for s in stage_runs),
+            "failed": next((s["failed"] for s in stage_runs if s["failed"]), None),
+        }
+    return summary
+
+
+def print_summary(name, summary):
+    sys.stdout.write("\n%s files:assets, %d runs, %.1f MB after setup, %d files synced\n"
+                     % (name, summary["runs"], summary["setup_rss_mb"], summary["files_synced"]))
+    sys.stdout.write("  %-15s %10s %12s %12s %10s %10s %8s\n"
+                     % ("stage", "wall s", "ui blocked s", "max stall ms", "rss MB", "slot calls", "errors"))
+    for stage in STAGES:
+        metrics = summary["stages"][stage]
+        flags = " TIMED OUT" if metrics["timed_out"] else ""
+        flags += " FAILED: %s" % metrics["failed"] if metrics["failed"] else ""
+        sys.stdout.write("  %-15s %10.3f %12.3f %12.1f %10.1f %10d %8d%s\n"
+                         % (stage, metrics["wall_s"], metrics["ui_blocked_s"], metrics["max_stall_ms"],
+                            metrics["peak_rss_mb"], sum(metrics["slot_calls"].values()), metrics["errors"], flags))
+
+
+def compare(results, baseline, tolerance):
+    """
+    :returns list:    Descriptions of the metrics that regressed compared to the baseline
+    """
+    regressions = []
+    for name, summary in results.items():
+        base_summary = baseline.get(name)
+        if not base_summary:
+            continue
+        for stage in STAGES:
+            for metric, minimum_change in COMPARED_METRICS.items():
+                value = summary["stages"][stage][metric]
+                base_value = base_summary["stages"].get(stage, {}).get(metric)
+                if base_value is None:
+                    continue
+                if value > base_value * (1 + tolerance) and value - base_value >= minimum_change:
+                    regressions.append("%s %s %s: %s -> %s" % (name, stage, metric, base_value, value))
+    return regressions
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.run_once:
+        args.files, args.assets = args.run_once
+        run_once(args)
+        return 0
+
+    results = {}
+    failed = False
+    for files, assets in args.scenario or [parse_scenario(s) for s in DEFAULT_SCENARIOS]:
+        name = "%d:%d" % (files, assets)
+        summary = summarize(run_scenario(args, files, assets))
+        results[name] = summary
+        print_summary(name, summary)
+        failed = failed or any(m["errors"] or m["timed_out"] or m["failed"] for m in summary["stages"].values())
+
+    if args.json:
+        with open(args.json, "w") as file_obj:
+            json.dump(results, file_obj, indent=4, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, "r") as file_obj:
+            regressions = compare(results, json.load(file_obj), args.tolerance)
+        for regression in regressions:
+            sys.stdout.write("REGRESSION %s\n" % regression)
+        failed = failed or bool(regressions)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
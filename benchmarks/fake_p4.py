@@ -0,0 +1,240 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Synthetic Perforce depot and connection used by the sync dialog benchmarks.  The
+connection answers the commands the sync stack runs ('changes', 'sync -n' and 'sync')
+from an in-memory depot, with a configurable latency per command and transfer time per
+file, and honours the OutputHandler and Progress contracts of P4Python so cancellation
+and per-file reporting behave as they do against a server.
+"""
+
+import random
+import threading
+import time
+
+from P4 import OutputHandler
+
+EXTENSIONS = ["ma", "mb", "fbx", "abc", "png", "exr", "tif", "json"]
+STEPS = ["Model", "Rig", "Surface", "Anim", "FX", "Light"]
+PUBLISH_TYPES = ["Maya Scene", "Alembic Cache", "FBX", "Texture", "Image"]
+
+# file sizes in bytes, picked with the weights below so that most files are small
+FILE_SIZES = [4 * 1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024, 256 * 1024 * 1024]
+FILE_SIZE_WEIGHTS = [40, 30, 20, 8, 2]
+
+WORKSPACE_ROOT = "/bench/workspace"
+DEPOT_ROOT = "//depot"
+
+
+class FakeDepot(object):
+    """
+    Deterministic set of assets and files, and the revision the workspace has of each
+    """
+
+    def __init__(self, file_count, asset_count, seed=0):
+        """
+        :param file_count:     Total number of files, spread evenly over the assets
+        :param asset_count:    Number of assets
+        :param seed:           Seed for the sizes, revisions and types of the files
+        """
+        rng = random.Random(seed)
+        self.head_change = 100000
+        self.assets = []
+        # local path -> file record
+        self.files = {}
+        # root directory of each asset -> its file records
+        self._files_by_root = {}
+        self._have = {}
+        self._lock = threading.Lock()
+
+        asset_count = max(1, asset_count)
+        for asset_index in range(asset_count):
+            code = "asset_%05d" % asset_index
+            root = "%s/assets/%s/" % (WORKSPACE_ROOT, code)
+            self.assets.append({"code": code, "root": root})
+            self._files_by_root[root] = []
+
+        for file_index in range(file_count):
+            asset = self.assets[file_index % asset_count]
+            step = STEPS[rng.randrange(len(STEPS))]
+            ext = EXTENSIONS[rng.randrange(len(EXTENSIONS))]
+            relative_path = "%s/file_%07d.%s" % (step.lower(), file_index, ext)
+            record = {
+                "clientFile": asset["root"] + relative_path,
+                "depotFile": "%s/assets/%s/%s" % (DEPOT_ROOT, asset["code"], relative_path),
+                "rev": str(rng.randint(1, 20)),
+                "fileSize": str(rng.choices(FILE_SIZES, FILE_SIZE_WEIGHTS)[0]),
+                "action": rng.choice(["added", "updated"]),
+                "asset": asset["code"],
+                "step": step,
+                "type": PUBLISH_TYPES[EXTENSIONS.index(ext) % len(PUBLISH_TYPES)],
+            }
+            self.files[record["clientFile"]] = record
+            self._files_by_root[asset["root"]].append(record)
+
+    def root_path(self, asset):
+        """
+        :returns str:    The root the sync dialog scans for an asset
+        """
+        return asset["root"] + "..."
+
+    def files_under(self, root):
+        """
+        :returns list:    The file records under a local directory
+        """
+        if root in self._files_by_root:
+            return self._files_by_root[root]
+        return [record for path, record in self.files.items() if path.startswith(root)]
+
+    def needs_sync(self, record, force=False):
+        with self._lock:
+            return force or self._have.get(record["clientFile"]) != record["rev"]
+
+    def mark_synced(self, record):
+        with self._lock:
+            self._have[record["clientFile"]] = record["rev"]
+
+
+class FakeP4(object):
+    """
+    Stands in for a connected P4 instance
+    """
+
+    def __init__(self, depot, latency=0.01, transfer_time=0.00002):
+        """
+        :param depot:            The FakeDepot to answer commands from
+        :param latency:          Seconds added to every command
+        :param transfer_time:    Seconds it takes to sync a single file
+        """
+        self.depot = depot
+        self.latency = latency
+        self.transfer_time = transfer_time
+
+        self.port = "bench:1666"
+        self.client = "bench_workspace"
+        self.user = "bench"
+        self.handler = None
+        self.progress = None
+        self.errors = []
+        self.warnings = []
+        self.exception_level = 1
+        self._connected = True
+
+    def connected(self):
+        return self._connected
+
+    def disconnect(self):
+        self._connected = False
+
+    def run_changes(self, *args):
+        time.sleep(self.latency)
+        return [{"change": str(self.depot.head_change)}]
+
+    def run(self, command, *args):
+        if command == "sync":
+            return self.run_sync(*args)
+        if command == "changes":
+            return self.run_changes(*args)
+        raise NotImplementedError("The benchmark backend doesn't implement 'p4 %s'" % command)
+
+    def run_sync(self, *args):
+        flags, paths = self._split_args(args)
+        time.sleep(self.latency)
+        if "-n" in flags:
+            return self._dry_run(paths, force="-f" in flags)
+        return self._sync(paths, force="-f" in flags)
+
+    @staticmethod
+    def _split_args(args):
+        flags = []
+        paths = []
+        for arg in args:
+            for value in (arg if isinstance(arg, (list, tuple)) else [arg]):
+                (flags if value.startswith("-") else paths).append(value)
+        return flags, paths
+
+    def _dry_run(self, paths, force=False):
+        output = []
+        # like the server, roots without files are reported as warnings
+        self.warnings = []
+        for path in paths:
+            path = path.split("#")[0]
+            if path.endswith("..."):
+                records = self.depot.files_under(path[:-3])
+            else:
+                records = [self.depot.files[path]] if path in self.depot.files else []
+            if not records:
+                self.warnings.append("%s - no such file(s)." % path)
+                continue
+            for record in records:
+                if self.depot.needs_sync(record, force):
+                    output.append(self._stat(record))
+        return self._output(output)
+
+    def _sync(self, paths, force=False):
+        output = []
+        transfer_debt = 0.0
+        for position, path in enumerate(paths):
+            if self.progress and self.progress.update(position):
+                break
+            record = self.depot.files.get(path)
+            if record is None:
+                output.append("%s - no such file(s)." % path)
+                continue
+            if not self.depot.needs_sync(record, force):
+                continue
+
+            # sleep in slices of a few ms rather than per file
+            transfer_debt += self.transfer_time
+            if transfer_debt >= 0.002:
+                time.sleep(transfer_debt)
+                transfer_debt = 0.0
+
+            self.depot.mark_synced(record)
+            if not self._emit(self._stat(record), output):
+                break
+        return output
+
+    def _output(self, items):
+        output = []
+        for item in items:
+            if not self._emit(item, output):
+                break
+        return output
+
+    def _emit(self, item, output):
+        """
+        Pass an output item through the handler, like P4Python does.
+
+        :returns bool:    False if the handler cancelled the command
+        """
+        if self.handler is None:
+            output.append(item)
+            return True
+        if isinstance(item, dict):
+            result = self.handler.outputStat(item)
+        else:
+            result = self.handler.outputMessage(item)
+        if result == OutputHandler.CANCEL:
+            return False
+        if result != OutputHandler.HANDLED:
+            output.append(item)
+        return True
+
+    @staticmethod
+    def _stat(record):
+        return {
+            "clientFile": record["clientFile"],
+            "depotFile": record["depotFile"],
+            "rev": record["rev"],
+            "fileSize": record["fileSize"],
+            "action": record["action"],
+        }
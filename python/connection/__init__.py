@@ -8,4 +8,6 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights 
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
-from .connection import connect, connect_with_dialog
\ No newline at end of file
+from .connection import connect, connect_with_dialog
+from .pool import ConnectionPool
+from .provider import ThreadConnectionProvider, ThreadBoundConnection
\ No newline at end of file
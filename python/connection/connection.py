@@ -26,7 +26,7 @@ from sgtk.platform.qt import QtGui
 from P4 import P4, P4Exception
 
 from .user_settings import UserSettings
-from ..util.progress import ProgressHandler
+from ..util.progress import ProgressHandler, ProgressAggregator
 
 logger = sgtk.platform.get_logger(__name__)
 
@@ -989,13 +989,16 @@ def connect(allow_ui=True, user=None, password=None, workspace=None, progress=No
     :param password:    If specified, this will be used to log in the Perforce user
     :param workspace:   If specified, this will be used as the workspace for the Perforce user.  If
                         set to '' then no workspace will be set for the new connection
+    :param progress:    If True, a ProgressHandler is attached to the connection.  If a
+                        ProgressAggregator is passed, the handler forwards its updates to it
     :returns P4:        A new Perforce connection instance if successful
     """
     fw = sgtk.platform.current_bundle()
     try:
         connection = ConnectionHandler(fw).connect(allow_ui, user, password, workspace)
         if progress:
-            connection.progress = ProgressHandler()
+            aggregator = progress if isinstance(progress, ProgressAggregator) else None
+            connection.progress = ProgressHandler(aggregator)
         return connection
     except SgtkP4TCPConnectionError:
         raise
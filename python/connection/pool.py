@@ -0,0 +1,144 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Pooling of Perforce connections for use by concurrent workers
+"""
+
+import threading
+from contextlib import contextmanager
+
+import sgtk
+from sgtk import TankError
+
+logger = sgtk.platform.get_logger(__name__)
+
+
+class ConnectionPool(object):
+    """
+    A pool of connected P4 instances.  P4 objects aren't safe to share between
+    threads so each connection is handed out to a single caller at a time and
+    returned to the pool when the caller is done with it.  This avoids paying
+    for a new connection (and the server lookups it involves) per worker.
+    """
+
+    def __init__(self, max_idle=None, **connect_kwargs):
+        """
+        :param max_idle:          Maximum number of idle connections to keep around.
+                                  Extra connections are disconnected when released.
+                                  None keeps all of them
+        :param connect_kwargs:    Keyword arguments passed to connect() when a new
+                                  connection is needed
+        """
+        self._max_idle = max_idle
+        self._connect_kwargs = connect_kwargs
+        self._lock = threading.Lock()
+        self._idle = []
+        self._in_use = set()
+        # connections to disconnect, rather than keep, when they're released
+        self._draining = set()
+        self._closed = False
+
+    @property
+    def size(self):
+        """
+        Total number of connections currently owned by the pool
+        """
+        with self._lock:
+            return len(self._idle) + len(self._in_use)
+
+    def acquire(self):
+        """
+        Take a connection from the pool, connecting a new one if none are idle.
+
+        :returns P4:    A connected P4 instance
+        :raises:        TankError if the pool has been closed or connecting fails
+        """
+        with self._lock:
+            if self._closed:
+                raise TankError("Perforce: Connection pool has been closed!")
+            while self._idle:
+                p4 = self._idle.pop()
+                if p4.connected():
+                    self._in_use.add(p4)
+                    return p4
+
+        # connect outside of the lock as this can be slow:
+        from .connection import connect
+        p4 = connect(**self._connect_kwargs)
+        if not p4:
+            raise TankError("Perforce: Failed to connect!")
+
+        with self._lock:
+            self._in_use.add(p4)
+        return p4
+
+    def release(self, p4):
+        """
+        Return a connection to the pool.
+
+        :param p4:    A P4 instance previously returned by acquire()
+        """
+        with self._lock:
+            self._in_use.discard(p4)
+            draining = p4 in self._draining
+            self._draining.discard(p4)
+            keep = (not self._closed and not draining and p4.connected()
+                    and (self._max_idle is None or len(self._idle) < self._max_idle))
+            if keep:
+                self._idle.append(p4)
+                return
+        self._disconnect(p4)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that acquires a connection and releases it on exit:
+
+            with pool.connection() as p4:
+                p4.run_sync(...)
+        """
+        p4 = self.acquire()
+        try:
+            yield p4
+        finally:
+            self.release(p4)
+
+    def drain(self):
+        """
+        Disconnect all idle connections and have the ones in use disconnected when they are
+        released, e.g. after commands were cancelled.  Unlike close(), the pool can still be
+        used and makes new connections as they're needed.
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+            self._draining.update(self._in_use)
+        for p4 in idle:
+            self._disconnect(p4)
+
+    def close(self):
+        """
+        Disconnect all idle connections.  Connections that are still in use are
+        disconnected when they are released.
+        """
+        with self._lock:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+        for p4 in idle:
+            self._disconnect(p4)
+
+    def _disconnect(self, p4):
+        try:
+            if p4.connected():
+                p4.disconnect()
+        except Exception as e:
+            logger.debug("Failed to disconnect pooled connection: %s" % e)
@@ -0,0 +1,222 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Per-thread Perforce connections for workers running on a thread pool
+"""
+
+import threading
+import weakref
+from contextlib import contextmanager
+
+import sgtk
+from sgtk import TankError
+
+logger = sgtk.platform.get_logger(__name__)
+
+
+class ThreadBoundConnection(object):
+    """
+    Wraps a P4 instance and raises a TankError when it's used from any thread but the one
+    that owns it, as P4 objects aren't safe to share between threads.
+    """
+
+    def __init__(self, p4, owner):
+        """
+        :param p4:       The connected P4 instance
+        :param owner:    Identifier of the owning thread, see threading.get_ident()
+        """
+        object.__setattr__(self, "_p4", p4)
+        object.__setattr__(self, "_owner", owner)
+
+    def _check_thread(self):
+        current = threading.get_ident()
+        if current != self._owner:
+            raise TankError("Perforce: Connection of thread %s used from thread %s!" % (self._owner, current))
+
+    def __getattr__(self, name):
+        self._check_thread()
+        return getattr(self._p4, name)
+
+    def __setattr__(self, name, value):
+        self._check_thread()
+        setattr(self._p4, name, value)
+
+
+class _ThreadConnection(object):
+    """
+    The connection owned by a single thread
+    """
+
+    def __init__(self, p4, owner, generation):
+        self.raw = p4
+        self.p4 = ThreadBoundConnection(p4, owner)
+        self.owner = owner
+        self.generation = generation
+        self.depth = 0
+        self.dropped = False
+
+
+class ThreadConnectionProvider(object):
+    """
+    Hands each thread its own Perforce connection, which it keeps for its lifetime and
+    reuses for every task it runs, rather than connecting per task.  It can be used
+    wherever a ConnectionPool is, e.g. by the QRunnables of a QThreadPool:
+
+        with provider.connection() as p4:
+            p4.run_sync(...)
+
+    Connections are wrapped in a ThreadBoundConnection so that one leaking to another
+    thread is caught.  Threads should live as long as the provider (e.g. a QThreadPool
+    with no expiry timeout) and close() is called once the thread pool has shut down.
+    """
+
+    def __init__(self, **connect_kwargs):
+        """
+        :param connect_kwargs:    Keyword arguments passed to connect() when a thread
+                                  needs a connection
+        """
+        self._connect_kwargs = connect_kwargs
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # the connections of the threads, a thread's connection is dropped from here and
+        # disconnected when the thread exits and its thread-local state goes away
+        self._connections = weakref.WeakSet()
+        # bumped by drain(), connections of an older generation are replaced
+        self._generation = 0
+        self._closed = False
+
+    @property
+    def size(self):
+        """
+        Number of threads currently holding a connection
+        """
+        with self._lock:
+            return len(self._connections)
+
+    def acquire(self):
+        """
+        Get the calling thread's connection, connecting it the first time or when it was
+        dropped.  Calls can be nested, each one is matched by a release().
+
+        :returns ThreadBoundConnection:    The connected P4 instance of the calling thread
+        :raises:                           TankError if the provider has been closed or connecting fails
+        """
+        state = getattr(self._local, "state", None)
+        stale = None
+        with self._lock:
+            if self._closed:
+                raise TankError("Perforce: Connection provider has been closed!")
+            if state is not None and state.depth == 0 and (
+                    state.dropped or state.generation != self._generation):
+                self._connections.discard(state)
+                stale, state = state, None
+            elif state is not None:
+                # taken under the lock so that drain() and close() leave it alone
+                state.depth += 1
+            generation = self._generation
+
+        if state is not None and state.depth == 1 and not state.raw.connected():
+            # the connection broke since the thread last used it
+            with self._lock:
+                state.depth = 0
+                self._connections.discard(state)
+            stale, state = state, None
+
+        if stale is not None:
+            self._local.state = None
+            self._disconnect(stale.raw)
+
+        if state is None:
+            # connect outside of the lock as this can be slow:
+            from .connection import connect
+            p4 = connect(**self._connect_kwargs)
+            if not p4:
+                raise TankError("Perforce: Failed to connect!")
+            state = self._local.state = _ThreadConnection(p4, threading.get_ident(), generation)
+            weakref.finalize(state, self._disconnect, p4)
+            with self._lock:
+                state.depth = 1
+                self._connections.add(state)
+        return state.p4
+
+    def release(self, p4):
+        """
+        Hand back a connection returned by acquire().  The thread keeps it for its next
+        task, unless the provider was drained or closed in the meantime.
+
+        :param p4:    The connection returned by acquire()
+        :raises:      TankError if the connection isn't owned by the calling thread
+        """
+        state = getattr(self._local, "state", None)
+        if state is None or state.p4 is not p4 or state.depth == 0:
+            raise TankError("Perforce: Connection released by thread %s, which doesn't hold it!"
+                            % threading.get_ident())
+        with self._lock:
+            state.depth -= 1
+            drop = state.depth == 0 and (self._closed or state.generation != self._generation)
+            if drop:
+                self._connections.discard(state)
+        if drop:
+            self._local.state = None
+            self._disconnect(state.raw)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that acquires the calling thread's connection and releases it on exit
+        """
+        p4 = self.acquire()
+        try:
+            yield p4
+        finally:
+            self.release(p4)
+
+    def drain(self):
+        """
+        Disconnect the connections that aren't in use and have the ones in use disconnected
+        when they are released, e.g. after commands were cancelled.  Threads connect again
+        the next time they need to.
+        """
+        with self._lock:
+            self._generation += 1
+            idle = self._take_idle()
+        for state in idle:
+            self._disconnect(state.raw)
+
+    def close(self):
+        """
+        Disconnect all connections that aren't in use, the ones still in use are
+        disconnected by their threads when they are released.
+        """
+        with self._lock:
+            self._closed = True
+            idle = self._take_idle()
+        for state in idle:
+            self._disconnect(state.raw)
+
+    def _take_idle(self):
+        """
+        Remove the connections that aren't in use from the provider, called with the lock held.
+        Their threads are idle, so they can be disconnected from the calling thread.
+        """
+        idle = [state for state in self._connections if state.depth == 0]
+        for state in idle:
+            state.dropped = True
+            self._connections.discard(state)
+        return idle
+
+    @staticmethod
+    def _disconnect(p4):
+        try:
+            if p4.connected():
+                p4.disconnect()
+        except Exception as e:
+            logger.debug("Failed to disconnect thread connection: %s" % e)
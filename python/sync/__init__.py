@@ -8,4 +8,6 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights 
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
-from .sync import  sync_with_dialog # connect,
\ No newline at end of file
+from .sync import  sync_with_dialog # connect,
+from .engine import SyncEngine, SyncReport
+from .cli import main as run_cli
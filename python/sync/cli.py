@@ -0,0 +1,185 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Command line interface to the headless sync engine.  Progress is written to stdout
+as one JSON object per line and the exit code reflects the outcome of the sync:
+
+    0    everything was synced (or was already up to date)
+    1    the sync could not run, e.g. Perforce could not be connected to
+    2    invalid arguments
+    3    some entities could not be resolved or have nothing in the depot
+    4    some files failed to sync
+    5    the sync was cancelled (SIGINT or SIGTERM)
+
+This is run from a bootstrapped toolkit session, see scripts/p4_sync.py
+"""
+
+import argparse
+import json
+import signal
+import sys
+import traceback
+
+import sgtk
+
+from .engine import SyncEngine, DEFAULT_MAX_WORKERS
+from .scheduler import SyncPriority
+from .concurrency import DEFAULT_FLOOR, DEFAULT_CEILING, DEFAULT_TARGET_LATENCY
+
+logger = sgtk.platform.get_logger(__name__)
+
+EXIT_SUCCESS = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_ENTITIES_FAILED = 3
+EXIT_FILES_FAILED = 4
+EXIT_CANCELLED = 5
+
+
+def _entity_arg(value):
+    """
+    Parse an entity given as Type:id
+    """
+    try:
+        entity_type, entity_id = value.rsplit(":", 1)
+        return {"type": entity_type, "id": int(entity_id)}
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected Type:id, e.g. Asset:1234, got '%s'" % value)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="p4_sync",
+                                     description="Sync the Perforce files of ShotGrid entities without a UI")
+    parser.add_argument("-e", "--entity", action="append", type=_entity_arg, default=[],
+                        help="Entity to sync, as Type:id (e.g. Asset:1234).  Can be repeated")
+    parser.add_argument("-p", "--published-file", action="append", type=int, default=[],
+                        help="Id of a PublishedFile to sync.  Can be repeated")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Force the sync of files that are already up to date")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="Only report what would be synced")
+    parser.add_argument("-j", "--threads", type=int, default=None,
+                        help="Maximum number of concurrent scans and syncs (default: sync_max_threads setting)")
+    parser.add_argument("-t", "--max-transfers", type=int, default=None,
+                        help="Maximum number of batches synced at once, the number adapts to the load of "
+                             "the server up to this (default: sync_max_transfers setting)")
+    parser.add_argument("--min-transfers", type=int, default=None,
+                        help="Number of batches synced at once however busy the server is "
+                             "(default: sync_min_transfers setting)")
+    parser.add_argument("-b", "--bandwidth-limit", type=int, default=None,
+                        help="Maximum overall sync rate in MB per second (default: sync_bandwidth_limit setting)")
+    parser.add_argument("-u", "--user", help="Perforce user, defaults to the one mapped from the ShotGrid user")
+    parser.add_argument("-w", "--workspace", help="Perforce workspace to sync into")
+    return parser
+
+
+def _write_event(event):
+    sys.stdout.write(json.dumps(event, default=str) + "\n")
+    sys.stdout.flush()
+
+
+def _cancel_on_signals(engine):
+    """
+    Cancel the sync on SIGINT and SIGTERM, so that running syncs are stopped and the
+    files that completed are still reported
+
+    :returns dict:    The previous handlers, to restore with _restore_signals
+    """
+    def handle_signal(signum, frame):
+        _write_event({"event": "cancelling", "signal": signum})
+        engine.cancel()
+
+    previous_handlers = {}
+    for signum in [signal.SIGINT, getattr(signal, "SIGTERM", None)]:
+        if signum is None:
+            continue
+        try:
+            previous_handlers[signum] = signal.signal(signum, handle_signal)
+        except ValueError:
+            # signals can only be handled from the main thread
+            pass
+    return previous_handlers
+
+
+def _restore_signals(previous_handlers):
+    for signum, handler in previous_handlers.items():
+        signal.signal(signum, handler)
+
+
+def main(argv=None, app=None):
+    """
+    Run a headless sync.
+
+    :param argv:    Command line arguments, defaults to sys.argv[1:]
+    :param app:     The bundle to run the sync with, defaults to this framework
+    :returns int:   The exit code
+    """
+    parser = build_parser()
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:
+        return EXIT_USAGE if e.code else EXIT_SUCCESS
+
+    if not args.entity and not args.published_file:
+        parser.print_usage(sys.stderr)
+        sys.stderr.write("p4_sync: error: nothing to sync, use --entity or --published-file\n")
+        return EXIT_USAGE
+
+    fw = sgtk.platform.current_bundle()
+    app = app or fw
+    connection_pool = None
+    try:
+        entities = list(args.entity)
+        if args.published_file:
+            published_files = app.shotgun.find("PublishedFile", [["id", "in", args.published_file]],
+                                               ["code", "path_cache", "entity"])
+            missing = set(args.published_file) - set(p["id"] for p in published_files)
+            if missing:
+                _write_event({"event": "error", "error": "PublishedFiles not found: %s" % sorted(missing)})
+            entities.extend(published_files)
+
+        threads = args.threads or fw.get_setting("sync_max_threads", DEFAULT_MAX_WORKERS)
+        max_transfers = args.max_transfers or fw.get_setting("sync_max_transfers", DEFAULT_CEILING)
+        min_transfers = args.min_transfers or fw.get_setting("sync_min_transfers", DEFAULT_FLOOR)
+        bandwidth_limit = args.bandwidth_limit
+        if bandwidth_limit is None:
+            bandwidth_limit = fw.get_setting("sync_bandwidth_limit", 0)
+        connection_pool = fw.connection.ConnectionPool(allow_ui=False, user=args.user, workspace=args.workspace)
+        engine = SyncEngine(app, connection_pool,
+                            force=args.force,
+                            dry_run=args.dry_run,
+                            max_workers=threads,
+                            max_transfers=max_transfers,
+                            min_transfers=min_transfers,
+                            target_latency=fw.get_setting("sync_target_latency", DEFAULT_TARGET_LATENCY),
+                            bandwidth_limit=bandwidth_limit * 1024 * 1024 or None,
+                            priority=SyncPriority(type_order=fw.get_setting("sync_type_priority", [])),
+                            on_event=_write_event)
+        previous_handlers = _cancel_on_signals(engine)
+        try:
+            report = engine.run(entities)
+        finally:
+            _restore_signals(previous_handlers)
+    except Exception as e:
+        logger.debug(traceback.format_exc())
+        _write_event({"event": "error", "error": str(e)})
+        return EXIT_ERROR
+    finally:
+        if connection_pool:
+            connection_pool.close()
+
+    if report.cancelled:
+        return EXIT_CANCELLED
+    if report.files_failed:
+        return EXIT_FILES_FAILED
+    if report.entity_errors or (args.published_file and len(entities) < len(args.entity) + len(args.published_file)):
+        return EXIT_ENTITIES_FAILED
+    return EXIT_SUCCESS
@@ -0,0 +1,270 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Adaptive limit on the number of Perforce commands run at the same time, following the
+load of the server
+"""
+
+import threading
+import time
+
+import sgtk
+
+logger = sgtk.platform.get_logger(__name__)
+
+DEFAULT_FLOOR = 1
+DEFAULT_CEILING = 16
+DEFAULT_INITIAL = 4
+
+# seconds a command may take to get its first answer from the server before the server
+# is considered to be under load
+DEFAULT_TARGET_LATENCY = 2.0
+
+# the limit is multiplied by this when the server is under load
+DEFAULT_BACKOFF = 0.5
+
+# after the limit went down, slow commands are ignored for this many seconds as they
+# were most likely started before it did
+DEFAULT_COOLDOWN = 5.0
+
+# weight of the latest command in the average latency reported by the metrics
+LATENCY_SMOOTHING = 0.2
+
+# messages the server answers with when it's out of resources or hits one of its limits
+# (see 'p4 help maxresults', 'p4 help maxscanrows', 'p4 help maxlocktime', ...), lowercase
+OVERLOAD_MESSAGES = [
+    "request too large",
+    "too many rows scanned",
+    "operation took too long",
+    "exceeded maxlocktime",
+    "too many concurrent commands",
+    "server is too busy",
+    "see 'p4 help maxresults'",
+    "see 'p4 help maxscanrows'",
+    "see 'p4 help maxlocktime'",
+    "see 'p4 help maxopenfiles'",
+    "see 'p4 help maxmemory'",
+]
+
+# generic code of the Perforce errors above, see P4.Message.generic
+EV_TOOBIG = 0x27
+
+
+def is_overload_error(error):
+    """
+    :param error:     An exception, error message or P4.Message from Perforce
+    :returns bool:    True if the error means the server is overloaded or hit a resource limit
+    """
+    if getattr(error, "generic", None) == EV_TOOBIG:
+        return True
+    for line in str(error).lower().splitlines():
+        # per-file errors read '<path> - <message>', the path must not be matched against
+        _, _, message = line.rpartition(" - ")
+        if any(overload in message for overload in OVERLOAD_MESSAGES):
+            return True
+    return False
+
+
+class LatencyProbe(object):
+    """
+    Times a command until the server's first answer and keeps the first error it reported,
+    to feed a ConcurrencyController.  For a sync the first answer is the first file starting
+    to transfer or being reported, so the time it takes to transfer the files isn't included
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.answered_at = None
+        self.error = None
+
+    def answered(self, error=None):
+        """
+        Record an answer from the server, e.g. a transfer starting or a file being synced
+        or failing
+        """
+        if self.answered_at is None:
+            self.answered_at = time.monotonic()
+        if error and self.error is None:
+            self.error = error
+
+    @property
+    def latency(self):
+        return (self.answered_at or time.monotonic()) - self.started
+
+
+class ConcurrencyController(object):
+    """
+    Additive increase, multiplicative decrease (AIMD) control of the number of commands
+    run at the same time.  Every command that gets its first answer within the target
+    latency raises the limit by 1/limit, so about one step per round of commands.  A slow
+    command or an overload error halves it, at most once per cooldown period.  The limit
+    stays between the floor and the ceiling.
+
+    Callers run at most `limit` commands at once (e.g. SyncScheduler) and report each one
+    with record().  Listeners added with add_listener() are called with metrics() whenever
+    the limit changes.
+    """
+
+    def __init__(self, floor=DEFAULT_FLOOR, ceiling=DEFAULT_CEILING, initial=DEFAULT_INITIAL,
+                 target_latency=DEFAULT_TARGET_LATENCY, backoff=DEFAULT_BACKOFF, cooldown=DEFAULT_COOLDOWN):
+        """
+        :param floor:             Lowest limit
+        :param ceiling:           Highest limit
+        :param initial:           Limit to start from
+        :param target_latency:    Seconds to the first answer above which a command counts as slow
+        :param backoff:           Factor the limit is multiplied by when the server is under load
+        :param cooldown:          Minimum seconds between two decreases
+        """
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.backoff = backoff
+        self.cooldown = cooldown
+
+        self.floor = None
+        self.ceiling = None
+        self.target_latency = None
+        self._limit = initial
+        self.configure(floor, ceiling, target_latency)
+
+        self._credit = 0.0
+        self._last_decrease = None
+        self._latency = None
+        self._commands = 0
+        self._increases = 0
+        self._decreases = 0
+        self._overloads = 0
+
+    @property
+    def limit(self):
+        """
+        The number of commands that may run at the same time
+        """
+        with self._lock:
+            return self._limit
+
+    def configure(self, floor=None, ceiling=None, target_latency=None):
+        """
+        Change the settings, e.g. when they were changed since the controller was made.
+        The limit is moved into the new floor and ceiling.
+        """
+        with self._lock:
+            if floor is not None:
+                self.floor = max(1, int(floor))
+            if ceiling is not None:
+                self.ceiling = max(self.floor, int(ceiling))
+            if target_latency is not None:
+                self.target_latency = float(target_latency)
+            self.ceiling = max(self.floor, self.ceiling)
+            self._limit = min(self.ceiling, max(self.floor, self._limit))
+
+    def record(self, latency, error=None):
+        """
+        Adjust the limit for a finished command.
+
+        :param latency:    Seconds the command took to get its first answer from the server
+        :param error:      The error the command failed with, if any
+        """
+        with self._lock:
+            previous = self._limit
+            now = time.monotonic()
+            self._commands += 1
+            if latency is not None:
+                self._latency = latency if self._latency is None else \
+                    LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self._latency
+
+            overloaded = error is not None and is_overload_error(error)
+            if overloaded:
+                self._overloads += 1
+            if overloaded or (latency is not None and latency > self.target_latency):
+                if self._last_decrease is None or now - self._last_decrease >= self.cooldown:
+                    self._limit = max(self.floor, int(self._limit * self.backoff))
+                    self._last_decrease = now
+                    self._credit = 0.0
+            elif error is None:
+                self._credit += 1.0 / self._limit
+                if self._credit >= 1.0:
+                    self._credit -= 1.0
+                    self._limit = min(self.ceiling, self._limit + 1)
+
+            changed = self._limit != previous
+            if changed:
+                if self._limit > previous:
+                    self._increases += 1
+                else:
+                    self._decreases += 1
+            listeners = list(self._listeners) if changed else []
+
+        if changed:
+            metrics = self.metrics()
+            logger.debug("Concurrency limit %d -> %d (latency %.2fs%s)"
+                         % (previous, metrics["limit"], latency or 0, ", overloaded" if overloaded else ""))
+            for listener in listeners:
+                try:
+                    listener(metrics)
+                except Exception as e:
+                    logger.warning("Failed to report concurrency metrics: %s" % e)
+
+    def metrics(self):
+        """
+        :returns dict:    The current limit, its bounds and the counters that drove it
+        """
+        with self._lock:
+            return {
+                "limit": self._limit,
+                "floor": self.floor,
+                "ceiling": self.ceiling,
+                "latency": round(self._latency, 3) if self._latency is not None else None,
+                "commands": self._commands,
+                "increases": self._increases,
+                "decreases": self._decreases,
+                "overloads": self._overloads,
+            }
+
+    def add_listener(self, listener):
+        """
+        :param listener:    Callable(dict) called with metrics() whenever the limit changes.
+                            It's called from the thread that recorded the command
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+
+_g_controllers = {}
+_g_controllers_lock = threading.Lock()
+
+
+def get_concurrency_controller(server, floor=DEFAULT_FLOOR, ceiling=DEFAULT_CEILING,
+                               target_latency=DEFAULT_TARGET_LATENCY):
+    """
+    Return the session-wide controller for a server, so that what was learnt about its
+    load carries over from one sync to the next.  The settings are applied to an existing
+    controller.
+
+    :param server:            The Perforce server (p4.port)
+    :param floor:             Lowest limit
+    :param ceiling:           Highest limit
+    :param target_latency:    Seconds to the first answer above which a command counts as slow
+    :returns:                 A ConcurrencyController instance
+    """
+    with _g_controllers_lock:
+        controller = _g_controllers.get(server)
+        if controller is None:
+            controller = _g_controllers[server] = ConcurrencyController(
+                floor=floor, ceiling=ceiling, target_latency=target_latency,
+                initial=min(ceiling, max(floor, DEFAULT_INITIAL)))
+            return controller
+    controller.configure(floor, ceiling, target_latency)
+    return controller
@@ -0,0 +1,440 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Headless sync of ShotGrid entities, for use without the sync dialog (e.g. on farm
+nodes and build agents)
+"""
+
+import threading
+import time
+import traceback
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+import sgtk
+from sgtk import TankError
+
+from .resolver import resolve_many, published_file_path
+from .planner import SyncPlanner, PLAN_ITEMS, PLAN_NO_FILES, PLAN_ERROR
+from .scan_cache import get_scan_cache, get_highest_change
+from .executor import run_sync_batch, SyncCancelled, STATUS_SYNCED, STATUS_UP_TO_DATE, STATUS_ERROR, STATUS_CANCELLED
+from .scheduler import SyncScheduler
+from .concurrency import get_concurrency_controller, LatencyProbe, DEFAULT_FLOOR, DEFAULT_CEILING, DEFAULT_TARGET_LATENCY
+from ..util.progress import ProgressAggregator
+
+logger = sgtk.platform.get_logger(__name__)
+
+DEFAULT_MAX_WORKERS = 8
+
+# seconds between the progress events of a sync
+PROGRESS_INTERVAL = 0.1
+
+# per-entity statuses reported by the engine
+ENTITY_ERROR = "error"
+ENTITY_NOT_IN_DEPOT = "not-in-depot"
+ENTITY_UP_TO_DATE = "up-to-date"
+ENTITY_SYNCED = "synced"
+ENTITY_PLANNED = "planned"
+ENTITY_FAILED = "failed"
+ENTITY_CANCELLED = "cancelled"
+
+
+class EntitySyncState(object):
+    """
+    The progress of the sync for a single entity
+    """
+
+    def __init__(self, entity):
+        self.entity = entity
+        self.key = "{}:{}".format(entity.get("type"), entity.get("id"))
+        self.name = entity.get("code")
+        self.root_path = None
+        self.status = None
+        self.error = None
+        self.files = []
+        self.synced = 0
+        self.up_to_date = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def as_dict(self):
+        return {
+            "entity": self.key,
+            "name": self.name,
+            "root_path": self.root_path,
+            "status": self.status,
+            "error": self.error,
+            "files": len(self.files),
+            "synced": self.synced,
+            "up_to_date": self.up_to_date,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+        }
+
+
+class SyncReport(object):
+    """
+    The outcome of a headless sync
+    """
+
+    def __init__(self, states, cancelled=False, concurrency=None):
+        """
+        :param states:         The EntitySyncState of every entity
+        :param cancelled:      True if the sync was cancelled
+        :param concurrency:    ConcurrencyController.metrics() at the end of the sync, if files
+                               were synced
+        """
+        self.states = states
+        self.cancelled = cancelled
+        self.concurrency = concurrency
+
+    @property
+    def entity_errors(self):
+        return [s for s in self.states if s.status in (ENTITY_ERROR, ENTITY_NOT_IN_DEPOT)]
+
+    @property
+    def files_failed(self):
+        return sum(s.failed for s in self.states)
+
+    @property
+    def files_synced(self):
+        return sum(s.synced for s in self.states)
+
+    @property
+    def files_up_to_date(self):
+        return sum(s.up_to_date for s in self.states)
+
+    @property
+    def files_cancelled(self):
+        return sum(s.cancelled for s in self.states)
+
+    def as_dict(self):
+        return {
+            "entities": [s.as_dict() for s in self.states],
+            "files_synced": self.files_synced,
+            "files_up_to_date": self.files_up_to_date,
+            "files_failed": self.files_failed,
+            "files_cancelled": self.files_cancelled,
+            "entity_errors": len(self.entity_errors),
+            "cancelled": self.cancelled,
+            "concurrency": self.concurrency,
+        }
+
+
+class SyncEngine(object):
+    """
+    Syncs the files of ShotGrid entities without any UI.  Entities are resolved to
+    their root paths concurrently, all roots are scanned with a single planned dry
+    run and the files are then synced in prioritized, concurrent batches.  Progress
+    is reported through an optional callback as dictionaries that can be serialized
+    to JSON.
+    """
+
+    def __init__(self, app, connection_pool, force=False, dry_run=False,
+                 max_workers=DEFAULT_MAX_WORKERS, max_transfers=DEFAULT_CEILING,
+                 bandwidth_limit=None, priority=None, on_event=None,
+                 min_transfers=DEFAULT_FLOOR, target_latency=DEFAULT_TARGET_LATENCY):
+        """
+        :param app:                The bundle to resolve templates, contexts and ShotGrid queries with
+        :param connection_pool:    ConnectionPool to take Perforce connections from.  Connections
+                                   for headless use should be made with allow_ui=False
+        :param force:              True to force-sync (-f) files that are already current
+        :param dry_run:            True to only report what would be synced
+        :param max_workers:        Maximum number of entities resolved at once
+        :param max_transfers:      Maximum number of batches synced at once.  The number actually
+                                   synced at once adapts to the load of the server, see
+                                   ConcurrencyController
+        :param bandwidth_limit:    Optional maximum overall sync rate in bytes per second
+        :param priority:           Optional SyncPriority deciding the order files are synced in
+        :param on_event:           Optional callable(dict) called with each progress event.  This can
+                                   be called from any thread, but never concurrently
+        :param min_transfers:      Number of batches synced at once however busy the server is
+        :param target_latency:     Seconds a sync may take to get its first answer from the server
+                                   before the number of batches synced at once goes down
+        """
+        self.app = app
+        self.connection_pool = connection_pool
+        self.force = force
+        self.dry_run = dry_run
+        self.max_workers = max(1, max_workers)
+        self.max_transfers = max(1, max_transfers)
+        self.min_transfers = max(1, min(min_transfers, self.max_transfers))
+        self.target_latency = target_latency
+        self.bandwidth_limit = bandwidth_limit
+        self.priority = priority
+        self._on_event = on_event
+        self._event_lock = threading.Lock()
+        self._started = None
+        self._cancelled = threading.Event()
+        self._scheduler = None
+        self._concurrency = None
+
+    def cancel(self):
+        """
+        Stop the sync as soon as possible.  Queued batches are dropped and running syncs
+        are aborted, files that weren't synced are reported as cancelled.  Safe to call
+        from any thread, e.g. a signal handler.
+        """
+        self._cancelled.set()
+        scheduler = self._scheduler
+        if scheduler:
+            scheduler.cancel()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def run(self, entities):
+        """
+        Sync the specified entities.
+
+        :param entities:       List of entity dictionaries with at least 'type' and 'id'.
+                               PublishedFile entities also need 'path_cache'
+        :returns SyncReport:   The outcome of the sync
+        """
+        self._started = time.monotonic()
+        self._concurrency = None
+        states = [EntitySyncState(entity) for entity in entities]
+
+        try:
+            self._resolve(states)
+            self._plan(states)
+            if not self.dry_run:
+                self._sync(states)
+        except SyncCancelled:
+            logger.info("Sync cancelled")
+
+        for state in states:
+            if state.status == ENTITY_PLANNED and not self.dry_run:
+                if state.failed:
+                    state.status = ENTITY_FAILED
+                elif state.cancelled:
+                    state.status = ENTITY_CANCELLED
+                else:
+                    state.status = ENTITY_SYNCED
+
+        report = SyncReport(states, cancelled=self.cancelled,
+                            concurrency=self._concurrency.metrics() if self._concurrency else None)
+        self._emit("finished", **report.as_dict())
+        return report
+
+    def _emit(self, event, **data):
+        if not self._on_event:
+            return
+        data["event"] = event
+        data["elapsed"] = round(time.monotonic() - self._started, 3)
+        with self._event_lock:
+            try:
+                self._on_event(data)
+            except Exception as e:
+                logger.warning("Failed to report sync event '%s': %s" % (event, e))
+
+    def _resolve(self, states):
+        """
+        Resolve the root path of every entity, concurrently
+        """
+        resolvers = resolve_many(self.app, [state.entity for state in states])
+
+        def resolve(state, resolver):
+            if self.cancelled:
+                return
+            try:
+                if state.entity.get("type") in ["PublishedFile"]:
+                    state.root_path = published_file_path(state.entity)
+                else:
+                    state.root_path = resolver.root_path
+                    state.name = resolver.entity.get("code")
+            except Exception as e:
+                logger.debug(traceback.format_exc())
+                state.status = ENTITY_ERROR
+                state.error = str(e)
+            self._emit("resolved", **state.as_dict())
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(resolve, state, resolver) for state, resolver in zip(states, resolvers)]
+            for future in as_completed(futures):
+                future.result()
+        if self.cancelled:
+            raise SyncCancelled("Sync cancelled")
+
+    def _plan(self, states):
+        """
+        Run a single planned dry run for all the resolved roots
+        """
+        to_plan = [s for s in states if not s.status and s.entity.get("type") not in ["PublishedFile"]]
+        for state in states:
+            if not state.status and state.entity.get("type") in ["PublishedFile"]:
+                # exact files don't need scanning
+                state.files = [(state.root_path, 0)]
+                state.status = ENTITY_PLANNED
+
+        if to_plan:
+            with self.connection_pool.connection() as p4:
+                scan_cache = get_scan_cache(p4.port, p4.client)
+                scan_change = get_highest_change(p4)
+                root_paths = [state.root_path for state in to_plan]
+                planner = SyncPlanner(force=self.force,
+                                      scan_cache=scan_cache,
+                                      scan_change=scan_change,
+                                      current_roots=scan_cache.refresh(p4, root_paths, self.force))
+                for index, state in enumerate(to_plan):
+                    planner.add_request(index, state.root_path)
+                plan = planner.run(p4, cancelled=self._cancelled.is_set)
+
+            for index, state in enumerate(to_plan):
+                entry = plan.get(index) or {}
+                if entry.get("status") == PLAN_ITEMS:
+                    state.files = [(item.get("clientFile"), int(item.get("fileSize") or 0))
+                                   for item in entry.get("items") if item.get("clientFile")]
+                    state.status = ENTITY_PLANNED
+                elif entry.get("status") == PLAN_NO_FILES:
+                    state.status = ENTITY_NOT_IN_DEPOT
+                    state.error = "Nothing in depot resolves [{}]".format(state.root_path)
+                elif entry.get("status") == PLAN_ERROR:
+                    state.status = ENTITY_ERROR
+                    state.error = entry.get("error")
+                else:
+                    state.status = ENTITY_UP_TO_DATE
+
+        for state in states:
+            self._emit("planned", **state.as_dict())
+
+    def _sync(self, states):
+        """
+        Sync the planned files in prioritized batches, several at once
+        """
+        states_by_key = dict((state.key, state) for state in states)
+        files_by_key = dict((state.key, state.files) for state in states
+                            if state.status == ENTITY_PLANNED and state.files)
+        if not files_by_key:
+            return
+        with self.connection_pool.connection() as p4:
+            server = p4.port
+            # the have list of these roots is about to change so their cached scans are stale
+            get_scan_cache(p4.port, p4.client).synced([states_by_key[key].root_path for key in files_by_key])
+        concurrency = get_concurrency_controller(server,
+                                                 floor=self.min_transfers,
+                                                 ceiling=self.max_transfers,
+                                                 target_latency=self.target_latency)
+        self._concurrency = concurrency
+        scheduler = SyncScheduler(max_transfers=self.max_transfers,
+                                  bandwidth_limit=self.bandwidth_limit,
+                                  priority=self.priority,
+                                  concurrency=concurrency)
+        batches = scheduler.add(files_by_key)
+        scheduler.close()
+        if not batches:
+            return
+        self._scheduler = scheduler
+        if self.cancelled:
+            scheduler.cancel()
+
+        # one aggregator adds up the bytes of every file in the sync, it's told the size of
+        # each file up front so the progress covers the files that haven't started
+        progress = ProgressAggregator()
+        for files in files_by_key.values():
+            for path, size in files:
+                progress.update(path, total=size)
+
+        state_lock = threading.Lock()
+        reported = set()
+
+        def file_synced(state, path, status, details, probe=None):
+            if probe is not None and status != STATUS_CANCELLED:
+                probe.answered(details if status == STATUS_ERROR else None)
+            with state_lock:
+                reported.add(path)
+                if status == STATUS_SYNCED:
+                    state.synced += 1
+                elif status == STATUS_UP_TO_DATE:
+                    state.up_to_date += 1
+                elif status == STATUS_CANCELLED:
+                    state.cancelled += 1
+                else:
+                    state.failed += 1
+            self._emit("file", entity=state.key, path=path, status=status,
+                       error=details if status == STATUS_ERROR else None)
+
+        def sync_batch(batch, probe):
+            on_file = partial(file_synced, states_by_key[batch.group], probe=probe)
+            try:
+                with self.connection_pool.connection() as p4:
+                    run_sync_batch(p4, batch.paths, force=self.force, on_file=on_file,
+                                   cancelled=self._cancelled.is_set, progress=progress,
+                                   throttle=partial(scheduler.throttle, cancelled=self._cancelled.is_set),
+                                   probe=probe)
+            except TankError as e:
+                for path in batch.paths:
+                    progress.finish(path, failed=True)
+                    on_file(path, STATUS_ERROR, str(e))
+
+        def transfer():
+            while True:
+                batch = scheduler.get()
+                if batch is None:
+                    return
+                probe = LatencyProbe()
+                try:
+                    sync_batch(batch, probe)
+                finally:
+                    # cancelled batches say nothing about the load of the server
+                    if self.cancelled:
+                        scheduler.task_done(batch)
+                    else:
+                        scheduler.task_done(batch, probe.latency, probe.error)
+
+        def report_concurrency(metrics):
+            self._emit("concurrency", **metrics)
+
+        # enough threads for the ceiling, the scheduler only lets the current limit sync at once
+        transfers = min(self.max_transfers, len(batches))
+        self._emit("concurrency", **concurrency.metrics())
+        concurrency.add_listener(report_concurrency)
+        try:
+            with ThreadPoolExecutor(max_workers=transfers) as executor:
+                futures = [executor.submit(transfer) for _ in range(transfers)]
+                last_snapshot = None
+                while futures:
+                    done, futures = wait(futures, timeout=PROGRESS_INTERVAL)
+                    for future in done:
+                        future.result()
+                    last_snapshot = self._emit_progress(progress, last_snapshot)
+        finally:
+            concurrency.remove_listener(report_concurrency)
+
+        # report the files of batches that were dropped from the queue by a cancel
+        for batch in batches:
+            for path in batch.paths:
+                if path not in reported:
+                    file_synced(states_by_key[batch.group], path, STATUS_CANCELLED, None)
+
+    def _emit_progress(self, progress, last_snapshot=None):
+        """
+        Report the bytes synced so far, if anything changed since the last report
+
+        :param progress:         The ProgressAggregator of the sync
+        :param last_snapshot:    The snapshot of the last report
+        :returns dict:           The snapshot of the progress
+        """
+        snapshot = progress.snapshot()
+        if last_snapshot and (snapshot["transferred"], snapshot["files_done"]) == \
+                (last_snapshot["transferred"], last_snapshot["files_done"]):
+            return last_snapshot
+        self._emit("progress",
+                   transferred=snapshot["transferred"],
+                   total=snapshot["total"],
+                   files_done=snapshot["files_done"],
+                   files_failed=snapshot["files_failed"],
+                   files_total=snapshot["files_total"],
+                   percent=round(snapshot["percent"], 1),
+                   rate=int(snapshot["rate"]),
+                   eta=None if snapshot["eta"] is None else round(snapshot["eta"], 1))
+        return snapshot
@@ -0,0 +1,336 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Batched execution of Perforce syncs
+"""
+
+import os
+import heapq
+
+import sgtk
+from sgtk import TankError
+
+from P4 import P4Exception, OutputHandler, Progress
+
+from ..util.progress import UNIT_BYTES
+
+logger = sgtk.platform.get_logger(__name__)
+
+# default limits used when splitting files into batches
+DEFAULT_BATCH_MAX_FILES = 500
+DEFAULT_BATCH_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# per-file statuses reported by the executor
+STATUS_SYNCED = "synced"
+STATUS_UP_TO_DATE = "up-to-date"
+STATUS_ERROR = "error"
+STATUS_CANCELLED = "cancelled"
+
+
+class SyncCancelled(TankError):
+    """
+    Raised when a scan or sync is stopped because it was cancelled
+    """
+
+
+class SyncBatch(object):
+    """
+    A group of files that are synced with a single sync command
+    """
+
+    def __init__(self, group, paths=None, size=0):
+        """
+        :param group:    Key identifying what the batch belongs to (e.g. the asset name)
+        :param paths:    List of local paths in the batch
+        :param size:     Total size in bytes of the files in the batch
+        """
+        self.group = group
+        self.paths = list(paths or [])
+        self.size = size
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __repr__(self):
+        return "<SyncBatch %s: %d files, %d bytes>" % (self.group, len(self.paths), self.size)
+
+
+def make_sync_batches(files_by_group, max_files=DEFAULT_BATCH_MAX_FILES, max_bytes=DEFAULT_BATCH_MAX_BYTES):
+    """
+    Split files to sync into batches.  Files are batched per group (e.g. per asset) and
+    groups that are too big are split into size-balanced batches of at most max_files
+    files and (unless a single file is bigger) max_bytes bytes.
+
+    :param files_by_group:    Dictionary of group -> list of (path, size in bytes) tuples
+    :param max_files:         Maximum number of files in a single batch
+    :param max_bytes:         Maximum total size of a single batch
+    :returns list:            List of SyncBatch instances
+    """
+    batches = []
+    for group, files in files_by_group.items():
+        if not files:
+            continue
+
+        total_size = sum(size for _, size in files)
+        batch_count = max(
+            (len(files) + max_files - 1) // max_files,
+            (total_size + max_bytes - 1) // max_bytes if max_bytes else 1,
+            1
+        )
+        batch_count = min(batch_count, len(files))
+        group_batches = [SyncBatch(group) for _ in range(batch_count)]
+
+        # largest files first, each into the currently smallest batch, to balance the sizes:
+        heap = [(0, 0, index) for index in range(batch_count)]
+        for path, size in sorted(files, key=lambda f: f[1], reverse=True):
+            batch_size, file_count, index = heapq.heappop(heap)
+            batch = group_batches[index]
+            batch.paths.append(path)
+            batch.size += size
+            heapq.heappush(heap, (batch.size, len(batch.paths), index))
+
+        batches.extend(group_batches)
+    return batches
+
+
+class SyncOutputHandler(OutputHandler):
+    """
+    Handler that reports the result for each file as the sync command outputs it
+    rather than once the whole command has completed.
+    """
+
+    def __init__(self, on_file=None, cancelled=None):
+        """
+        :param on_file:      Optional callable(result dict) called for each file synced
+        :param cancelled:    Optional callable returning True once the command should stop
+        """
+        OutputHandler.__init__(self)
+        self.on_file = on_file
+        self.cancelled = cancelled
+        self.results = []
+        self.messages = []
+
+    def is_cancelled(self):
+        return bool(self.cancelled and self.cancelled())
+
+    def outputStat(self, stat):
+        self.results.append(stat)
+        if self.on_file:
+            try:
+                self.on_file(stat)
+            except Exception as e:
+                logger.warning("Failed to handle sync result for %s: %s" % (stat.get("clientFile"), e))
+        # CANCEL makes P4 abort the rest of the command
+        if self.is_cancelled():
+            return OutputHandler.CANCEL
+        return OutputHandler.HANDLED
+
+    def outputMessage(self, message):
+        # let P4 record errors and warnings as usual so failures still raise
+        self.messages.append(str(message))
+        if self.is_cancelled():
+            return OutputHandler.CANCEL
+        return OutputHandler.REPORT
+
+
+class SyncProgress(Progress):
+    """
+    Progress callback that's called while a file is transferred, so that a command
+    stuck on a single big file can still be stopped between output lines and the bytes
+    of a transfer can be reported before the file has completed.
+    """
+
+    def __init__(self, cancelled=None, progress=None, paths_by_key=None, throttle=None, probe=None):
+        """
+        :param cancelled:       Callable returning True once the command should stop
+        :param progress:        Optional ProgressAggregator the bytes transferred for each file
+                                are reported to, keyed by the path of the file
+        :param paths_by_key:    Dictionary of normalized local path -> path of the files synced
+        :param throttle:        Optional callable(nbytes) called with the bytes transferred as
+                                they arrive, it may block to hold the transfer back
+        :param probe:           Optional LatencyProbe told when the first transfer starts
+        """
+        Progress.__init__(self)
+        self.cancelled = cancelled
+        self.progress = progress
+        self.paths_by_key = paths_by_key or {}
+        self.throttle = throttle
+        self.probe = probe
+        # path -> bytes reported for the file so far
+        self.transferred = {}
+        self._path = None
+        self._unit_bytes = None
+
+    def init(self, type):
+        # the server answered once it starts sending a file, however long the file takes
+        if self.probe:
+            self.probe.answered()
+
+    def setDescription(self, description, unit):
+        # transfers are described by the local path of the file.  Progress that isn't about
+        # one of the files or isn't counted in bytes isn't reported
+        self._path = self.paths_by_key.get(normalize_local_path(description)) if description else None
+        self._unit_bytes = UNIT_BYTES.get(unit)
+
+    def setTotal(self, total):
+        if self.progress and self._path and self._unit_bytes:
+            self.progress.update(self._path, total=total * self._unit_bytes)
+
+    def update(self, position):
+        if self._path and self._unit_bytes:
+            transferred = position * self._unit_bytes
+            new_bytes = transferred - self.transferred.get(self._path, 0)
+            self.transferred[self._path] = transferred
+            if self.progress:
+                self.progress.update(self._path, position=transferred)
+            if self.throttle and new_bytes > 0:
+                self.throttle(new_bytes)
+        # a true value asks P4 to stop the transfer
+        return bool(self.cancelled and self.cancelled())
+
+
+def normalize_local_path(path):
+    """
+    Normalize a local path so that it can be matched against the 'clientFile' in tagged output
+    """
+    return os.path.normcase(os.path.normpath(path))
+
+
+def message_path(message, paths_by_key):
+    """
+    Find the path a Perforce message is about.  Messages about a file start with the
+    path as it was passed to the command, e.g. '<path> - file(s) up-to-date.'
+
+    :param message:         The error or warning message
+    :param paths_by_key:    Dictionary of normalized local path -> path
+    :returns:               The path the message is about, None if it isn't about one of the paths
+    """
+    start = 0
+    while True:
+        # paths can contain ' - ' as well, so try every separator in turn
+        index = message.find(" - ", start)
+        if index < 0:
+            return None
+        path = paths_by_key.get(normalize_local_path(message[:index]))
+        if path is not None:
+            return path
+        start = index + 1
+
+
+def run_sync_batch(p4, paths, force=False, on_file=None, cancelled=None, progress=None, throttle=None,
+                   probe=None):
+    """
+    Sync a batch of files with a single sync command and report the result per file.
+
+    :param p4:           The Perforce connection to use
+    :param paths:        List of local paths to sync to their head revision
+    :param force:        If True, force a re-transfer of files that are already current
+    :param on_file:      Optional callable(path, status, details) called from the calling
+                         thread as each file is synced
+    :param cancelled:    Optional callable returning True once the sync should stop.  It's
+                         polled as output and transfer progress arrive, files that weren't
+                         synced by then are reported as STATUS_CANCELLED
+    :param progress:     Optional ProgressAggregator the files are reported to, keyed by their
+                         path, while they transfer and once they're synced or failed
+    :param throttle:     Optional callable(nbytes) called with the bytes synced as they're
+                         transferred, e.g. SyncScheduler.throttle.  It may block to hold
+                         the sync back
+    :param probe:        Optional LatencyProbe told when the first file starts to transfer, so
+                         the latency it measures doesn't include the transfer itself
+    :returns dict:       Dictionary of path -> (status, details) for every path in the batch
+    """
+    if not paths:
+        return {}
+
+    paths_by_key = dict((normalize_local_path(path), path) for path in paths)
+    results = {}
+
+    def report(path, status, details):
+        results[path] = (status, details)
+        if progress and status != STATUS_CANCELLED:
+            progress.finish(path, failed=status == STATUS_ERROR)
+        if on_file:
+            on_file(path, status, details)
+
+    sync_progress = None
+    if cancelled or progress or throttle or probe:
+        sync_progress = SyncProgress(cancelled, progress, paths_by_key, throttle, probe)
+
+    def handle_stat(stat):
+        client_file = stat.get("clientFile")
+        path = paths_by_key.get(normalize_local_path(client_file)) if client_file else None
+        if path is None:
+            return
+        report(path, STATUS_SYNCED, stat)
+        if throttle:
+            # the bytes of the file the transfer progress didn't report
+            remaining = int(stat.get("fileSize") or 0) - sync_progress.transferred.get(path, 0)
+            if remaining > 0:
+                throttle(remaining)
+
+    def report_cancelled():
+        for path in paths:
+            if path not in results:
+                report(path, STATUS_CANCELLED, None)
+        return results
+
+    args = []
+    if force:
+        args.append("-f")
+
+    if cancelled and cancelled():
+        return report_cancelled()
+
+    handler = SyncOutputHandler(handle_stat, cancelled)
+    previous_handler = p4.handler
+    previous_progress = p4.progress
+    p4.handler = handler
+    if sync_progress:
+        p4.progress = sync_progress
+    try:
+        p4.run_sync(args, paths)
+    except P4Exception as e:
+        if handler.is_cancelled():
+            return report_cancelled()
+        # files the server failed or warned about are reported with their own message,
+        # warnings (e.g. up-to-date or not in the client view) aren't failures
+        error = None
+        for message in p4.errors:
+            path = message_path(message, paths_by_key)
+            if path is None:
+                error = error or message
+            elif path not in results:
+                report(path, STATUS_ERROR, message)
+        for message in p4.warnings:
+            path = message_path(message, paths_by_key)
+            if path is not None and path not in results:
+                report(path, STATUS_UP_TO_DATE, message)
+
+        # the paths no message is about failed with the command
+        error = error or str(e)
+        logger.warning("Perforce: Sync batch failed - %s" % error)
+        for path in paths:
+            if path not in results:
+                report(path, STATUS_ERROR, error)
+        return results
+    finally:
+        p4.handler = previous_handler
+        p4.progress = previous_progress
+
+    # the command stopped early, so no output doesn't mean the file was already current
+    if handler.is_cancelled():
+        return report_cancelled()
+
+    # anything that didn't produce output was already current:
+    for path in paths:
+        if path not in results:
+            report(path, STATUS_UP_TO_DATE, None)
+    return results
@@ -0,0 +1,257 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Append-only journal of a sync session, so that an interrupted sync can be resumed
+without scanning again
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+import sgtk
+
+from .executor import STATUS_SYNCED, STATUS_UP_TO_DATE
+
+logger = sgtk.platform.get_logger(__name__)
+
+# seconds between forcing the journal to disk
+FSYNC_INTERVAL = 1.0
+
+JOURNAL_EXTENSION = ".journal"
+
+# planned files are written this many per line, so a torn write loses at most one line
+PLANNED_CHUNK_SIZE = 1000
+
+# journal records
+OP_SESSION = "session"
+OP_PLANNED = "planned"
+OP_STARTED = "started"
+OP_COMPLETED = "completed"
+
+# statuses that mean a file doesn't need syncing again
+DONE_STATUSES = (STATUS_SYNCED, STATUS_UP_TO_DATE)
+
+
+class SyncJournal(object):
+    """
+    Records the files planned for a sync session, when their batches started and
+    the result of each file, as one JSON object per line.  Lines are only ever
+    appended, so a crash can at worst lose the last, partially written, line.  When
+    the session completes the journal is compacted to the files that still need
+    syncing, or removed if there are none.
+    """
+
+    def __init__(self, path):
+        """
+        :param path:    Path of the journal file
+        """
+        self.path = path
+        self.session = {}
+        # path -> planned entry, in the order the files were planned
+        self.planned = {}
+        # path -> (status, revision)
+        self.completed = {}
+        self.started = set()
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._last_sync = 0
+
+    @classmethod
+    def create(cls, directory, **session_info):
+        """
+        Start a new journal.
+
+        :param directory:       Directory to store journals in
+        :param session_info:    Extra information to record about the session
+        :returns SyncJournal:   The new journal
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        session_id = "%s-%s" % (time.strftime("%Y%m%d-%H%M%S"), uuid.uuid4().hex[:8])
+        journal = cls(os.path.join(directory, session_id + JOURNAL_EXTENSION))
+        journal.session = dict(session_info, id=session_id, created=time.time())
+        journal._append([dict(journal.session, op=OP_SESSION)], force_sync=True)
+        return journal
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a journal back from disk.  Lines that can't be parsed (e.g. a line that was
+        being written during a crash) are skipped.
+
+        :returns SyncJournal:    The loaded journal
+        """
+        journal = cls(path)
+        with open(path, "r") as file_obj:
+            for line in file_obj:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.debug("Skipping unreadable line in sync journal %s" % path)
+                    continue
+                journal._apply(record)
+        return journal
+
+    @classmethod
+    def find_incomplete(cls, directory):
+        """
+        Find the journals of sessions that didn't complete and still have files to sync.
+
+        :param directory:    Directory the journals are stored in
+        :returns list:       SyncJournal instances, newest first
+        """
+        journals = []
+        for path in sorted(glob.glob(os.path.join(directory, "*" + JOURNAL_EXTENSION)), reverse=True):
+            try:
+                journal = cls.load(path)
+            except (IOError, OSError) as e:
+                logger.warning("Failed to read sync journal %s: %s" % (path, e))
+                continue
+            if journal.remaining():
+                journals.append(journal)
+            else:
+                journal.discard()
+        return journals
+
+    def _apply(self, record):
+        op = record.get("op")
+        if op == OP_SESSION:
+            self.session = dict((k, v) for k, v in record.items() if k != "op")
+        elif op == OP_PLANNED:
+            for entry in record.get("files", []):
+                self.planned[entry["path"]] = entry
+        elif op == OP_STARTED:
+            self.started.update(record.get("paths", []))
+        elif op == OP_COMPLETED:
+            for path, status, rev in record.get("files", []):
+                self.completed[path] = (status, rev)
+
+    def _append(self, records, force_sync=False):
+        """
+        Append records to the journal file, forcing them to disk at most every
+        FSYNC_INTERVAL seconds unless force_sync is set
+        """
+        with self._lock:
+            for record in records:
+                self._apply(record)
+            try:
+                if not self._file:
+                    self._file = self._open()
+                self._file.write("".join(json.dumps(record) + "\n" for record in records))
+                self._file.flush()
+                if force_sync or time.monotonic() - self._last_sync >= FSYNC_INTERVAL:
+                    os.fsync(self._file.fileno())
+                    self._last_sync = time.monotonic()
+            except (IOError, OSError) as e:
+                # the journal is a safety net, failing to write it mustn't stop the sync
+                logger.warning("Failed to write sync journal %s: %s" % (self.path, e))
+
+    def _open(self):
+        """
+        Open the journal for appending, terminating a line left torn by a crash so that
+        it doesn't swallow the next record
+        """
+        file_obj = open(self.path, "a+")
+        if file_obj.tell() > 0:
+            file_obj.seek(file_obj.tell() - 1)
+            if file_obj.read(1) != "\n":
+                file_obj.write("\n")
+        return file_obj
+
+    def record_planned(self, entries):
+        """
+        Record files that are about to be synced.  Files that were already planned are skipped.
+
+        :param entries:    List of dictionaries with at least 'path', and optionally 'asset',
+                           'root_path', 'size', 'depot_file' and 'rev'
+        """
+        entries = [entry for entry in entries if entry["path"] not in self.planned]
+        if entries:
+            # the plan has to be on disk before anything is synced
+            self._append([{"op": OP_PLANNED, "files": entries[i:i + PLANNED_CHUNK_SIZE]}
+                          for i in range(0, len(entries), PLANNED_CHUNK_SIZE)], force_sync=True)
+
+    def record_started(self, paths):
+        """
+        Record that the sync of a batch of files started
+        """
+        self._append([{"op": OP_STARTED, "paths": list(paths)}])
+
+    def record_completed(self, results):
+        """
+        Record the result of synced files
+
+        :param results:    List of (path, status, revision) tuples
+        """
+        if results:
+            self._append([{"op": OP_COMPLETED, "files": [list(result) for result in results]}])
+
+    def remaining(self):
+        """
+        :returns list:    The planned entries of the files that still need syncing
+        """
+        return [entry for path, entry in self.planned.items()
+                if self.completed.get(path, (None, None))[0] not in DONE_STATUSES]
+
+    def finish(self):
+        """
+        Compact the journal once the session is over: it's rewritten with just the
+        files that still need syncing, or removed if there are none
+        """
+        remaining = self.remaining()
+        self.close()
+        if not remaining:
+            self.discard()
+            return
+
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as file_obj:
+            file_obj.write(json.dumps(dict(self.session, op=OP_SESSION)) + "\n")
+            for i in range(0, len(remaining), PLANNED_CHUNK_SIZE):
+                file_obj.write(json.dumps({"op": OP_PLANNED, "files": remaining[i:i + PLANNED_CHUNK_SIZE]}) + "\n")
+            file_obj.flush()
+            os.fsync(file_obj.fileno())
+        os.replace(temp_path, self.path)
+
+        self.planned = dict((entry["path"], entry) for entry in remaining)
+        self.completed = {}
+        self.started = set()
+
+    def discard(self):
+        """
+        Close and delete the journal
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                try:
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                finally:
+                    self._file.close()
+                    self._file = None
+
+
+def get_journal_directory(framework=None):
+    """
+    :returns str:    The directory sync journals are stored in
+    """
+    fw = framework or sgtk.platform.current_bundle()
+    return os.path.join(fw.cache_location, "sync_journals")
@@ -0,0 +1,302 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Planning of dry-run syncs for many, possibly overlapping, roots
+"""
+
+import os
+
+import sgtk
+from sgtk import TankError
+
+from P4 import P4Exception
+
+from .executor import SyncCancelled
+
+logger = sgtk.platform.get_logger(__name__)
+
+# maximum number of roots passed to a single dry-run sync
+DRY_RUN_CHUNK_SIZE = 200
+
+# per-request results of a plan
+PLAN_ITEMS = "items"
+PLAN_UP_TO_DATE = "up-to-date"
+PLAN_NO_FILES = "no-files"
+PLAN_ERROR = "error"
+
+NO_SUCH_FILES_MESSAGE = "no such file"
+
+
+def normalize_root(root_path):
+    """
+    Normalize a root path so that roots and files can be compared.  Trailing
+    '...' wildcards are removed and directories end with a '/'.
+
+    :param root_path:    A local root path, either a directory ending in '...'
+                         or a single file
+    :returns:            A tuple (normalized path, True if the root is a directory)
+    """
+    path = root_path.replace("\\", "/")
+    is_dir = path.endswith("/...") or path == "..."
+    if is_dir:
+        path = path[:-3]
+    path = os.path.normcase(path).replace("\\", "/")
+    if is_dir and not path.endswith("/"):
+        path += "/"
+    return path, is_dir
+
+
+class SyncPlanner(object):
+    """
+    Collects the roots requested by several entities, collapses nested roots so that
+    every depot tree is only scanned once, runs the dry-run sync for all of them in as
+    few commands as possible and attributes each file back to the most specific entity
+    that requested it.
+    """
+
+    def __init__(self, force=False, scan_cache=None, scan_change=None, current_roots=None, scan_filter=None):
+        """
+        :param force:            True to plan a forced (-f) sync
+        :param scan_cache:       Optional ScanCache to reuse and store dry-run results
+        :param scan_change:      The highest submitted change before the dry run, used
+                                 when storing results in the scan cache
+        :param current_roots:    Roots whose cached results are known to be current
+        :param scan_filter:      Optional ScanFilter narrowing the dry run
+        """
+        self._force = force
+        self._scan_cache = scan_cache
+        self._scan_change = scan_change
+        self._current_roots = set(current_roots or [])
+        self._scan_filter = scan_filter
+        self._scope = scan_filter.scope if scan_filter else None
+
+        # requester key -> (root path, normalized root, is directory)
+        self._requests = {}
+        # scanned root -> the error its dry run failed with
+        self._errors = {}
+
+    def add_request(self, key, root_path):
+        """
+        Request a root to be scanned on behalf of a requester (e.g. an entity).
+
+        :param key:          Hashable key identifying the requester
+        :param root_path:    The local root path to scan, usually ending in '...'
+        """
+        normalized, is_dir = normalize_root(root_path)
+        self._requests[key] = (root_path, normalized, is_dir)
+
+    def collapsed_roots(self):
+        """
+        Return the requested roots with any root nested under another removed.
+
+        :returns list:    The list of original root paths to scan
+        """
+        roots = {}
+        for root_path, normalized, is_dir in self._requests.values():
+            roots.setdefault(normalized, (root_path, is_dir))
+
+        collapsed = []
+        dirs = set(normalized for normalized, (_, is_dir) in roots.items() if is_dir)
+        for normalized in sorted(roots):
+            root_path, is_dir = roots[normalized]
+            if self._find_containing(normalized, dirs, exclude_self=is_dir):
+                # a parent root already covers this one
+                continue
+            collapsed.append(root_path)
+        return collapsed
+
+    def run(self, p4, cancelled=None):
+        """
+        Run the dry-run sync for all requested roots.
+
+        :param p4:           The Perforce connection to use
+        :param cancelled:    Optional callable returning True once the scan should stop.  It's
+                             checked between dry-run chunks
+        :returns dict:       Requester key -> dictionary with the 'status' (one of PLAN_ITEMS,
+                             PLAN_UP_TO_DATE, PLAN_NO_FILES or PLAN_ERROR), the 'items' to sync
+                             attributed to the requester, the 'root_path' the requester asked
+                             for and the 'error' the dry run of its root failed with, if any.
+                             Requesters of the same root as an earlier one get no items and
+                             the key of that one as 'covered_by', so every file is synced once
+        :raises:             SyncCancelled if the scan was cancelled
+        """
+        collapsed = self.collapsed_roots()
+
+        responses = {}
+        roots_to_scan = []
+        for root_path in collapsed:
+            if self._scan_cache and root_path in self._current_roots:
+                entry = self._scan_cache.get(root_path, self._force, self._scope)
+                if entry:
+                    responses[root_path] = entry.result
+                    continue
+            roots_to_scan.append(root_path)
+
+        for chunk_start in range(0, len(roots_to_scan), DRY_RUN_CHUNK_SIZE):
+            if cancelled and cancelled():
+                raise SyncCancelled("Perforce: Scan cancelled")
+            chunk = roots_to_scan[chunk_start:chunk_start + DRY_RUN_CHUNK_SIZE]
+            responses.update(self._dry_run(p4, chunk, cancelled))
+
+        return self._attribute(responses)
+
+    def _dry_run(self, p4, root_paths, cancelled=None):
+        """
+        Run a single dry-run sync for several roots and split the output per root.  A root
+        the server fails (e.g. one that isn't under the client's root) fails the whole
+        command, so a failed command is split in halves until the failing roots are found
+        and only they are reported as failed.
+        """
+        arguments = ["-n"]
+        if self._force:
+            arguments.append("-f")
+        case_insensitive = getattr(p4, "server_case_insensitive", False)
+        patterns = {}
+        for root_path in root_paths:
+            patterns[root_path] = self._scan_filter.file_patterns(root_path, case_insensitive) \
+                if self._scan_filter else [root_path]
+        file_args = ["{}#head".format(pattern) for root_path in root_paths for pattern in patterns[root_path]]
+        if not file_args:
+            # the filter leaves nothing to scan, and a sync without files would sync everything
+            return dict((root_path, []) for root_path in root_paths)
+        # roots without files and files that are current are warnings.  They mustn't fail the
+        # command, whatever the connection's exception level, and are read from p4.warnings
+        previous_exception_level = p4.exception_level
+        p4.exception_level = 1
+        try:
+            sync_response = list(p4.run("sync", arguments, file_args))
+            sync_response.extend(warning for warning in p4.warnings if warning not in sync_response)
+        except P4Exception as e:
+            error = p4.errors[0] if p4.errors else str(e)
+            if not p4.connected():
+                # nothing left to split apart, every root would fail
+                raise TankError("Perforce: %s" % error)
+            if len(root_paths) == 1:
+                logger.warning("Perforce: Dry run of %s failed - %s" % (root_paths[0], error))
+                self._errors[root_paths[0]] = error
+                return {}
+            if cancelled and cancelled():
+                raise SyncCancelled("Perforce: Scan cancelled")
+            middle = len(root_paths) // 2
+            responses = self._dry_run(p4, root_paths[:middle], cancelled)
+            responses.update(self._dry_run(p4, root_paths[middle:], cancelled))
+            return responses
+        finally:
+            p4.exception_level = previous_exception_level
+
+        responses = dict((root_path, []) for root_path in root_paths)
+        dirs = {}
+        files = {}
+        for root_path in root_paths:
+            normalized, is_dir = normalize_root(root_path)
+            (dirs if is_dir else files)[normalized] = root_path
+
+        for item in sync_response:
+            if isinstance(item, dict):
+                path, _ = normalize_root(item.get("clientFile", ""))
+                root_path = files.get(path) or dirs.get(self._find_containing(path, dirs))
+            else:
+                # messages start with the path they're about:
+                root_path = None
+                for candidate in root_paths:
+                    if str(item).startswith(candidate):
+                        root_path = candidate
+                        break
+            if root_path:
+                responses[root_path].append(item)
+
+        # a root scanned for several patterns only has no files if none of the patterns has any
+        for root_path, root_patterns in patterns.items():
+            if len(root_patterns) < 2:
+                continue
+            response = responses[root_path]
+            no_files = [item for item in response
+                        if not isinstance(item, dict) and NO_SUCH_FILES_MESSAGE in str(item)]
+            if len(no_files) < len(root_patterns):
+                responses[root_path] = [item for item in response if item not in no_files]
+            else:
+                responses[root_path] = no_files[:1]
+
+        if self._scan_cache and self._scan_change is not None:
+            for root_path, response in responses.items():
+                self._scan_cache.store(root_path, self._scan_change, response, self._force, self._scope)
+
+        return responses
+
+    def _attribute(self, responses):
+        """
+        Attribute the files in each root's response to the most specific requester, the
+        first one to request it when several requested the same root
+        """
+        requesters_by_root = {}
+        dirs = set()
+        for key, (root_path, normalized, is_dir) in self._requests.items():
+            requesters_by_root.setdefault(normalized, []).append(key)
+            if is_dir:
+                dirs.add(normalized)
+
+        plan = {}
+        for key, (root_path, normalized, is_dir) in self._requests.items():
+            plan[key] = {"root_path": root_path, "status": PLAN_UP_TO_DATE, "items": []}
+
+        # the status of a requester with no files comes from the root that was scanned for it:
+        for scanned_root, error in self._errors.items():
+            scanned_normalized, scanned_is_dir = normalize_root(scanned_root)
+            for key, (root_path, normalized, is_dir) in self._requests.items():
+                if normalized == scanned_normalized or (scanned_is_dir and normalized.startswith(scanned_normalized)):
+                    plan[key]["status"] = PLAN_ERROR
+                    plan[key]["error"] = error
+
+        for scanned_root, response in responses.items():
+            scanned_normalized, scanned_is_dir = normalize_root(scanned_root)
+            no_files = [item for item in response
+                        if not isinstance(item, dict) and NO_SUCH_FILES_MESSAGE in str(item)]
+            if not no_files:
+                continue
+            for key, (root_path, normalized, is_dir) in self._requests.items():
+                if normalized == scanned_normalized or (scanned_is_dir and normalized.startswith(scanned_normalized)):
+                    plan[key]["status"] = PLAN_NO_FILES
+
+        for response in responses.values():
+            for item in response:
+                if not isinstance(item, dict):
+                    continue
+                if self._scan_filter and self._scan_filter.excludes(item):
+                    continue
+                path, _ = normalize_root(item.get("clientFile", ""))
+                root = path if path in requesters_by_root else self._find_containing(path, dirs)
+                if root in requesters_by_root:
+                    owner = requesters_by_root[root][0]
+                    plan[owner]["items"].append(item)
+                    plan[owner]["status"] = PLAN_ITEMS
+
+        for keys in requesters_by_root.values():
+            for key in keys[1:]:
+                if plan[key]["status"] == PLAN_UP_TO_DATE:
+                    plan[key]["covered_by"] = keys[0]
+
+        return plan
+
+    @staticmethod
+    def _find_containing(path, dirs, exclude_self=False):
+        """
+        Find the most specific directory root in dirs that contains path by walking up
+        the path, so the cost depends on the depth of the path rather than the number
+        of roots.
+        """
+        if not exclude_self and path in dirs:
+            return path
+        parent = path.rstrip("/")
+        while "/" in parent:
+            parent = parent.rsplit("/", 1)[0]
+            if parent + "/" in dirs:
+                return parent + "/"
+        return None
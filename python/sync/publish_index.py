@@ -0,0 +1,143 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Bulk lookup of PublishedFile entities for the files found by a sync scan
+"""
+
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import sgtk
+
+logger = sgtk.platform.get_logger(__name__)
+
+# the only PublishedFile fields the sync needs
+PUBLISH_INDEX_FIELDS = [
+    "sg_p4_depo_path",
+    "task.Task.step.Step.code",
+    "published_file_type.PublishedFileType.code",
+]
+
+STEP_FIELD = "task.Task.step.Step.code"
+TYPE_FIELD = "published_file_type.PublishedFileType.code"
+
+# maximum number of values passed to a single 'in' filter
+DEFAULT_CHUNK_SIZE = 200
+DEFAULT_MAX_WORKERS = 4
+
+
+class PublishIndex(object):
+    """
+    Index of PublishedFile entities keyed by depot path (and by id).  This is built
+    with a few chunked, parallel 'in' queries for all the files found across a scan
+    rather than one query per asset.
+    """
+
+    def __init__(self, publishes=None):
+        """
+        :param publishes:    Optional list of PublishedFile dictionaries to index
+        """
+        self._by_depot_path = {}
+        self._by_id = {}
+        self.add(publishes or [])
+
+    def add(self, publishes):
+        """
+        Add PublishedFile dictionaries to the index.  When several publishes share a
+        depot path the one with the highest id wins.
+
+        :param publishes:    List of PublishedFile dictionaries
+        """
+        for publish in sorted(publishes, key=lambda p: p.get("id") or 0):
+            self._by_id[publish.get("id")] = publish
+            depot_path = publish.get("sg_p4_depo_path")
+            if depot_path:
+                self._by_depot_path[depot_path] = publish
+
+    def get(self, depot_path=None, publish_id=None):
+        """
+        Look up a publish by depot path or by id.
+
+        :returns dict:    The PublishedFile dictionary or None if not found
+        """
+        if depot_path:
+            publish = self._by_depot_path.get(depot_path)
+            if publish:
+                return publish
+        if publish_id:
+            return self._by_id.get(publish_id)
+        return None
+
+    def step(self, depot_path=None, publish_id=None):
+        publish = self.get(depot_path, publish_id)
+        return publish.get(STEP_FIELD) if publish else None
+
+    def publish_type(self, depot_path=None, publish_id=None):
+        publish = self.get(depot_path, publish_id)
+        return publish.get(TYPE_FIELD) if publish else None
+
+    def depot_paths(self):
+        """
+        :returns list:    The depot paths of the indexed publishes
+        """
+        return list(self._by_depot_path.keys())
+
+    def __len__(self):
+        return len(self._by_id)
+
+    @classmethod
+    def fetch(cls, shotgun_getter, depot_paths=None, publish_ids=None, entities=None, filters=None,
+              fields=None, chunk_size=DEFAULT_CHUNK_SIZE, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        Build an index by querying ShotGrid for the specified depot paths, ids and/or linked
+        entities.  The queries are split into chunks that run in parallel.
+
+        :param shotgun_getter:    Callable returning a ShotGrid connection.  This is called
+                                  from each query thread so that every thread uses its own
+                                  connection, e.g. `lambda: app.shotgun`
+        :param depot_paths:       List of depot paths to find publishes for
+        :param publish_ids:       List of PublishedFile ids to find publishes for
+        :param entities:          List of entity dictionaries to find the linked publishes of
+        :param filters:           Optional filters every query must match as well
+        :param fields:            Fields to query.  Defaults to PUBLISH_INDEX_FIELDS
+        :param chunk_size:        Maximum number of values per 'in' filter
+        :param max_workers:       Maximum number of queries to run at the same time
+        :returns PublishIndex:    The new index
+        """
+        fields = list(fields or PUBLISH_INDEX_FIELDS)
+        depot_paths = sorted(set(p for p in (depot_paths or []) if p))
+        publish_ids = sorted(set(i for i in (publish_ids or []) if i))
+        entities = sorted(dict(((e["type"], e["id"]), e) for e in (entities or []) if e).values(),
+                          key=lambda e: (e["type"], e["id"]))
+        extra_filters = list(filters or [])
+
+        chunk_filters = []
+        for field, values in [("sg_p4_depo_path", depot_paths), ("id", publish_ids), ("entity", entities)]:
+            for chunk_start in range(0, len(values), chunk_size):
+                chunk_filters.append([field, "in", values[chunk_start:chunk_start + chunk_size]])
+
+        index = cls()
+        if not chunk_filters:
+            return index
+
+        def query(sg_filter):
+            return shotgun_getter().find("PublishedFile", [sg_filter] + extra_filters, fields)
+
+        if len(chunk_filters) == 1:
+            index.add(query(chunk_filters[0]))
+            return index
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(chunk_filters))) as executor:
+            for publishes in executor.map(query, chunk_filters):
+                index.add(publishes)
+
+        logger.debug("Indexed %d publishes with %d queries" % (len(index), len(chunk_filters)))
+        return index
@@ -1,6 +1,7 @@
 import os
 import sys
 import sgtk
+import threading
 import traceback
 
 name_mapping = {
@@ -17,9 +18,89 @@ root_template_mapping = {
 }
 
 
+# TODO: this needs to become dynamic
+PUBLISHED_FILE_ROOT = "B:/"
+
+
+def published_file_path(entity):
+    """
+    Return the local path to sync for a PublishedFile entity
+
+    :param entity:    PublishedFile dictionary with at least the 'path_cache' field
+    """
+    return PUBLISHED_FILE_ROOT + entity.get('path_cache')
+
+
+class ResolverCache(object):
+    """
+    Session-wide cache of the values TemplateResolver computes for an entity, keyed by
+    (type, id): the entity itself, its context, template fields and root path.  Folders
+    are only created once per entity per session.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._values = {}
+        self._folders_created = set()
+
+    @staticmethod
+    def key(entity):
+        return (entity.get('type'), entity.get('id'))
+
+    def get(self, name, entity_key, compute):
+        """
+        Return the cached value for an entity, computing it with compute() the first time.
+        Concurrent requests for the same entity wait for the first computation.
+
+        :param name:          Name of the value (e.g. 'context')
+        :param entity_key:    (type, id) of the entity
+        :param compute:       Callable returning the value if it isn't cached yet
+        """
+        cache_key = (name, entity_key)
+        if cache_key in self._values:
+            return self._values[cache_key]
+
+        with self._entity_lock(entity_key):
+            if cache_key not in self._values:
+                self._values[cache_key] = compute()
+            return self._values[cache_key]
+
+    def set(self, name, entity_key, value):
+        self._values[(name, entity_key)] = value
+
+    def has(self, name, entity_key):
+        return (name, entity_key) in self._values
+
+    def ensure_folders(self, entity_key, create):
+        """
+        Run create() to make the folders for an entity unless that's already been
+        done this session
+        """
+        if entity_key in self._folders_created:
+            return
+        with self._entity_lock(entity_key):
+            if entity_key not in self._folders_created:
+                create()
+                self._folders_created.add(entity_key)
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+            self._folders_created = set()
+
+    def _entity_lock(self, entity_key):
+        with self._lock:
+            return self._key_locks.setdefault(entity_key, threading.RLock())
+
+
+# shared for the lifetime of the session
+_g_resolver_cache = ResolverCache()
+
+
 class TemplateResolver:
 
-    def __init__(self, app=None, entity=None):
+    def __init__(self, app=None, entity=None, cache=None):
         self.app = app
 
         self._entity = None
@@ -27,6 +108,9 @@ class TemplateResolver:
         if entity.get('type') in ["PublishedFile"]:
             self._entity = entity
 
+        self._cache = cache if cache is not None else _g_resolver_cache
+        self._key = ResolverCache.key(entity)
+
     @property
     def root_template(self):
         mapping = {
@@ -44,17 +128,19 @@ class TemplateResolver:
 
     @property
     def template_fields(self):
-        self.prepare_folders()
-        fields = self.context.as_template_fields(self.root_template)
-        return fields
+        def compute():
+            self.prepare_folders()
+            return self.context.as_template_fields(self.root_template)
+        return self._cache.get("template_fields", self._key, compute)
 
     @property
     def entity(self):
         if not self._entity:
             if not self._incoming_entity.get('code'):
-                self._entity = self.app.shotgun.find_one(self._incoming_entity['type'], 
-                                                [["id", "is", self._incoming_entity['id']]], 
-                                                ["code"])
+                self._entity = self._cache.get("entity", self._key,
+                                               lambda: self.app.shotgun.find_one(self._incoming_entity['type'], 
+                                                    [["id", "is", self._incoming_entity['id']]], 
+                                                    ["code"]))
             else:
                 self._entity = self._incoming_entity
         return self._entity
@@ -65,14 +151,17 @@ class TemplateResolver:
 
     @property
     def context(self):
-        return self.app.sgtk.context_from_entity(self.entity['type'],  self.entity['id'])
+        return self._cache.get("context", self._key,
+                               lambda: self.app.sgtk.context_from_entity(self.entity['type'],  self.entity['id']))
 
     def prepare_folders(self):
-        try:
-            self.app.sgtk.create_filesystem_structure(self.entity['type'], self.entity['id'])
-        except Exception as e:
-            self.app.log_error(traceback.format_exc())
-            raise Exception(str(e))
+        def create():
+            try:
+                self.app.sgtk.create_filesystem_structure(self.entity['type'], self.entity['id'])
+            except Exception as e:
+                self.app.log_error(traceback.format_exc())
+                raise Exception(str(e))
+        self._cache.ensure_folders(self._key, create)
 
 
     @property
@@ -80,9 +169,11 @@ class TemplateResolver:
         if self._incoming_entity.get('type') in ['PublishedFile']:
             return self._incoming_entity.get('path_cache')
         else:
-            templated_path = self.root_template.apply_fields(self.template_fields,
-                                                            platform= sys.platform)
-            return os.path.join(templated_path, "...")
+            def compute():
+                templated_path = self.root_template.apply_fields(self.template_fields,
+                                                                platform= sys.platform)
+                return os.path.join(templated_path, "...")
+            return self._cache.get("root_path", self._key, compute)
 
     @property
     def entity_info(self):
@@ -98,3 +189,77 @@ class TemplateResolver:
             }
             self.app.log_error(traceback.format_exc())
         return info
+
+
+def prefetch_entities(app, entities, cache=None):
+    """
+    Look up the entities whose codes aren't cached yet with a single query per entity
+    type rather than a find_one each.
+
+    :param app:         The app to query ShotGrid with
+    :param entities:    List of entity dictionaries with at least 'type' and 'id'
+    :param cache:       Optional ResolverCache.  Defaults to the session cache
+    """
+    cache = cache if cache is not None else _g_resolver_cache
+
+    ids_by_type = {}
+    for entity in entities:
+        key = ResolverCache.key(entity)
+        if entity.get('type') in ["PublishedFile"] or entity.get('code') or cache.has("entity", key):
+            continue
+        ids_by_type.setdefault(entity['type'], set()).add(entity['id'])
+
+    for entity_type, ids in ids_by_type.items():
+        for sg_entity in app.shotgun.find(entity_type, [["id", "in", sorted(ids)]], ["code"]):
+            cache.set("entity", ResolverCache.key(sg_entity), sg_entity)
+
+
+def resolve_many(app, entities, cache=None):
+    """
+    Create resolvers for many entities at once.  Entity codes that aren't cached yet
+    are prefetched with a single query per entity type rather than a find_one each.
+
+    :param app:         The app to resolve templates and contexts with
+    :param entities:    List of entity dictionaries with at least 'type' and 'id'
+    :param cache:       Optional ResolverCache.  Defaults to the session cache
+    :returns list:      A TemplateResolver per entity, in the same order
+    """
+    prefetch_entities(app, entities, cache)
+    return [TemplateResolver(app=app, entity=entity, cache=cache) for entity in entities]
+
+
+class EntityPrefetcher(object):
+    """
+    Runs prefetch_entities() for the entities of a scan once, from whichever worker needs
+    them first, so the bulk queries don't hold up the thread that starts the scan (e.g.
+    the UI thread).  The other workers wait for it rather than querying their entity.
+    """
+
+    def __init__(self, app, entities, cache=None):
+        """
+        :param app:         The app to query ShotGrid with
+        :param entities:    List of entity dictionaries with at least 'type' and 'id'
+        :param cache:       Optional ResolverCache.  Defaults to the session cache
+        """
+        self.app = app
+        self.entities = entities
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._done = False
+
+    def ensure(self):
+        """
+        Prefetch the entities unless that's already been done
+        """
+        if self._done:
+            return
+        with self._lock:
+            if self._done:
+                return
+            try:
+                prefetch_entities(self.app, self.entities, self._cache)
+            except Exception as e:
+                # resolvers look up their entity one by one instead
+                self.app.log_warning("Failed to prefetch {} entities: {}".format(len(self.entities), e))
+            finally:
+                self._done = True
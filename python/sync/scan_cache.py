@@ -0,0 +1,239 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Cache of dry-run sync results per root so that repeated scans can be skipped when
+nothing has been submitted under a root since it was last scanned and the have list
+of the workspace hasn't changed
+"""
+
+import threading
+import time
+
+import sgtk
+from sgtk import TankError
+
+from P4 import P4Exception
+
+logger = sgtk.platform.get_logger(__name__)
+
+# entries older than this are always rescanned.  Have list changes made outside of this
+# framework are picked up through the highest change the workspace has, but syncing
+# files back to older revisions can leave that as it was and is only noticed once the
+# entries expire
+DEFAULT_MAX_AGE = 10 * 60
+
+
+class ScanCacheEntry(object):
+    """
+    The result of a dry-run sync for a root
+    """
+
+    def __init__(self, root_path, change, result):
+        """
+        :param root_path:    The root that was scanned
+        :param change:       The highest submitted change on the server when the root was scanned
+        :param result:       The dry-run sync output
+        """
+        self.root_path = root_path
+        self.change = int(change)
+        self.result = result
+        self.timestamp = time.monotonic()
+
+
+class ScanCache(object):
+    """
+    Stores the last dry-run result for each root, along with the server's highest
+    submitted change at the time of the scan.  Before rescanning, all cached roots are
+    checked for newer submits with a single batched 'changes' query and only the roots
+    that have new submits (or whose have list was changed by a sync) are rescanned.
+
+    The have list can also be changed by other tools, e.g. syncing from P4V, 'p4 flush' or
+    switching the workspace to another stream.  The highest change the workspace has is
+    recorded with the entries and when it moves without a sync of the framework in
+    between, all entries are dropped.
+    """
+
+    def __init__(self, max_age=DEFAULT_MAX_AGE):
+        """
+        :param max_age:    Seconds after which an entry is always rescanned
+        """
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._have_change = None
+        self._syncing = False
+
+    def get(self, root_path, force=False, scope=None):
+        """
+        Return the cached entry for a root if it's still considered current.
+
+        :param root_path:    The root path that was scanned
+        :param force:        True if the scan was a forced (-f) dry run
+        :param scope:        The ScanFilter.scope the root was scanned with, if any
+        :returns:            A ScanCacheEntry or None
+        """
+        with self._lock:
+            entry = self._entries.get((root_path, force, scope))
+        if entry and time.monotonic() - entry.timestamp > self._max_age:
+            self.invalidate([root_path])
+            return None
+        return entry
+
+    def store(self, root_path, change, result, force=False, scope=None):
+        """
+        Store the result of a dry-run sync.
+
+        :param root_path:    The root path that was scanned
+        :param change:       The highest submitted change on the server, queried *before*
+                             the dry run was started
+        :param result:       The dry-run sync output
+        :param force:        True if the scan was a forced (-f) dry run
+        :param scope:        The ScanFilter.scope the root was scanned with, if any
+        """
+        with self._lock:
+            self._entries[(root_path, force, scope)] = ScanCacheEntry(root_path, change, result)
+
+    def invalidate(self, root_paths):
+        """
+        Forget the results for the specified roots, however they were scanned, e.g. because
+        they were just synced
+
+        :param root_paths:    List of root paths to invalidate
+        """
+        root_paths = set(root_paths)
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if key[0] in root_paths:
+                    del self._entries[key]
+
+    def synced(self, root_paths):
+        """
+        Forget the results for roots the framework is about to sync.  The sync moves the
+        have list of the workspace, which isn't taken for a change made by another tool
+        when the cache is next refreshed
+
+        :param root_paths:    List of root paths that are synced
+        """
+        self.invalidate(root_paths)
+        with self._lock:
+            self._syncing = True
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+    def refresh(self, p4, root_paths, force=False, scope=None):
+        """
+        Check the cached roots for submits newer than their last scan and invalidate
+        those that have them.  All roots scanned at the same change are checked with
+        a single 'changes -m1' query, only falling back to a query per root when that
+        reports a new submit.
+
+        :param p4:            The Perforce connection to use
+        :param root_paths:    The roots about to be scanned
+        :param force:         True if the scan is a forced (-f) dry run
+        :param scope:         The ScanFilter.scope the roots are about to be scanned with
+        :returns set:         The roots that still have a valid cached result
+        """
+        self._check_have_list(p4)
+
+        roots_by_change = {}
+        for root_path in set(root_paths):
+            entry = self.get(root_path, force, scope)
+            if entry:
+                roots_by_change.setdefault(entry.change, []).append(root_path)
+
+        current = set()
+        for change, roots in roots_by_change.items():
+            if not self._has_new_submits(p4, roots, change):
+                current.update(roots)
+                continue
+            for root_path in roots:
+                if self._has_new_submits(p4, [root_path], change):
+                    self.invalidate([root_path])
+                else:
+                    current.add(root_path)
+
+        logger.debug("Scan cache: %d of %d roots are current" % (len(current), len(set(root_paths))))
+        return current
+
+    def _check_have_list(self, p4):
+        """
+        Drop every entry if the have list of the workspace was changed by another tool since
+        the last refresh
+        """
+        have_change = get_have_change(p4)
+        with self._lock:
+            if self._have_change is not None and have_change != self._have_change and not self._syncing:
+                logger.debug("Scan cache: the have list changed from change %d to %d outside of a sync, "
+                             "dropping %d entries" % (self._have_change, have_change, len(self._entries)))
+                self._entries = {}
+            self._have_change = have_change
+            self._syncing = False
+
+    @staticmethod
+    def _has_new_submits(p4, root_paths, change):
+        try:
+            p4_res = p4.run_changes("-m1", "-s", "submitted",
+                                    ["%s@>%d" % (root_path, change) for root_path in root_paths])
+        except P4Exception as e:
+            raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
+        return bool([item for item in p4_res if isinstance(item, dict)])
+
+
+def get_highest_change(p4):
+    """
+    Return the highest submitted change on the server
+
+    :param p4:    The Perforce connection to use
+    :returns:     The change number as an int, 0 if there are no submitted changes
+    """
+    try:
+        p4_res = p4.run_changes("-m1", "-s", "submitted")
+    except P4Exception as e:
+        raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
+    for item in p4_res:
+        if isinstance(item, dict) and item.get("change"):
+            return int(item["change"])
+    return 0
+
+
+def get_have_change(p4):
+    """
+    Return the highest change of the revisions the workspace has
+
+    :param p4:    The Perforce connection to use
+    :returns:     The change number as an int, 0 if the workspace has no files
+    """
+    try:
+        p4_res = p4.run_changes("-m1", "//%s/...#have" % p4.client)
+    except P4Exception as e:
+        raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
+    for item in p4_res:
+        if isinstance(item, dict) and item.get("change"):
+            return int(item["change"])
+    return 0
+
+
+_g_scan_caches = {}
+_g_scan_caches_lock = threading.Lock()
+
+
+def get_scan_cache(server, client):
+    """
+    Return the session-wide scan cache for a server and workspace
+
+    :param server:    The Perforce server (p4.port)
+    :param client:    The Perforce workspace (p4.client)
+    :returns:         A ScanCache instance
+    """
+    with _g_scan_caches_lock:
+        return _g_scan_caches.setdefault((server, client), ScanCache())
@@ -0,0 +1,168 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Narrowing of the dry-run sync of a scan to the files the sync dialog's filters show
+"""
+
+import threading
+
+import sgtk
+
+from .publish_index import PublishIndex, STEP_FIELD, TYPE_FIELD
+
+logger = sgtk.platform.get_logger(__name__)
+
+FILTER_EXT = "ext"
+FILTER_STEP = "step"
+FILTER_TYPE = "type"
+
+# extensions containing Perforce wildcards or reserved characters can't be put in a file pattern
+RESERVED_CHARACTERS = "@#%*/\\"
+
+
+class ScanFilter(object):
+    """
+    Extensions are pushed into the file patterns the dry run is made for (e.g. 'root/....ma'),
+    so the server never lists files with other extensions.  With every extension switched
+    off nothing is scanned.  Steps and types aren't known to
+    Perforce: the publishes with a switched off step or type are looked up before the dry
+    run with prefetch() and their files are dropped from its output before they're handed
+    out to the assets.
+    """
+
+    def __init__(self, extensions=None, excluded_steps=None, excluded_types=None):
+        """
+        :param extensions:        Extensions to scan for, None scans all files and an empty
+                                  list none
+        :param excluded_steps:    Steps whose published files are left out
+        :param excluded_types:    Published file types whose files are left out
+        """
+        if extensions is not None:
+            extensions = sorted(set(ext.lower().lstrip(".") for ext in extensions))
+            if any(c in ext for ext in extensions for c in RESERVED_CHARACTERS) or "" in extensions:
+                logger.debug("Not narrowing the scan to extensions %s" % extensions)
+                extensions = None
+        self.extensions = extensions
+        self.excluded_steps = sorted(set(excluded_steps or []))
+        self.excluded_types = sorted(set(excluded_types or []))
+
+        self._lock = threading.Lock()
+        self._excluded_depot_paths = set()
+
+    @classmethod
+    def from_states(cls, states):
+        """
+        Build the filter from the on/off state of the filter values.  Extensions only narrow
+        the scan once one of them is switched off, new extensions would be missed otherwise.
+        Once all of them are switched off nothing is scanned.
+
+        :param states:             Filter type -> {value: enabled}, e.g. FilterIndex.states()
+        :returns ScanFilter:       The new filter
+        """
+        ext_states = states.get(FILTER_EXT) or {}
+        extensions = None
+        if not all(ext_states.values()):
+            extensions = [ext for ext, enabled in ext_states.items() if enabled]
+
+        def disabled(filter_type):
+            return [value for value, enabled in (states.get(filter_type) or {}).items() if not enabled]
+
+        return cls(extensions=extensions,
+                   excluded_steps=disabled(FILTER_STEP),
+                   excluded_types=disabled(FILTER_TYPE))
+
+    @property
+    def scope(self):
+        """
+        Key telling apart the dry-run results of differently narrowed scans, see ScanCache
+        """
+        return tuple(self.extensions) if self.extensions is not None else None
+
+    @property
+    def excludes_publishes(self):
+        return bool(self.excluded_steps or self.excluded_types)
+
+    def narrows(self, filter_type):
+        """
+        :returns bool:    True if the scan leaves out files for a filter type
+        """
+        if filter_type == FILTER_EXT:
+            return self.extensions is not None
+        if filter_type == FILTER_STEP:
+            return bool(self.excluded_steps)
+        if filter_type == FILTER_TYPE:
+            return bool(self.excluded_types)
+        return False
+
+    def is_left_out(self, filter_type, value):
+        """
+        :returns bool:    True if files with the filter value aren't part of the scan, so
+                          showing them again needs a rescan
+        """
+        if filter_type == FILTER_EXT:
+            return self.extensions is not None and str(value).lower() not in self.extensions
+        if filter_type == FILTER_STEP:
+            return value in self.excluded_steps
+        if filter_type == FILTER_TYPE:
+            return value in self.excluded_types
+        return False
+
+    def file_patterns(self, root_path, case_insensitive=False):
+        """
+        :param root_path:           A local root path, either a directory ending in '...' or a single file
+        :param case_insensitive:    True if the server matches file names regardless of case
+                                    (see P4.server_case_insensitive).  Otherwise the patterns
+                                    are made for the lower, upper and capitalized extension
+        :returns list:              The file patterns to run the dry run for instead of the root,
+                                    empty if nothing is to be scanned
+        """
+        if self.extensions is None or not root_path.endswith("..."):
+            return [root_path]
+        patterns = []
+        for ext in self.extensions:
+            variants = [ext] if case_insensitive else [ext, ext.upper(), ext.capitalize()]
+            for variant in variants:
+                pattern = "{}.{}".format(root_path, variant)
+                if pattern not in patterns:
+                    patterns.append(pattern)
+        return patterns
+
+    def prefetch(self, shotgun_getter, entities):
+        """
+        Look up the published files of the entities that have a switched off step or type.
+
+        :param shotgun_getter:    Callable returning a ShotGrid connection, e.g. `lambda: app.shotgun`
+        :param entities:          The entities (e.g. Assets) about to be scanned
+        """
+        if not self.excludes_publishes:
+            return
+        entities = [{"type": e.get("type"), "id": e.get("id")} for e in entities if e and e.get("id")]
+        filters = []
+        if self.excluded_steps:
+            filters.append([STEP_FIELD, "in", self.excluded_steps])
+        if self.excluded_types:
+            filters.append([TYPE_FIELD, "in", self.excluded_types])
+
+        index = PublishIndex.fetch(shotgun_getter,
+                                   entities=entities,
+                                   filters=[{"filter_operator": "any", "filters": filters}],
+                                   fields=["sg_p4_depo_path"])
+        with self._lock:
+            self._excluded_depot_paths.update(index.depot_paths())
+        logger.debug("Leaving %d published files out of the scan" % len(self._excluded_depot_paths))
+
+    def excludes(self, item):
+        """
+        :param item:      A file from the dry-run output
+        :returns bool:    True if the file's publish has a switched off step or type
+        """
+        with self._lock:
+            return item.get("depotFile") in self._excluded_depot_paths
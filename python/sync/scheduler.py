@@ -0,0 +1,321 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Priority and bandwidth aware scheduling of sync batches
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+import sgtk
+
+from .executor import make_sync_batches, DEFAULT_BATCH_MAX_FILES, DEFAULT_BATCH_MAX_BYTES
+
+logger = sgtk.platform.get_logger(__name__)
+
+DEFAULT_MAX_TRANSFERS = 4
+
+# files up to these sizes (in bytes) are put in the same priority class when small
+# files are synced first, anything bigger goes last
+DEFAULT_SIZE_CLASSES = [16 * 1024 * 1024, 256 * 1024 * 1024]
+
+# priority of promoted batches, ahead of any other priority
+PROMOTED = (-1,)
+
+# longest time in seconds a transfer held back by the bandwidth limit waits before
+# checking if it was cancelled
+THROTTLE_POLL_INTERVAL = 0.1
+
+
+class SyncPriority(object):
+    """
+    Decides the order files are synced in.  Files are ordered by:
+
+    - whether they belong to a selected group (e.g. the assets selected in the dialog)
+    - the rank of their publish type in type_order, types not listed go after those listed
+    - their size class, so that small files arrive before big caches
+    """
+
+    def __init__(self, selected_groups=None, type_order=None, small_files_first=True,
+                 size_classes=DEFAULT_SIZE_CLASSES):
+        """
+        :param selected_groups:      Groups to sync before any other
+        :param type_order:           List of publish types, in the order to sync them in
+        :param small_files_first:    True to sync small files before big ones
+        :param size_classes:         Upper bounds in bytes of the size classes
+        """
+        self.selected_groups = set(selected_groups or [])
+        self.type_ranks = dict((t, rank) for rank, t in enumerate(type_order or []))
+        self.small_files_first = small_files_first
+        self.size_classes = sorted(size_classes)
+
+    def key(self, group, size=0, publish_type=None):
+        """
+        :returns tuple:    The priority of a file, lower sorts first
+        """
+        selected = 0 if group in self.selected_groups else 1
+        type_rank = self.type_ranks.get(publish_type, len(self.type_ranks))
+        size_class = 0
+        if self.small_files_first:
+            size_class = len(self.size_classes)
+            for index, limit in enumerate(self.size_classes):
+                if size <= limit:
+                    size_class = index
+                    break
+        return (selected, type_rank, size_class)
+
+
+class BandwidthLimiter(object):
+    """
+    Token bucket shared by all transfers to cap the overall sync bandwidth.  Callers
+    report the bytes they transferred and are held back for as long as they're ahead
+    of the allowed rate, or until the limiter or the caller is cancelled.
+    """
+
+    def __init__(self, bytes_per_second, burst=None):
+        """
+        :param bytes_per_second:    The maximum average rate
+        :param burst:               Maximum number of bytes that can be transferred at once
+                                    after a pause.  Defaults to one second's worth
+        """
+        self.rate = float(bytes_per_second)
+        self.burst = float(burst or bytes_per_second)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    def consume(self, nbytes, cancelled=None):
+        """
+        Account for nbytes being transferred, blocking until that's within the rate
+
+        :param nbytes:       Number of bytes transferred
+        :param cancelled:    Optional callable returning True once the caller should stop
+                             waiting.  It's polled every THROTTLE_POLL_INTERVAL seconds
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= nbytes
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        deadline = time.monotonic() + wait
+        while wait > 0 and not (cancelled and cancelled()):
+            if self._cancelled.wait(min(wait, THROTTLE_POLL_INTERVAL)):
+                return
+            wait = deadline - time.monotonic()
+
+    def cancel(self):
+        """
+        Release every transfer held back, now and from now on.  Safe to call from any thread
+        """
+        self._cancelled.set()
+
+
+class SyncScheduler(object):
+    """
+    Queue of sync batches that hands out the highest priority batch first and
+    limits the number of batches transferring at the same time.  Queued batches of
+    a group can be promoted to the front while the sync is running.
+
+    Workers loop on get() and call task_done() when they've synced a batch:
+
+        while True:
+            batch = scheduler.get()
+            if batch is None:
+                break
+            probe = LatencyProbe()
+            try:
+                run_sync_batch(p4, batch.paths, on_file=..., throttle=scheduler.throttle)
+            finally:
+                scheduler.task_done(batch, probe.latency, probe.error)
+    """
+
+    def __init__(self, max_transfers=DEFAULT_MAX_TRANSFERS, bandwidth_limit=None, priority=None,
+                 max_files=DEFAULT_BATCH_MAX_FILES, max_bytes=DEFAULT_BATCH_MAX_BYTES, concurrency=None):
+        """
+        :param max_transfers:      Maximum number of batches syncing at the same time, when
+                                   there's no concurrency controller
+        :param bandwidth_limit:    Optional maximum overall rate in bytes per second
+        :param priority:           SyncPriority deciding the order, defaults to small files first
+        :param max_files:          Maximum number of files in a batch
+        :param max_bytes:          Maximum size of a batch
+        :param concurrency:        Optional ConcurrencyController deciding the number of batches
+                                   syncing at the same time from the latency of the batches
+        """
+        self.max_transfers = max(1, max_transfers)
+        self.concurrency = concurrency
+        self.priority = priority or SyncPriority()
+        self.limiter = BandwidthLimiter(bandwidth_limit) if bandwidth_limit else None
+        self._max_files = max_files
+        self._max_bytes = max_bytes
+
+        self._condition = threading.Condition()
+        self._queue = []
+        self._counter = itertools.count()
+        # batch id -> sequence number of its current queue entry, older entries are stale
+        self._entries = {}
+        self._batches_by_group = {}
+        self._running = 0
+        self._closed = False
+
+    @property
+    def max_running(self):
+        """
+        Number of batches that may sync at the same time
+        """
+        return self.concurrency.limit if self.concurrency else self.max_transfers
+
+    @property
+    def pending(self):
+        """
+        Number of batches still queued
+        """
+        with self._condition:
+            return len(self._entries)
+
+    def add(self, files_by_group, publish_types=None):
+        """
+        Queue files to sync.  The files of each group are split into batches per
+        priority class.
+
+        :param files_by_group:    Dictionary of group -> list of (path, size in bytes) tuples
+        :param publish_types:     Optional dictionary of path -> publish type
+        :returns list:            The queued SyncBatch instances
+        """
+        publish_types = publish_types or {}
+        files_by_class = {}
+        for group, files in files_by_group.items():
+            for path, size in files:
+                key = self.priority.key(group, size, publish_types.get(path))
+                files_by_class.setdefault((key, group), []).append((path, size))
+
+        batches = []
+        with self._condition:
+            for (key, group), files in sorted(files_by_class.items(), key=lambda i: i[0][0]):
+                for batch in make_sync_batches({group: files}, self._max_files, self._max_bytes):
+                    self._push(key, batch)
+                    self._batches_by_group.setdefault(group, []).append(batch)
+                    batches.append(batch)
+            self._condition.notify_all()
+        return batches
+
+    def promote(self, group):
+        """
+        Move the queued batches of a group ahead of everything else
+
+        :returns int:    The number of batches promoted
+        """
+        with self._condition:
+            promoted = 0
+            for batch in self._batches_by_group.get(group, []):
+                if id(batch) in self._entries:
+                    self._push(PROMOTED, batch)
+                    promoted += 1
+            self._condition.notify_all()
+        logger.debug("Promoted %d batches of %s" % (promoted, group))
+        return promoted
+
+    def get(self, timeout=None):
+        """
+        Take the next batch to sync, waiting for a transfer slot to free up.
+
+        :param timeout:    Optional maximum time in seconds to wait
+        :returns:          A SyncBatch, or None when the queue is empty and closed, or
+                           the timeout expired
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._condition:
+            while True:
+                if self._running < self.max_running:
+                    batch = self._pop()
+                    if batch is not None:
+                        self._running += 1
+                        return batch
+                    if self._closed:
+                        return None
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def task_done(self, batch, latency=None, error=None):
+        """
+        Report that a batch taken with get() has been synced
+
+        :param batch:      The batch
+        :param latency:    Optional seconds the sync took to get its first answer from the server,
+                           passed on to the concurrency controller along with the error
+        :param error:      The error the sync failed with, if any
+        """
+        if self.concurrency and latency is not None:
+            self.concurrency.record(latency, error)
+        with self._condition:
+            self._running -= 1
+            group_batches = self._batches_by_group.get(batch.group)
+            if group_batches and batch in group_batches:
+                group_batches.remove(batch)
+            self._condition.notify_all()
+
+    def throttle(self, nbytes, cancelled=None):
+        """
+        Account for transferred bytes against the bandwidth limit, blocking the caller
+        while it's ahead of the allowed rate.  Called from the transfer progress of a sync,
+        so a transfer is held back while it runs rather than once it has completed
+
+        :param nbytes:       Number of bytes transferred
+        :param cancelled:    Optional callable returning True once the caller should stop waiting
+        """
+        if self.limiter and nbytes:
+            self.limiter.consume(nbytes, cancelled)
+
+    def close(self):
+        """
+        No more batches will be added, get() returns None once the queue is empty
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def cancel(self):
+        """
+        Drop all queued batches and close the queue
+
+        :returns list:    The batches that were dropped
+        """
+        with self._condition:
+            dropped = []
+            while self._queue:
+                batch = self._pop()
+                if batch is None:
+                    break
+                dropped.append(batch)
+            self._batches_by_group = {}
+            self._closed = True
+            self._condition.notify_all()
+        if self.limiter:
+            self.limiter.cancel()
+        return dropped
+
+    def _push(self, key, batch):
+        seq = next(self._counter)
+        self._entries[id(batch)] = seq
+        heapq.heappush(self._queue, (key, seq, batch))
+
+    def _pop(self):
+        while self._queue:
+            key, seq, batch = heapq.heappop(self._queue)
+            if self._entries.get(id(batch)) == seq:
+                del self._entries[id(batch)]
+                return batch
+        return None
@@ -11,5 +11,8 @@
 from .files import get_client_file_details, get_depot_file_details, sync_published_file, open_file_for_edit
 from .files import client_to_depot_paths, depot_to_client_paths, P4InvalidFileNameException
 from .change import create_change, add_to_change, find_change_containing, submit_change, get_change_details
+from .change import ChangeSubmitter, PartialSubmitError, find_changes_containing
+from .change_cache import SubmittedChangeCache
 from .url import url_from_depot_path, depot_path_from_url
+from .url import urls_from_depot_paths, depot_paths_from_urls, get_url_codec, PerforceUrlCodec
 from .reconcile import reconcile_files
@@ -11,11 +11,20 @@
 """
 Common utilities for working with Perforce changes
 """
+import os
+import re
+import time
+
 from P4 import P4Exception
 from sgtk import TankError, LogManager
 
+from .change_cache import get_submitted_change_cache
+
 log = LogManager.get_logger(__name__)
 
+# maximum number of paths to pass to a single fstat call
+FSTAT_CHUNK_SIZE = 1000
+
 
 def create_change(p4, description):
     """
@@ -70,69 +79,437 @@ def add_to_change(p4, change, file_paths, dry_run=False):
 def find_change_containing(p4, path):
     """
     Find the current change that the specified path is in.
+
+    :param p4:      The Perforce connection
+    :param path:    The local or depot path to look for
+    :returns:       The change the path is opened in ('default' for the default
+                    change) or None if the path isn't opened
     """
-    try:
-        p4_res = p4.run_fstat(path)
-    except P4Exception as e:
-        raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
+    return find_changes_containing(p4, [path]).get(path)
 
-    change = p4_res[0].get("change")
-    return change
 
+def find_changes_containing(p4, paths, chunk_size=FSTAT_CHUNK_SIZE):
+    """
+    Find the current change that each of the specified paths is opened in.  This
+    runs a single projected fstat per chunk of paths rather than one per path.
 
-def submit_change(p4, change, dry_run=False):
+    :param p4:            The Perforce connection
+    :param paths:         List of local and/or depot paths to look for
+    :param chunk_size:    Maximum number of paths to pass to each fstat call
+    :returns dict:        A dictionary mapping each path to the change it is opened in
+                          ('default' for the default change).  Paths that aren't opened
+                          in the current workspace are mapped to None
     """
-    Submit the specified change
+    if isinstance(paths, str):
+        paths = [paths]
+
+    change_lookup = {}
+    for chunk_start in range(0, len(paths), chunk_size):
+        chunk = paths[chunk_start:chunk_start + chunk_size]
+        try:
+            # -Ro limits the results to opened files and -T projects just the fields we need.
+            # Paths that aren't opened only produce a warning so don't raise.
+            p4_res = p4.run_fstat("-Ro", "-T", "change,depotFile,clientFile", chunk)
+        except P4Exception as e:
+            raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
+
+        for item in p4_res:
+            if not isinstance(item, dict) or not item.get("change"):
+                continue
+            for path_field in ["depotFile", "clientFile"]:
+                if item.get(path_field):
+                    change_lookup[_normalize_path(item[path_field])] = item["change"]
+
+    return dict((path, change_lookup.get(_normalize_path(path))) for path in paths)
+
+
+def _normalize_path(path):
     """
-    try:
-        change_spec = p4.fetch_change("-o", str(change))
+    Normalize a local or depot path so that fstat results can be matched with
+    the paths that were requested
+    """
+    path = path.replace("\\", "/")
+    if not path.startswith("//"):
+        path = os.path.normcase(path).replace("\\", "/")
+    return path
+
+
+# error fragments that indicate a submit failed for a transient reason (network
+# drop, server busy) rather than because of a problem with the change itself
+TRANSIENT_SUBMIT_ERRORS = [
+    "TCP receive failed",
+    "TCP send failed",
+    "Connection reset",
+    "Connection refused",
+    "Partner exited unexpectedly",
+    "RpcTransmit",
+    "timed out",
+    "Too many",
+    "resource limit",
+]
+
+# regex to extract the change to resubmit from a failed submit error, e.g.:
+#   "Submit failed -- fix problems above then use 'p4 submit -c 1234'."
+SUBMIT_RETRY_CHANGE_REGEX = re.compile(r"p4 submit -c (?P<change>[0-9]+)")
+
+
+class PartialSubmitError(TankError):
+    """
+    Raised when a split change fails to submit after some of its sub-changes were submitted
+    """
+    def __init__(self, message, submitted_changes, pending_changes):
+        """
+        :param message:              The error the failed sub-change was submitted with
+        :param submitted_changes:    The changes submitted before the failure, in order
+        :param pending_changes:      The sub-changes left pending, starting with the one that
+                                     failed
+        """
+        TankError.__init__(self, "%s (changes %s were submitted, changes %s are still pending)"
+                           % (message, ", ".join(submitted_changes), ", ".join(pending_changes)))
+        self.submitted_changes = submitted_changes
+        self.pending_changes = pending_changes
+
+
+def _submitted_change(submit):
+    """
+    Return the submitted change number from the output of run_submit, None if it isn't there
+    """
+    for item in reversed(submit):
+        if isinstance(item, dict) and item.get("submittedChange"):
+            return item["submittedChange"]
+    return None
+
+
+class ChangeSubmitter(object):
+    """
+    Submit engine for large changes.  Supports parallel file transfer ('submit --parallel'),
+    splitting an oversized change into size-bounded sub-changes that are submitted in
+    order, streaming per-file progress through a ProgressHandler and retrying submits
+    that fail for transient reasons.
+    """
+
+    def __init__(self, p4, parallel_threads=0, parallel_batch=None, max_change_size=None,
+                 progress=None, retries=0, retry_delay=5.0):
+        """
+        :param p4:                  The Perforce connection to submit with
+        :param parallel_threads:    Number of threads to transfer files with.  0 or 1 disables
+                                    parallel submit.  The server must allow this through
+                                    the net.parallel.max configurable
+        :param parallel_batch:      Optional number of files sent in each parallel batch
+        :param max_change_size:     If set, changes whose files add up to more than this many
+                                    bytes are split into sub-changes of at most this size
+        :param progress:            Optional ProgressHandler to receive per-file progress
+        :param retries:             Number of times to retry a submit that fails for a
+                                    transient reason
+        :param retry_delay:         Seconds to wait before the first retry.  This doubles
+                                    for each subsequent retry
+        """
+        self._p4 = p4
+        self._parallel_threads = parallel_threads
+        self._parallel_batch = parallel_batch
+        self._max_change_size = max_change_size
+        self._progress = progress
+        self._retries = retries
+        self._retry_delay = retry_delay
+
+    def submit(self, change, dry_run=False):
+        """
+        Submit the specified change, splitting it first if needed.
+
+        :param change:     The pending change to submit
+        :param dry_run:    If True, validate the submit without submitting anything.  The
+                           change is never split when doing a dry run
+        :returns list:     The combined output of run_submit for each (sub-)change submitted
+        :raises PartialSubmitError: If a sub-change fails to submit after earlier sub-changes
+                                    were submitted
+        """
         if dry_run:
-            # -n flag is to do a dry run
-            submit = p4.run_submit("-n", change_spec)
-        else:
-            # no -n flag, so this will actually run the command
-            submit = p4.run_submit(change_spec)
-        """
-        run_submit returns a list of dicts, something like this:
-        [{'change': '90', 'locked': '2'},
-         "Possible string in here",
-         {'action': 'edit',
-          'depotFile': '//deva/Tool/ScorchedEarth/ToolCategory/ToolTestAsset/deva_ScorchedEarth_ToolTestAsset_concept.psd',
-          'rev': '2'},
-         {'action': 'edit',
-          'depotFile': '//deva/Tool/ScorchedEarth/ToolCategory/ToolTestAsset/deva_ScorchedEarth_ToolTestAsset_concept_alt.psd',
-          'rev': '4'},
-         {'submittedChange': '90'}]
+            return self._run_submit(str(change), dry_run=True)
+
+        submit = []
+        submitted_changes = []
+        sub_changes = self.split_change(change)
+        for sub_change_index, sub_change in enumerate(sub_changes):
+            try:
+                sub_submit = self._submit_with_retry(sub_change)
+            except TankError as e:
+                if not submitted_changes:
+                    raise
+                raise PartialSubmitError(str(e), submitted_changes, sub_changes[sub_change_index:])
+            submit.extend(sub_submit)
+            submitted_changes.append(_submitted_change(sub_submit) or sub_change)
+        return submit
+
+    def split_change(self, change):
         """
+        Split the specified change into sub-changes of at most max_change_size bytes. Files
+        are moved out of the original change into new changes in the order they are listed
+        so the first group stays in the original change.
+
+        :param change:    The pending change to split
+        :returns list:    The list of changes to submit, in order
+        """
+        change = str(change)
+        if not self._max_change_size:
+            return [change]
+
+        groups = []
+        group = []
+        group_size = 0
+        for depot_path, size in self._get_opened_file_sizes(change):
+            if group and group_size + size > self._max_change_size:
+                groups.append(group)
+                group = []
+                group_size = 0
+            group.append(depot_path)
+            group_size += size
+        if group:
+            groups.append(group)
+
+        if len(groups) < 2:
+            return [change]
+
+        description = self._p4.fetch_change(change)._description.strip()
+        sub_changes = [change]
+        for group_index, group in enumerate(groups[1:], 2):
+            sub_change = create_change(self._p4, "%s\n\n(part %d of %d)" % (description, group_index, len(groups)))
+            add_to_change(self._p4, sub_change, group)
+            sub_changes.append(sub_change)
+
+        log.debug("Split change %s into %d sub-changes: %s" % (change, len(sub_changes), sub_changes))
+        return sub_changes
+
+    def _get_opened_file_sizes(self, change):
+        """
+        Return (depot path, local file size) for each file opened in the specified change
+        """
+        try:
+            p4_res = self._p4.run_fstat("-Ro", "-e", change, "-T", "depotFile,clientFile",
+                                        "//%s/..." % self._p4.client)
+        except P4Exception as e:
+            raise TankError("Perforce: %s" % (self._p4.errors[0] if self._p4.errors else e))
+
+        file_sizes = []
+        for item in p4_res:
+            if not isinstance(item, dict) or "depotFile" not in item:
+                continue
+            client_file = item.get("clientFile")
+            size = 0
+            if client_file and os.path.isfile(client_file):
+                size = os.path.getsize(client_file)
+            file_sizes.append((item["depotFile"], size))
+        return file_sizes
+
+    def _submit_with_retry(self, change):
+        """
+        Submit a single change, retrying transient failures with an exponential back-off.
+        A transient failure can happen after the server has already committed the change,
+        e.g. when the connection drops while the reply is sent, so the change is looked up
+        before it is resubmitted
+        """
+        attempt = 0
+        while True:
+            try:
+                return self._run_submit(change)
+            except P4Exception as e:
+                errors = list(self._p4.errors) or [str(e)]
+                if not self._is_transient(errors):
+                    raise TankError("Perforce: %s" % errors[0])
+
+                self._reconnect()
+                submitted_change = self._find_submitted_change(change)
+                if submitted_change:
+                    log.info("Submit of change %s failed (%s) but the server submitted it as change %s"
+                             % (change, errors[0], submitted_change))
+                    return [{"submittedChange": submitted_change}]
+
+                if attempt >= self._retries:
+                    raise TankError("Perforce: %s" % errors[0])
+
+                # a failed submit may renumber the change so make sure we resubmit the right one:
+                for error in errors:
+                    mo = SUBMIT_RETRY_CHANGE_REGEX.search(error)
+                    if mo:
+                        change = mo.group("change")
+                        break
+
+                delay = self._retry_delay * (2 ** attempt)
+                attempt += 1
+                log.warning("Submit of change %s failed (%s), retrying in %.1fs (%d/%d)"
+                            % (change, errors[0], delay, attempt, self._retries))
+                time.sleep(delay)
+                self._reconnect()
+
+    def _reconnect(self):
+        """
+        Reconnect after a dropped connection.  A failure is left to the next command to report
+        """
+        if not self._p4.connected():
+            try:
+                self._p4.connect()
+            except P4Exception:
+                pass
+
+    def _find_submitted_change(self, change):
+        """
+        Check if the specified pending change has been submitted.  The change may have been
+        renumbered on submit so it's looked up by its original number
+
+        :param change:    The pending change number
+        :returns str:     The submitted change number or None if the change is still pending
+                          or its status can't be determined
+        """
+        try:
+            p4_res = self._p4.run_describe("-s", "-O", change)
+        except P4Exception as e:
+            log.debug("Failed to look up the status of change %s: %s"
+                      % (change, self._p4.errors[0] if self._p4.errors else e))
+            return None
+
+        for item in p4_res:
+            if isinstance(item, dict) and item.get("status") == "submitted":
+                return item.get("change")
+        return None
+
+    def _run_submit(self, change, dry_run=False):
+        """
+        Run the actual submit command for a single change
+        """
+        args = []
+        if dry_run:
+            # -n flag is to do a dry run
+            args.append("-n")
+        if self._parallel_threads and self._parallel_threads > 1 and not dry_run:
+            parallel = "threads=%d" % self._parallel_threads
+            if self._parallel_batch:
+                parallel += ",batch=%d" % self._parallel_batch
+            args.append("--parallel=%s" % parallel)
+
+        previous_progress = self._p4.progress
+        if self._progress:
+            self._p4.progress = self._progress
+        try:
+            submit = self._p4.run_submit(args, "-c", change)
+        finally:
+            self._p4.progress = previous_progress
+
         log.debug("Return of run_submit: {}".format(submit))
         return submit
-    except P4Exception as e:
-        raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
+
+    def _is_transient(self, errors):
+        """
+        Check if any of the errors indicate a transient failure
+        """
+        for error in errors:
+            for transient_error in TRANSIENT_SUBMIT_ERRORS:
+                if transient_error.lower() in error.lower():
+                    return True
+        return False
 
 
-def get_change_details(p4, changes):
+def submit_change(p4, change, dry_run=False, parallel_threads=0, max_change_size=None, progress=None, retries=0):
     """
-    Get the changes details for one or more changes
+    Submit the specified change
 
-    :param p4:         The Perforce connection
-    :param changes:    The list of changes to query Perforce for
-    :returns dict:     A dictionary mapping each change to the details found
+    :param p4:                  The Perforce connection
+    :param change:              The pending change to submit
+    :param dry_run:             If True, validate the submit without submitting anything
+    :param parallel_threads:    Number of threads to use for 'submit --parallel'.  0 disables
+                                parallel submit
+    :param max_change_size:     If set, split the change into sub-changes of at most this
+                                many bytes, each submitted in order
+    :param progress:            Optional ProgressHandler to receive per-file progress
+    :param retries:             Number of times to retry transient submit failures
+    :returns list:              The output of run_submit.  When a change is split, the output
+                                of each sub-change submit is concatenated in order
     """
+    if not (parallel_threads or max_change_size or progress or retries):
+        try:
+            change_spec = p4.fetch_change("-o", str(change))
+            if dry_run:
+                # -n flag is to do a dry run
+                submit = p4.run_submit("-n", change_spec)
+            else:
+                # no -n flag, so this will actually run the command
+                submit = p4.run_submit(change_spec)
+            """
+            run_submit returns a list of dicts, something like this:
+            [{'change': '90', 'locked': '2'},
+             "Possible string in here",
+             {'action': 'edit',
+              'depotFile': '//deva/Tool/ScorchedEarth/ToolCategory/ToolTestAsset/deva_ScorchedEarth_ToolTestAsset_concept.psd',
+              'rev': '2'},
+             {'action': 'edit',
+              'depotFile': '//deva/Tool/ScorchedEarth/ToolCategory/ToolTestAsset/deva_ScorchedEarth_ToolTestAsset_concept_alt.psd',
+              'rev': '4'},
+             {'submittedChange': '90'}]
+            """
+            log.debug("Return of run_submit: {}".format(submit))
+            return submit
+        except P4Exception as e:
+            raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
+
+    submitter = ChangeSubmitter(p4,
+                                parallel_threads=parallel_threads,
+                                max_change_size=max_change_size,
+                                progress=progress,
+                                retries=retries)
     try:
-        p4_res = p4.run_describe(changes)
+        return submitter.submit(change, dry_run=dry_run)
     except P4Exception as e:
         raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
 
+
+def get_change_details(p4, changes, include_diffs=False, use_cache=True):
+    """
+    Get the changes details for one or more changes
+
+    Submitted changes never change so, unless diffs are requested, their
+    details are served from (and stored in) the on-disk submitted change
+    cache.  Pending changes are always fetched from the server.
+
+    :param p4:               The Perforce connection
+    :param changes:          The list of changes to query Perforce for
+    :param include_diffs:    If True then the full file diffs are included in the
+                             details.  Otherwise 'describe -s' is used which is much
+                             cheaper for the server to compute
+    :param use_cache:        If True then look up/store submitted changes in the
+                             submitted change cache
+    :returns dict:           A dictionary mapping each change to the details found
+    """
+    change_keys = [str(change) for change in changes]
+
+    cache = None
     p4_res_lookup = {}
-    for item in p4_res:
-        change = item.get("change")
-        if not change:
-            continue
-        p4_res_lookup[change] = item
+    if use_cache and not include_diffs:
+        cache = get_submitted_change_cache()
+        p4_res_lookup.update(cache.get_many(p4.port, change_keys))
+
+    changes_to_describe = [change for change in change_keys if change not in p4_res_lookup]
+    if changes_to_describe:
+        describe_args = [] if include_diffs else ["-s"]
+        try:
+            p4_res = p4.run_describe(describe_args, changes_to_describe)
+        except P4Exception as e:
+            raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
+
+        submitted = {}
+        for item in p4_res:
+            if not isinstance(item, dict):
+                continue
+            change = item.get("change")
+            if not change:
+                continue
+            p4_res_lookup[change] = item
+            if item.get("status") == "submitted":
+                submitted[change] = item
+
+        if cache:
+            cache.put_many(p4.port, submitted)
 
     change_details = {}
-    for change in changes:
-        details = p4_res_lookup.get(change)
+    for change, change_key in zip(changes, change_keys):
+        details = p4_res_lookup.get(change_key)
         change_details[change] = details
 
     return change_details
@@ -0,0 +1,194 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Persistent cache of submitted change descriptions
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+import sgtk
+
+logger = sgtk.LogManager.get_logger(__name__)
+
+
+class SubmittedChangeCache(object):
+    """
+    On-disk LRU cache of 'describe -s' results for submitted changes, keyed by
+    (server, change).  Submitted changes are immutable so entries never need to
+    be invalidated, only evicted once the cache grows beyond its size cap.
+    """
+
+    DEFAULT_MAX_ENTRIES = 5000
+
+    def __init__(self, cache_path, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        :param cache_path:     Path to the sqlite file used to store the cache
+        :param max_entries:    Maximum number of changes to keep before the least
+                               recently used ones are evicted
+        """
+        self._cache_path = cache_path
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    @property
+    def cache_path(self):
+        return self._cache_path
+
+    def get_many(self, server, changes):
+        """
+        Look up the cached details for the specified changes.
+
+        :param server:     The Perforce server (p4.port) the changes belong to
+        :param changes:    List of change numbers (as strings)
+        :returns dict:     A dictionary of change -> details for all changes found in the cache
+        """
+        if not changes:
+            return {}
+
+        found = {}
+        with self._lock:
+            try:
+                with self._connect() as db:
+                    for chunk in _chunks(changes, 500):
+                        rows = db.execute(
+                            "SELECT change, data FROM changes WHERE server = ? AND change IN (%s)"
+                            % ",".join("?" * len(chunk)),
+                            [server] + list(chunk)
+                        ).fetchall()
+                        for change, data in rows:
+                            found[change] = json.loads(data)
+
+                    if found:
+                        # touch the entries so they're treated as most recently used:
+                        now = time.time()
+                        db.executemany(
+                            "UPDATE changes SET accessed = ? WHERE server = ? AND change = ?",
+                            [(now, server, change) for change in found]
+                        )
+            except (sqlite3.Error, ValueError) as e:
+                logger.warning("Failed to read the change cache '%s': %s" % (self._cache_path, e))
+                return {}
+
+        return found
+
+    def put_many(self, server, change_details):
+        """
+        Store details for one or more submitted changes.
+
+        :param server:            The Perforce server (p4.port) the changes belong to
+        :param change_details:    A dictionary of change -> details to store
+        """
+        if not change_details:
+            return
+
+        with self._lock:
+            try:
+                with self._connect() as db:
+                    now = time.time()
+                    db.executemany(
+                        "INSERT OR REPLACE INTO changes (server, change, data, accessed) VALUES (?, ?, ?, ?)",
+                        [(server, change, json.dumps(details), now) for change, details in change_details.items()]
+                    )
+                    # evict the least recently used entries beyond the cap:
+                    db.execute(
+                        "DELETE FROM changes WHERE rowid IN "
+                        "(SELECT rowid FROM changes ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                        (self._max_entries,)
+                    )
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                logger.warning("Failed to write the change cache '%s': %s" % (self._cache_path, e))
+
+    def clear(self):
+        """
+        Remove all entries from the cache
+        """
+        with self._lock:
+            try:
+                with self._connect() as db:
+                    db.execute("DELETE FROM changes")
+            except sqlite3.Error as e:
+                logger.warning("Failed to clear the change cache '%s': %s" % (self._cache_path, e))
+
+    def _connect(self):
+        """
+        Open a connection to the cache database, creating the schema the first
+        time it's used.  Connections are opened per operation so that the cache
+        can safely be used from any thread.
+        """
+        if not self._initialized:
+            cache_dir = os.path.dirname(self._cache_path)
+            if cache_dir and not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+
+        db = sqlite3.connect(self._cache_path, timeout=10)
+        if not self._initialized:
+            with db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS changes ("
+                    "server TEXT NOT NULL, change TEXT NOT NULL, data TEXT NOT NULL, accessed REAL NOT NULL, "
+                    "PRIMARY KEY (server, change))"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS changes_accessed ON changes (accessed)")
+            self._initialized = True
+        return _ClosingConnection(db)
+
+
+class _ClosingConnection(object):
+    """
+    Wraps a sqlite connection so that it commits/rolls back and is then closed when
+    used as a context manager (sqlite3 connections only handle the transaction).
+    """
+
+    def __init__(self, db):
+        self._db = db
+
+    def __enter__(self):
+        self._db.__enter__()
+        return self._db
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            return self._db.__exit__(exc_type, exc_value, tb)
+        finally:
+            self._db.close()
+
+
+def _chunks(items, size):
+    """
+    Split a list into consecutive chunks of at most size items
+    """
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+_g_change_cache = None
+_g_change_cache_lock = threading.Lock()
+
+
+def get_submitted_change_cache():
+    """
+    Return the shared submitted change cache for the current framework, creating it
+    in the framework's cache location the first time it's requested.
+
+    :returns SubmittedChangeCache:    The shared cache instance
+    """
+    global _g_change_cache
+    with _g_change_cache_lock:
+        if _g_change_cache is None:
+            fw = sgtk.platform.current_bundle()
+            cache_path = os.path.join(fw.cache_location, "p4_submitted_changes.db")
+            _g_change_cache = SubmittedChangeCache(cache_path)
+        return _g_change_cache
@@ -1,11 +1,23 @@
 import sgtk
 from P4 import P4Exception, Progress
 logger = sgtk.LogManager.get_logger(__name__)
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import deque
+from datetime import timedelta
 
 from sgtk.platform.qt import QtCore
 
 
+# bytes in each unit Perforce reports transfer progress in.  Progress counted in files or
+# as a percentage isn't included, it mustn't be added to byte totals
+UNIT_BYTES = {
+    0: 1,               # unspecified, file transfers are counted in bytes
+    3: 1024,            # kilobytes
+    4: 1024 * 1024,     # megabytes
+}
+
+
 def sizeof_fmt(num, suffix="B"):
     num *= 1024.0
     if suffix in ["b", "bps"]:
@@ -16,11 +28,21 @@ def sizeof_fmt(num, suffix="B"):
         num /= 1024.0
     return "{num:.1f}Y{suffix}".format(num=num,suffix=suffix)
 
+
+def format_time_remaining(seconds):
+    """
+    Format an ETA in seconds as H:MM:SS, dropping fractions of a second
+    """
+    if seconds is None:
+        return ""
+    return str(timedelta(seconds=int(seconds)))
+
+
 class ProgressSignaller(QtCore.QObject):
     """
     Create signaller class for to signal from the progress handler
     """
-    
+
     total_size = QtCore.Signal(str)
     transfer_rate = QtCore.Signal(str)
 
@@ -30,18 +52,266 @@ class ProgressSignaller(QtCore.QObject):
     finished = QtCore.Signal()
 
 
+class ThroughputMeter(object):
+    """
+    Moving average of transfer throughput over a time window, measured with a monotonic clock
+    """
+
+    def __init__(self, window=5.0):
+        """
+        :param window:    Number of seconds of samples to average the throughput over
+        """
+        self.window = window
+        self._samples = deque()
+
+    def add_sample(self, transferred, now=None):
+        """
+        Record the total number of bytes transferred so far
+
+        :param transferred:    Total bytes transferred at this point in time
+        :param now:            Optional monotonic timestamp of the sample
+        """
+        now = time.monotonic() if now is None else now
+        self._samples.append((now, transferred))
+        while len(self._samples) > 2 and now - self._samples[0][0] > self.window:
+            self._samples.popleft()
+
+    @property
+    def rate(self):
+        """
+        Bytes per second averaged over the window, or 0.0 if not enough samples yet
+        """
+        if len(self._samples) < 2:
+            return 0.0
+        (start_time, start_size), (end_time, end_size) = self._samples[0], self._samples[-1]
+        elapsed = end_time - start_time
+        if elapsed <= 0:
+            return 0.0
+        return max(0.0, float(end_size - start_size) / elapsed)
+
+    def eta(self, remaining):
+        """
+        Estimated seconds to transfer the remaining number of bytes, or None if unknown
+        """
+        rate = self.rate
+        if not rate:
+            return None
+        return remaining / rate
+
+
+class ProgressAggregator(QtCore.QObject):
+    """
+    Aggregates progress updates from many concurrent transfers (any thread) and emits
+    coalesced updates at a fixed rate from the thread that owns the aggregator.  This
+    keeps the UI thread from being flooded by per-callback signals in parallel syncs.
+
+    Exposes the same signals as ProgressSignaller (for the overall progress) as well as
+    an `updated` signal carrying a snapshot dictionary with per-file and overall totals.
+    Transfers are counted in bytes.
+    """
+
+    total_size = QtCore.Signal(str)
+    transfer_rate = QtCore.Signal(str)
+    description = QtCore.Signal(str)
+    time_remaining = QtCore.Signal(str)
+    percent_done = QtCore.Signal(float)
+    finished = QtCore.Signal()
+
+    updated = QtCore.Signal(dict)
+
+    DEFAULT_RATE_HZ = 10
+
+    def __init__(self, rate_hz=DEFAULT_RATE_HZ, window=5.0, parent=None):
+        """
+        :param rate_hz:    Maximum number of updates to emit per second
+        :param window:     Number of seconds to average the throughput over
+        :param parent:     Optional parent QObject
+        """
+        QtCore.QObject.__init__(self, parent)
+
+        self._lock = threading.Lock()
+        self._transfers = {}
+        self._transferred = 0
+        self._total = 0
+        self._files_done = 0
+        self._files_failed = 0
+        self._meter = ThroughputMeter(window)
+        self._dirty = False
+        self._last_description = ""
+        self._last_total = None
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(int(1000 / rate_hz))
+        self._timer.timeout.connect(self.flush)
+
+    def start(self):
+        """
+        Start emitting coalesced updates
+        """
+        self._timer.start()
+
+    def stop(self):
+        """
+        Stop emitting updates, flushing anything still pending
+        """
+        self._timer.stop()
+        self.flush()
+
+    def reset(self):
+        """
+        Forget all transfers
+        """
+        with self._lock:
+            self._transfers = {}
+            self._transferred = 0
+            self._total = 0
+            self._files_done = 0
+            self._files_failed = 0
+            self._meter = ThroughputMeter(self._meter.window)
+            self._dirty = True
+            self._last_total = None
+
+    def update(self, transfer_id, position=None, total=None, description=None):
+        """
+        Record progress for a single transfer.  This is safe to call from any thread.
+
+        :param transfer_id:    Unique key for the transfer (e.g. the file being transferred)
+        :param position:       Units transferred so far for this transfer
+        :param total:          Total units to transfer for this transfer
+        :param description:    Description of the transfer
+        """
+        with self._lock:
+            transfer = self._transfers.setdefault(transfer_id, {
+                "description": "",
+                "position": 0,
+                "total": 0,
+                "done": False,
+                "failed": False,
+            })
+            if position is not None:
+                self._transferred += position - transfer["position"]
+                transfer["position"] = position
+            if total is not None:
+                self._total += total - transfer["total"]
+                transfer["total"] = total
+            if description is not None:
+                transfer["description"] = description
+                self._last_description = description
+            self._meter.add_sample(self._transferred)
+            self._dirty = True
+
+    def finish(self, transfer_id, failed=False):
+        """
+        Mark a transfer as complete.  This is safe to call from any thread.
+
+        :param transfer_id:    Unique key for the transfer
+        :param failed:         True if the transfer failed
+        """
+        with self._lock:
+            transfer = self._transfers.get(transfer_id)
+            if not transfer or transfer["done"]:
+                return
+            transfer["done"] = True
+            transfer["failed"] = bool(failed)
+            self._files_done += 1
+            if failed:
+                self._files_failed += 1
+            elif transfer["total"]:
+                self._transferred += transfer["total"] - transfer["position"]
+                transfer["position"] = transfer["total"]
+            self._meter.add_sample(self._transferred)
+            self._dirty = True
+
+    def snapshot(self, include_files=False):
+        """
+        Return the current overall (and optionally per-file) progress.  This is safe to call
+        from any thread so can also be polled when no Qt event loop is running.
+
+        :param include_files:    If True, include a copy of the per-file progress
+        :returns dict:           A dictionary with the overall 'transferred', 'total', 'files_done',
+                                 'files_failed', 'files_total', 'percent', 'rate' (units/s) and
+                                 'eta' (seconds or None).  If requested, 'files' maps each
+                                 transfer_id to its per-file progress
+        """
+        with self._lock:
+            snapshot = self._snapshot()
+            if include_files:
+                snapshot["files"] = dict((key, dict(transfer)) for key, transfer in self._transfers.items())
+            return snapshot
+
+    def file_progress(self, transfer_id):
+        """
+        Return the progress of a single transfer, or None if it isn't known
+
+        :param transfer_id:    Unique key for the transfer
+        :returns dict:         A dictionary with 'description', 'position', 'total', 'done'
+                               and 'failed'
+        """
+        with self._lock:
+            transfer = self._transfers.get(transfer_id)
+            return dict(transfer) if transfer else None
+
+    def flush(self):
+        """
+        Emit the aggregated progress if anything changed since the last flush
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            snapshot = self._snapshot()
+            description = self._last_description
+
+        if snapshot["total"] != self._last_total:
+            self._last_total = snapshot["total"]
+            self.total_size.emit(sizeof_fmt(snapshot["total"] / 1024.0))
+
+        self.description.emit(description)
+        self.percent_done.emit(snapshot["percent"])
+        self.transfer_rate.emit(sizeof_fmt(snapshot["rate"] / 1024.0, suffix="bps"))
+        self.time_remaining.emit(format_time_remaining(snapshot["eta"]))
+        self.updated.emit(snapshot)
+
+        if snapshot["files_total"] and snapshot["files_done"] == snapshot["files_total"]:
+            self.finished.emit()
+
+    def _snapshot(self):
+        return {
+            "transferred": self._transferred,
+            "total": self._total,
+            "files_done": self._files_done,
+            "files_failed": self._files_failed,
+            "files_total": len(self._transfers),
+            "percent": (float(self._transferred) / self._total * 100) if self._total else 0.0,
+            "rate": self._meter.rate,
+            "eta": self._meter.eta(max(0, self._total - self._transferred)),
+        }
+
+
 class ProgressHandler( Progress ):
 
-    def __init__(self):
+    # minimum number of seconds between signals emitted by a stand-alone handler
+    EMIT_INTERVAL = 0.1
+
+    def __init__(self, aggregator=None):
         """
         To be used as a module handler to receive progress updates from P4 server when
-        another blocking call is being utilized. 
+        another blocking call is being utilized.
         For example, when a single call for "submit change" is occurring, the p4 module is
-        still receiving progress updates from the server and theyre handled via this class. 
+        still receiving progress updates from the server and theyre handled via this class.
+
+        :param aggregator: Optional ProgressAggregator to forward updates to.  Handlers
+                           for concurrent connections can share a single aggregator, which
+                           then takes care of throttling and signalling.  Without one, the
+                           handler emits its own (throttled) signals
         """
         Progress.__init__(self)
 
-        self.signaller = ProgressSignaller()
+        self.aggregator = aggregator
+        if aggregator:
+            self.signaller = aggregator
+        else:
+            self.signaller = ProgressSignaller()
         self.description = self.signaller.description
         self.time_remaining = self.signaller.time_remaining
         self.finished = self.signaller.finished
@@ -52,58 +322,72 @@ class ProgressHandler( Progress ):
         self.invoked = 0
         self.curr_total = 0
         self.curr_description = ""
+        self.curr_unit = 0
 
         # markers to be able to derive eta
-        self.time_register = datetime.now()
-        self.size_register = 1
+        self.meter = ThroughputMeter()
         self.percent_complete = 0.0
-        self.completed_since_last_poll = 0.0
+        self.last_emit = 0.0
 
+    @property
+    def transfer_id(self):
+        """
+        Key used for the current transfer when forwarding to an aggregator
+        """
+        return "{}:{}".format(id(self), self.curr_description)
 
     def init(self, type):
-        logger.info(type)
+        logger.debug(type)
+        self.meter = ThroughputMeter()
 
     def setDescription(self, description, unit):
         self.curr_description = description
-        logger.info("{}, {}".format(description, unit))
+        self.curr_unit = unit
+        logger.debug("{}, {}".format(description, unit))
+        if self.aggregator and unit in UNIT_BYTES:
+            self.aggregator.update(self.transfer_id, description=description)
 
     def setTotal(self, total):
         self.curr_total = total
-        self.total_size.emit(sizeof_fmt(self.curr_total))
+        if self.aggregator:
+            if self.curr_unit in UNIT_BYTES:
+                self.aggregator.update(self.transfer_id, total=total * UNIT_BYTES[self.curr_unit])
+        else:
+            self.total_size.emit(sizeof_fmt(self.curr_total))
 
     def update(self, position):
         try:
-        
-            size_transfered = position-self.size_register
-
-            percent_completed = float(position)/float(self.curr_total)
-            percent_left = 1.0-percent_completed
-            self.completed_since_last_poll = percent_completed - self.percent_complete
-            updates_left = percent_left/self.completed_since_last_poll
+            if self.aggregator:
+                # the aggregator adds up bytes, other progress isn't forwarded
+                if self.curr_unit in UNIT_BYTES:
+                    self.aggregator.update(self.transfer_id, position=position * UNIT_BYTES[self.curr_unit])
+                return
 
-            now = datetime.now()
-            update_interval =  now - self.time_register
-            
-            update_interval_seconds = float(update_interval.microseconds)/1000000
-            size_transfered_per_second = sizeof_fmt(int(size_transfered/update_interval_seconds), suffix="bps")
+            now = time.monotonic()
+            self.meter.add_sample(position, now)
+            if self.curr_total:
+                self.percent_complete = float(position)/float(self.curr_total)
 
-            estimated_time_left = timedelta(microseconds=update_interval.microseconds*updates_left)
-            self.percent_complete = percent_completed
+            # throttle signals so the UI isn't flooded by every callback:
+            if now - self.last_emit < self.EMIT_INTERVAL and position < self.curr_total:
+                return
+            self.last_emit = now
 
-            self.time_register = now
-            self.size_register = position
+            estimated_time_left = self.meter.eta(max(0, self.curr_total - position))
 
             # emit qt signals
             self.description.emit(self.curr_description)
-            self.time_remaining.emit(str(estimated_time_left))
+            self.time_remaining.emit(format_time_remaining(estimated_time_left))
             self.percent_done.emit(self.percent_complete*100)
-            self.transfer_rate.emit(size_transfered_per_second)
+            self.transfer_rate.emit(sizeof_fmt(int(self.meter.rate), suffix="bps"))
 
         except Exception as e:
             logger.warning("Could not handle progress: {}".format(e))
 
     def done(self, fail):
-        logger.info(fail)
-        self.finished.emit()
-
-
+        logger.debug(fail)
+        if self.aggregator:
+            if self.curr_unit in UNIT_BYTES:
+                self.aggregator.finish(self.transfer_id, failed=fail)
+        else:
+            self.finished.emit()
@@ -13,17 +13,11 @@ Common utilities for working with Perforce files
 """
 
 import re
+import weakref
+from functools import lru_cache
+from urllib import parse as urlparse
 
 import sgtk
-from tank_vendor import six
-from tank_vendor.six.moves import urllib
-
-if not six.PY3:
-    # Python 2
-    import urlparse
-else:
-    # Python 3
-    from urllib import parse as urlparse
 
 URL_REVISION_PARAM_REGEX = re.compile("^rev=(?P<revision>[0-9]+)$")
 
@@ -34,6 +28,177 @@ if PERFORCE_SCHEME not in urlparse.uses_netloc:
     urlparse.uses_params.append(PERFORCE_SCHEME)
 
 
+class PerforceUrlCodec(object):
+    """
+    Encodes depot paths to perforce urls and decodes them back again.  The set of
+    valid servers is computed once when the codec is created and decoded urls are
+    memoised so that repeatedly decoding the same publish urls is cheap.
+    """
+
+    DEFAULT_CACHE_SIZE = 10000
+
+    def __init__(self, server, server_aliases=None, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        :param server:            The Perforce server used when constructing urls
+        :param server_aliases:    Optional list of aliases that are also accepted
+                                  when validating the server of a url
+        :param cache_size:        Maximum number of decoded urls to remember
+        """
+        self._netloc = self._server_to_netloc(server)
+
+        # precompute every netloc that is considered valid. When only a port is
+        # specified, both the port and localhost:port are accepted.
+        valid_netlocs = set()
+        for valid_server in [server] + list(server_aliases or []):
+            if not valid_server:
+                continue
+            valid_netlocs.add(valid_server)
+            if valid_server.isdigit():
+                valid_netlocs.add("localhost:%s" % valid_server)
+        self._valid_netlocs = frozenset(valid_netlocs)
+
+        self._decode_cached = lru_cache(maxsize=cache_size)(self._decode)
+
+    @classmethod
+    def from_bundle(cls, bundle):
+        """
+        Create a codec using the 'server' and 'server_aliases' settings of the
+        specified bundle.
+
+        :param bundle:    The bundle (usually this framework) to read settings from
+        :returns:         A new PerforceUrlCodec instance
+        """
+        return cls(bundle.get_setting("server"), bundle.get_setting("server_aliases"))
+
+    @property
+    def valid_netlocs(self):
+        return self._valid_netlocs
+
+    def encode(self, depot_path, revision=None):
+        """
+        Construct a uniform perforce url for the specified depot path.
+
+        :param depot_path:    The depot path to construct a url for
+        :param revision:      Optional revision to include in the url
+        :returns:             url representing the specified depot path
+        """
+        # remove double slashes at start of path:
+        url_path = "/%s" % depot_path.lstrip("/")
+
+        # if revision is specified then append it to the path:
+        params = ""
+        if revision != None:
+            params = "rev=%d" % revision
+
+        # construct url:
+        return urlparse.urlunparse((PERFORCE_SCHEME, self._netloc, url_path, params, "", ""))
+
+    def encode_many(self, depot_paths, revisions=None):
+        """
+        Construct perforce urls for a list of depot paths.
+
+        :param depot_paths:    List of depot paths to construct urls for
+        :param revisions:      Optional list of revisions matching depot_paths
+        :returns list:         List of urls in the same order as depot_paths
+        """
+        if revisions is None:
+            return [self.encode(depot_path) for depot_path in depot_paths]
+        return [self.encode(depot_path, revision) for depot_path, revision in zip(depot_paths, revisions)]
+
+    def decode(self, url, validate_server=True):
+        """
+        Extract the depot path and revision from a perforce url.
+
+        :param url:                The url to extract the path from
+        :param validate_server:    If True then validate that the server matches
+                                   the current server or one of its aliases
+        :returns:                  A tuple (depot path, revision) or None if the url
+                                   isn't a valid perforce url
+        """
+        if not url:
+            return
+        return self._decode_cached(url, validate_server)
+
+    def decode_many(self, urls, validate_server=True):
+        """
+        Extract the depot paths and revisions from a list of perforce urls.
+
+        :param urls:               List of urls to extract paths from
+        :param validate_server:    If True then validate that the server matches
+                                   the current server or one of its aliases
+        :returns list:             List of (depot path, revision) tuples, or None for
+                                   invalid urls, in the same order as urls
+        """
+        return [self.decode(url, validate_server) for url in urls]
+
+    def clear_cache(self):
+        """
+        Forget all previously decoded urls
+        """
+        self._decode_cached.cache_clear()
+
+    def _decode(self, url, validate_server):
+        """
+        Uncached implementation of decode
+        """
+        res = urlparse.urlparse(url)
+        if res.scheme != PERFORCE_SCHEME:
+            return
+
+        if validate_server:
+            # check that netloc is server or one of the aliases if set.  The
+            # aliases are intended to allow old publish data to be used in
+            # the event that the server is moved/renamed.
+            if not res.netloc or res.netloc not in self._valid_netlocs:
+                return
+
+        # depot path should always start with '//':
+        depot_path = "//%s" % res.path.lstrip("/")
+
+        # check to see if a revision is specified in the params:
+        revision = None
+        if res.params:
+            for param in res.params.split("&"):
+                mo = URL_REVISION_PARAM_REGEX.match(param)
+                if mo:
+                    revision = mo.group("revision")
+
+        # return valid depot path:
+        return (depot_path, revision)
+
+    @staticmethod
+    def _server_to_netloc(server):
+        """
+        Convert the server setting to the netloc used in urls
+        """
+        netloc = server or ""
+        if netloc.isdigit():
+            # assume p4.port is port on localhost:
+            netloc = "localhost:%s" % netloc
+        return netloc
+
+
+# codecs are cached per bundle as the server settings don't change during
+# the lifetime of a bundle
+_g_url_codecs = weakref.WeakKeyDictionary()
+
+
+def get_url_codec(bundle=None):
+    """
+    Return the url codec for the specified bundle, creating it the first time
+    it's requested.
+
+    :param bundle:    The bundle to use the settings from.  Defaults to the current bundle
+    :returns:         A PerforceUrlCodec instance
+    """
+    bundle = bundle or sgtk.platform.current_bundle()
+    codec = _g_url_codecs.get(bundle)
+    if codec is None:
+        codec = PerforceUrlCodec.from_bundle(bundle)
+        _g_url_codecs[bundle] = codec
+    return codec
+
+
 def url_from_depot_path(depot_path, revision=None):
     """
     Construct a uniform perforce url for the specified
@@ -47,24 +212,19 @@ def url_from_depot_path(depot_path, revision=None):
     :param depot_path:    The depot path to construct a url for
     :returns:             url representing the specified depot path
     """
-    fw = sgtk.platform.current_bundle()
+    return get_url_codec().encode(depot_path, revision)
 
-    # remove double slashes at start of path:
-    url_path = "/%s" % depot_path.lstrip("/")
 
-    # if revision is specified then append it to the path:
-    params = ""
-    if revision != None:
-        params = "rev=%d" % revision
-
-    # add server & port (always use 'server' for this rather than an alias)
-    netloc = fw.get_setting("server")
-    if netloc.isdigit():
-        # assume p4.port is port on localhost:
-        netloc = "localhost:%s" % netloc
+def urls_from_depot_paths(depot_paths, revisions=None):
+    """
+    Construct uniform perforce urls for a list of depot paths.  Settings
+    are only looked up once for the whole list.
 
-    # construct url:
-    return urlparse.urlunparse((PERFORCE_SCHEME, netloc, url_path, params, "", ""))
+    :param depot_paths:    List of depot paths to construct urls for
+    :param revisions:      Optional list of revisions matching depot_paths
+    :returns list:         List of urls in the same order as depot_paths
+    """
+    return get_url_codec().encode_many(depot_paths, revisions)
 
 
 def depot_path_from_url(url, validate_server=True):
@@ -77,44 +237,18 @@ def depot_path_from_url(url, validate_server=True):
     :param validate_server:    If True then validate that the server matches
                                the current Perforce connection
     """
-    fw = sgtk.platform.current_bundle()
-
-    res = urlparse.urlparse(url)
-    if res.scheme != PERFORCE_SCHEME:
-        return
-
-    if validate_server:
-        if not res.netloc:
-            # no server specified in the url!
-            return
+    return get_url_codec().decode(url, validate_server)
 
-        # check that netloc is server or one of the aliases if set.  The
-        # aliases are intended to allow old publish data to be used in
-        # the event that the server is moved/renamed.
-        server_is_valid = False
-        for server in [fw.get_setting("server")] + fw.get_setting("server_aliases"):
-            if res.netloc == server:
-                server_is_valid = True
-                break
-            elif server.isdigit():
-                # special case handling when only the server port has been entered:
-                if res.netloc == ("localhost:%s" % server):
-                    server_is_valid = True
-                    break
-
-        if not server_is_valid:
-            return
-
-    # depot path should always start with '//':
-    depot_path = "//%s" % res.path.lstrip("/")
 
-    # check to see if a revision is specified in the params:
-    revision = None
-    if res.params:
-        for param in res.params.split("&"):
-            mo = URL_REVISION_PARAM_REGEX.match(param)
-            if mo:
-                revision = mo.group("revision")
+def depot_paths_from_urls(urls, validate_server=True):
+    """
+    Extract the depot paths from a list of perforce urls.  Settings are only
+    looked up once for the whole list.
 
-    # return valid depot path:
-    return (depot_path, revision)
+    :param urls:               List of urls to extract paths from
+    :param validate_server:    If True then validate that the server matches
+                               the current Perforce connection
+    :returns list:             List of (depot path, revision) tuples, or None for
+                               invalid urls, in the same order as urls
+    """
+    return get_url_codec().decode_many(urls, validate_server)
@@ -0,0 +1,122 @@
+# Copyright (c) 2013 Studio WILDCARD.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+# sync states of a file row
+STATE_PENDING = "pending"
+STATE_IN_FLIGHT = "in-flight"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+
+class AssetCounters(object):
+    """
+    Counts of an asset's files per sync state, split by whether they're filtered away
+    """
+
+    def __init__(self):
+        self._counts = {}
+
+    def _get(self, state, hidden=None):
+        if hidden is None:
+            return self._counts.get((state, False), 0) + self._counts.get((state, True), 0)
+        return self._counts.get((state, hidden), 0)
+
+    def _add(self, state, hidden, count):
+        self._counts[(state, hidden)] = self._counts.get((state, hidden), 0) + count
+
+    @property
+    def pending(self):
+        """
+        Files that are shown and still have to be synced
+        """
+        return self._get(STATE_PENDING, False)
+
+    @property
+    def in_flight(self):
+        return self._get(STATE_IN_FLIGHT)
+
+    @property
+    def done(self):
+        return self._get(STATE_DONE)
+
+    @property
+    def failed(self):
+        return self._get(STATE_FAILED)
+
+    @property
+    def filtered(self):
+        """
+        Files that are filtered away
+        """
+        return sum(count for (state, hidden), count in self._counts.items() if hidden)
+
+    @property
+    def sync_started(self):
+        return bool(self.in_flight or self.done or self.failed)
+
+
+class AssetCounterStore(object):
+    """
+    Per-asset file counters that are updated in constant time as files are found,
+    filtered and synced.  Assets whose counters changed are remembered so that the
+    view only has to refresh those, at its own pace.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._dirty = set()
+
+    def clear(self):
+        self._counters = {}
+        self._dirty = set()
+
+    def get(self, asset_name):
+        """
+        :returns AssetCounters:    The counters of the asset
+        """
+        counters = self._counters.get(asset_name)
+        if counters is None:
+            counters = self._counters[asset_name] = AssetCounters()
+        return counters
+
+    def add(self, asset_name, state=STATE_PENDING, hidden=False, count=1):
+        """
+        Count new files of an asset.  This doesn't mark the asset as changed, the status
+        the scan gave the asset stays until files are filtered or synced
+        """
+        self.get(asset_name)._add(state, hidden, count)
+
+    def move(self, asset_name, old_state, new_state, hidden=False, count=1):
+        """
+        Move files of an asset from one sync state to another
+        """
+        counters = self.get(asset_name)
+        counters._add(old_state, hidden, -count)
+        counters._add(new_state, hidden, count)
+        self._dirty.add(asset_name)
+
+    def set_hidden(self, asset_name, state, hidden, count=1):
+        """
+        Move files of an asset in or out of the filtered count
+        """
+        counters = self.get(asset_name)
+        counters._add(state, not hidden, -count)
+        counters._add(state, hidden, count)
+        self._dirty.add(asset_name)
+
+    def mark_dirty(self, asset_name):
+        self._dirty.add(asset_name)
+
+    def take_dirty(self):
+        """
+        :returns set:    The assets whose counters changed since the last call
+        """
+        dirty, self._dirty = self._dirty, set()
+        return dirty
@@ -0,0 +1,138 @@
+# Copyright (c) 2013 Studio WILDCARD.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+
+class FilterIndex(object):
+    """
+    Index of the rows of the sync tree by filter value (e.g. the Step, Type or Ext of a
+    file).  A row is hidden while any of its values is switched off.  Every row keeps a
+    count of its switched off values, so switching a value on or off only touches the
+    rows that have that value.
+    """
+
+    def __init__(self, filter_types, enabled=None):
+        """
+        :param filter_types:    List of filter types, e.g. ['step', 'type', 'ext']
+        :param enabled:         Optional dictionary of filter type -> {value: enabled},
+                                values that aren't listed are enabled
+        """
+        self._filter_types = list(filter_types)
+        self._enabled = dict((f, dict((enabled or {}).get(f) or {})) for f in self._filter_types)
+        self._rows = dict((f, {}) for f in self._filter_types)
+        self._row_values = {}
+        self._disabled_count = {}
+        self._filtered_count = dict((f, 0) for f in self._filter_types)
+
+    def clear(self):
+        """
+        Remove all rows, the enabled state of the values is kept
+        """
+        self._rows = dict((f, {}) for f in self._filter_types)
+        self._row_values = {}
+        self._disabled_count = {}
+        self._filtered_count = dict((f, 0) for f in self._filter_types)
+
+    def states(self):
+        """
+        :returns dict:    Filter type -> {value: enabled} for the values switched on or off so far
+        """
+        return dict((f, dict(values)) for f, values in self._enabled.items())
+
+    def is_enabled(self, filter_type, value):
+        return self._enabled[filter_type].get(value, True)
+
+    def is_hidden(self, row):
+        return self._disabled_count.get(row, 0) > 0
+
+    def filtered_count(self, filter_type):
+        """
+        :returns int:    The number of rows with a switched off value of the filter type
+        """
+        return self._filtered_count[filter_type]
+
+    def add(self, row, values):
+        """
+        Add a row to the index.
+
+        :param row:       Hashable id of the row
+        :param values:    Dictionary of filter type -> value for the row, None values are ignored
+        :returns bool:    True if the row is hidden
+        """
+        self._row_values[row] = {}
+        self._disabled_count[row] = 0
+        for filter_type, value in values.items():
+            self.set_value(row, filter_type, value)
+        return self.is_hidden(row)
+
+    def remove(self, row):
+        """
+        Remove a row from the index, e.g. once its file is listed with another asset
+        """
+        for filter_type in list(self._row_values.get(row, {})):
+            self.set_value(row, filter_type, None)
+        self._row_values.pop(row, None)
+        self._disabled_count.pop(row, None)
+
+    def set_value(self, row, filter_type, value):
+        """
+        Set (or change) the value of a row for a filter type, e.g. once the Step of a
+        file is known.
+
+        :returns bool:    True if the visibility of the row changed
+        """
+        if filter_type not in self._rows:
+            return False
+        was_hidden = self.is_hidden(row)
+        row_values = self._row_values.setdefault(row, {})
+        self._disabled_count.setdefault(row, 0)
+
+        previous = row_values.get(filter_type)
+        if previous == value:
+            return False
+        if previous is not None:
+            self._rows[filter_type][previous].discard(row)
+            if not self.is_enabled(filter_type, previous):
+                self._disabled_count[row] -= 1
+                self._filtered_count[filter_type] -= 1
+
+        if value is None:
+            row_values.pop(filter_type, None)
+        else:
+            row_values[filter_type] = value
+            self._rows[filter_type].setdefault(value, set()).add(row)
+            if not self.is_enabled(filter_type, value):
+                self._disabled_count[row] += 1
+                self._filtered_count[filter_type] += 1
+
+        return was_hidden != self.is_hidden(row)
+
+    def set_enabled(self, filter_type, value, enabled):
+        """
+        Switch a filter value on or off.
+
+        :returns list:    The rows whose visibility changed
+        """
+        if self.is_enabled(filter_type, value) == enabled:
+            self._enabled[filter_type][value] = enabled
+            return []
+        self._enabled[filter_type][value] = enabled
+
+        rows = self._rows[filter_type].get(value, set())
+        delta = -1 if enabled else 1
+        self._filtered_count[filter_type] += delta * len(rows)
+
+        changed = []
+        for row in rows:
+            count = self._disabled_count[row]
+            self._disabled_count[row] = count + delta
+            # the row changes visibility when it gains its first or loses its last switched off value
+            if (count == 0) != (count + delta == 0):
+                changed.append(row)
+        return changed
@@ -0,0 +1,85 @@
+# Copyright (c) 2013 Studio WILDCARD.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import os
+
+from sgtk.platform.qt import QtGui
+
+# status icons shipped in resources/ as status_<name>.png
+ICON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources")
+STATUS_ICONS = ["error", "filter", "load", "success", "syncing", "validate", "warning"]
+
+
+class IconRegistry(object):
+    """
+    Shared icons and pixmaps, loaded from disk once per process.  Every caller gets the
+    same QIcon instance for a name, so views and delegates don't reload the image for
+    each item they draw.  Pixmaps can only be created on the UI thread, so the registry
+    must only be used from there.
+    """
+
+    def __init__(self, icon_dir=ICON_DIR):
+        """
+        :param icon_dir:    Directory with the status_<name>.png icons
+        """
+        self._icon_dir = icon_dir
+        self._icons = {}
+        self._pixmaps = {}
+
+    def warm(self, names=STATUS_ICONS):
+        """
+        Load the status icons up front, icons that are already loaded are skipped
+        """
+        for name in names:
+            self.status_icon(name)
+
+    def status_icon(self, name):
+        """
+        :param name:      Status name, e.g. 'success'
+        :returns QIcon:   The shared icon.  It's a null icon if there's no image for the name
+        """
+        icon = self._icons.get(name)
+        if icon is None:
+            icon = self._icons[name] = QtGui.QIcon(
+                self.pixmap(os.path.join(self._icon_dir, "status_{}.png".format(name))))
+        return icon
+
+    def resource_icon(self, path):
+        """
+        :param path:      Path of the image, on disk or in the Qt resources (e.g. ':/res/folder_512x400.png')
+        :returns QIcon:   The shared icon
+        """
+        icon = self._icons.get(path)
+        if icon is None:
+            icon = self._icons[path] = QtGui.QIcon(self.pixmap(path))
+        return icon
+
+    def pixmap(self, path):
+        """
+        :param path:        Path of the image, on disk or in the Qt resources
+        :returns QPixmap:   The shared pixmap, callers that paint on it should copy it first
+        """
+        pixmap = self._pixmaps.get(path)
+        if pixmap is None:
+            pixmap = self._pixmaps[path] = QtGui.QPixmap(path)
+        return pixmap
+
+
+_g_icon_registry = None
+
+
+def get_icon_registry():
+    """
+    :returns IconRegistry:    The registry shared by everything in the process
+    """
+    global _g_icon_registry
+    if _g_icon_registry is None:
+        _g_icon_registry = IconRegistry()
+    return _g_icon_registry
@@ -15,6 +15,7 @@ import sgtk
 import datetime
 from . import loader_utils, constants
 from . import model_item_data
+from .icons import get_icon_registry
 
 # import the shotgun_model module from the shotgun utils framework
 shotgun_model = sgtk.platform.import_framework(
@@ -43,8 +44,9 @@ class SgLatestPublishModel(ShotgunModel):
         Model which represents the latest publishes for an entity
         """
         self._publish_type_model = publish_type_model
-        self._folder_icon = QtGui.QIcon(QtGui.QPixmap(":/res/folder_512x400.png"))
-        self._loading_icon = QtGui.QIcon(QtGui.QPixmap(":/res/loading_512x400.png"))
+        icons = get_icon_registry()
+        self._folder_icon = icons.resource_icon(":/res/folder_512x400.png")
+        self._loading_icon = icons.resource_icon(":/res/loading_512x400.png")
         self._associated_items = {}
 
         app = sgtk.platform.current_bundle()
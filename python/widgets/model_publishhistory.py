@@ -12,6 +12,7 @@ import sgtk
 from sgtk.platform.qt import QtCore, QtGui
 
 from . import loader_utils, constants
+from .icons import get_icon_registry
 
 # import the shotgun_model module from the shotgun utils framework
 shotgun_model = sgtk.platform.import_framework(
@@ -35,7 +36,7 @@ class SgPublishHistoryModel(ShotgunModel):
         Constructor
         """
         # folder icon
-        self._loading_icon = QtGui.QPixmap(":/res/loading_100x100.png")
+        self._loading_icon = get_icon_registry().pixmap(":/res/loading_100x100.png")
         app = sgtk.platform.current_bundle()
         ShotgunModel.__init__(
             self,
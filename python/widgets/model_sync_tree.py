@@ -0,0 +1,280 @@
+# Copyright (c) 2013 Studio WILDCARD.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+import os
+
+from sgtk.platform.qt import QtCore, QtGui
+
+# number of file rows exposed to the view at a time for each asset
+FETCH_CHUNK_SIZE = 500
+
+
+class SyncTreeNode(object):
+    """
+    A row in the sync tree.  Asset rows have no parent and hold their files as
+    children, file rows have an asset as their parent.
+    """
+
+    __slots__ = ("parent", "row", "name", "status", "details", "icon", "tooltip",
+                 "path", "children", "loaded", "hidden", "state")
+
+    def __init__(self, parent=None, name=None, status=None, details=None, icon=None, path=None):
+        self.parent = parent
+        self.row = 0
+        self.name = name
+        self.status = status
+        self.details = details
+        self.icon = icon
+        self.tooltip = None
+        self.path = path
+        self.hidden = False
+        self.state = None
+
+        # only used by asset rows: all files, and how many of them the view knows about
+        self.children = []
+        self.loaded = 0
+
+    @property
+    def is_asset(self):
+        return self.parent is None
+
+
+class SyncTreeModel(QtCore.QAbstractItemModel):
+    """
+    Two-level model of assets and the files there are to sync for them.  Files are
+    added in batches and only exposed to the view in chunks of FETCH_CHUNK_SIZE as
+    asset rows are expanded or scrolled through, so that scans of tens of thousands
+    of files don't create a view row per file up front.
+    """
+
+    ASSET_NAME, STATUS, DETAIL = range(3)
+    HEADER = ["Asset Name", "Status", "Detail"]
+
+    def __init__(self, icon_factory=None, parent=None):
+        """
+        :param icon_factory:    Callable returning a QIcon for an icon name
+        :param parent:          The parent QObject
+        """
+        super(SyncTreeModel, self).__init__(parent)
+        self._icon_factory = icon_factory
+        self._icons = {}
+        self._assets = []
+        self._assets_by_name = {}
+
+    ############################################################################################
+    # QAbstractItemModel implementation
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QtCore.QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(row, column, self._assets[row])
+        asset = parent.internalPointer()
+        return self.createIndex(row, column, asset.children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+        node = index.internalPointer()
+        if node.is_asset:
+            return QtCore.QModelIndex()
+        return self.createIndex(node.parent.row, 0, node.parent)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if not parent.isValid():
+            return len(self._assets)
+        node = parent.internalPointer()
+        if node.is_asset and parent.column() == 0:
+            return node.loaded
+        return 0
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(self.HEADER)
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        if not parent.isValid():
+            return bool(self._assets)
+        node = parent.internalPointer()
+        return node.is_asset and parent.column() == 0 and bool(node.children)
+
+    def canFetchMore(self, parent):
+        if not parent.isValid():
+            return False
+        node = parent.internalPointer()
+        return node.is_asset and node.loaded < len(node.children)
+
+    def fetchMore(self, parent):
+        if self.canFetchMore(parent):
+            node = parent.internalPointer()
+            self._load(node, min(len(node.children), node.loaded + FETCH_CHUNK_SIZE))
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.HEADER[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        column = index.column()
+
+        if role == QtCore.Qt.DisplayRole:
+            if column == self.ASSET_NAME:
+                return node.name
+            if column == self.STATUS:
+                return node.status
+            if column == self.DETAIL:
+                return node.details
+        elif role == QtCore.Qt.DecorationRole and column == self.STATUS:
+            return self.icon(node.icon)
+        elif role == QtCore.Qt.ToolTipRole and column == self.STATUS:
+            return node.tooltip
+        elif role == QtCore.Qt.UserRole:
+            return node.path
+        return None
+
+    ############################################################################################
+    # public methods
+
+    def icon(self, name):
+        """
+        Return the QIcon for an icon name, icons are only created once
+        """
+        if not name or not self._icon_factory:
+            return None
+        if name not in self._icons:
+            self._icons[name] = self._icon_factory(name)
+        return self._icons[name]
+
+    def clear(self):
+        self.beginResetModel()
+        self._assets = []
+        self._assets_by_name = {}
+        self.endResetModel()
+
+    def asset(self, asset_name):
+        """
+        :returns: The asset SyncTreeNode with the given name, None if there isn't one
+        """
+        return self._assets_by_name.get(asset_name)
+
+    def add_asset(self, asset_name, status=None, details=None, icon=None, root_path=None):
+        """
+        Append an asset row.
+
+        :returns: The new asset SyncTreeNode
+        """
+        node = SyncTreeNode(name=asset_name, status=status, details=details, icon=icon, path=root_path)
+        node.row = len(self._assets)
+        self.beginInsertRows(QtCore.QModelIndex(), node.row, node.row)
+        self._assets.append(node)
+        self._assets_by_name[asset_name] = node
+        self.endInsertRows()
+        return node
+
+    def add_files(self, asset, files):
+        """
+        Append a batch of file rows to an asset.  Only the first FETCH_CHUNK_SIZE files of
+        an asset are exposed to the view straight away, the rest are fetched on demand.
+
+        :param asset:    The asset SyncTreeNode
+        :param files:    List of (local path, status, icon) tuples
+        :returns list:   The new file SyncTreeNodes
+        """
+        nodes = []
+        first_row = len(asset.children)
+        for row, (path, status, icon) in enumerate(files, first_row):
+            node = SyncTreeNode(parent=asset, name=os.path.basename(path), status=status,
+                                details=path, icon=icon, path=path)
+            node.row = row
+            nodes.append(node)
+        asset.children.extend(nodes)
+
+        # fill up the first chunk straight away, anything beyond it is fetched by the view
+        if asset.loaded == first_row and asset.loaded < FETCH_CHUNK_SIZE:
+            self._load(asset, min(len(asset.children), FETCH_CHUNK_SIZE))
+        return nodes
+
+    def remove_files(self, asset, nodes):
+        """
+        Remove file rows from an asset, e.g. once their files are listed with another asset
+
+        :param asset:    The asset SyncTreeNode
+        :param nodes:    The file SyncTreeNodes to remove
+        """
+        rows = sorted(set(node.row for node in nodes if node.parent is asset), reverse=True)
+        if not rows:
+            return
+
+        # contiguous ranges of rows, last first so the rows of the ranges left don't move
+        ranges = []
+        for row in rows:
+            if ranges and ranges[-1][0] == row + 1:
+                ranges[-1][0] = row
+            else:
+                ranges.append([row, row])
+
+        parent = self.createIndex(asset.row, 0, asset)
+        for first, last in ranges:
+            if first < asset.loaded:
+                # only the rows the view knows about are announced
+                last_loaded = min(last, asset.loaded - 1)
+                self.beginRemoveRows(parent, first, last_loaded)
+                del asset.children[first:last + 1]
+                asset.loaded -= last_loaded - first + 1
+                self.endRemoveRows()
+            else:
+                del asset.children[first:last + 1]
+
+        for row in range(rows[-1], len(asset.children)):
+            asset.children[row].row = row
+
+    def index_for(self, node, column=0):
+        """
+        :returns: The QModelIndex for a node, invalid if the view doesn't know about it yet
+        """
+        if not node.is_asset and node.row >= node.parent.loaded:
+            return QtCore.QModelIndex()
+        return self.createIndex(node.row, column, node)
+
+    def asset_changed(self, asset):
+        """
+        Notify views that the data of an asset row changed
+        """
+        self.dataChanged.emit(self.createIndex(asset.row, 0, asset),
+                              self.createIndex(asset.row, len(self.HEADER) - 1, asset))
+
+    def files_changed(self, nodes):
+        """
+        Notify views that the data of a batch of file rows changed, with one dataChanged
+        per asset covering the changed rows
+        """
+        rows_by_asset = {}
+        for node in nodes:
+            if node.row < node.parent.loaded:
+                rows = rows_by_asset.setdefault(id(node.parent), [node.parent, node.row, node.row])
+                rows[1] = min(rows[1], node.row)
+                rows[2] = max(rows[2], node.row)
+
+        for asset, first, last in rows_by_asset.values():
+            self.dataChanged.emit(self.createIndex(first, 0, asset.children[first]),
+                                  self.createIndex(last, len(self.HEADER) - 1, asset.children[last]))
+
+    def _load(self, asset, count):
+        """
+        Expose the first count files of an asset to the view, in chunked inserts
+        """
+        parent = self.createIndex(asset.row, 0, asset)
+        while asset.loaded < count:
+            last = min(count, asset.loaded + FETCH_CHUNK_SIZE) - 1
+            self.beginInsertRows(parent, asset.loaded, last)
+            asset.loaded = last + 1
+            self.endInsertRows()
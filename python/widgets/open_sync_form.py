@@ -20,19 +20,33 @@ import sys
 
 from functools import partial
 
-from .sync_workers import SyncWorker, AssetInfoGatherWorker
+from .model_sync_tree import SyncTreeModel
+from .filter_index import FilterIndex
+from .icons import get_icon_registry
+from .asset_counters import AssetCounterStore, STATE_PENDING, STATE_IN_FLIGHT, STATE_DONE, STATE_FAILED
+from .sync_workers import SyncWorker, AssetInfoGatherWorker, PublishLookupWorker, SyncPlanWorker, JournalLookupWorker
+from ..sync.executor import STATUS_ERROR, STATUS_CANCELLED
+from ..sync.scheduler import SyncScheduler, SyncPriority
+from ..sync.concurrency import get_concurrency_controller, DEFAULT_FLOOR, DEFAULT_CEILING, DEFAULT_INITIAL, DEFAULT_TARGET_LATENCY
+from ..sync.journal import SyncJournal, get_journal_directory
+from ..sync.scan_filter import ScanFilter
+from ..sync.resolver import TemplateResolver, EntityPrefetcher
 from .utils import PrefFile, open_browser
+from ..util.progress import ProgressAggregator, sizeof_fmt, format_time_remaining
 
-# file base for accessing Qt resources outside of resource scope
-basepath = os.path.dirname(os.path.abspath(__file__))
+# minimum time in ms between refreshes of the per-asset counts
+COUNTER_REFRESH_INTERVAL = 100
 
 
 class SyncForm(QtGui.QWidget):
 
     _fw = None
-    _p4 = None
         
     progress = 0
+
+    # ConcurrencyController.metrics(), emitted from the sync workers' threads whenever the
+    # number of batches synced at once changes
+    concurrency_updated = QtCore.Signal(dict)
     
     def __init__(self, parent_sgtk_app, entities_to_sync, specific_files,  parent=None):
         """
@@ -57,8 +71,6 @@ class SyncForm(QtGui.QWidget):
         self._sync_items = {}
         self._step_options = []
 
-        self._filtered_away = []
-
         self.use_filters = ['Step', 'Type', 'Ext']
         self.filter_sizes = {
             "Step" : 80,
@@ -67,24 +79,79 @@ class SyncForm(QtGui.QWidget):
         }
 
         # init preferences
-        self.prefs = PrefFile()
+        self.prefs = PrefFile(parent=self)
         if not self.prefs.data.get('hide_syncd'):
             self.prefs.data['hide_syncd'] = True
             self.prefs.write()
-            self.prefs.read()
+
+        # filter state is kept in memory while the dialog is open, so filtering never
+        # has to go back to the prefs file
+        self.filter_index = FilterIndex([f.lower() for f in self.use_filters],
+                                        enabled=dict((f.lower(), self.prefs.data.get('{}_filters'.format(f.lower())))
+                                                     for f in self.use_filters))
+
+        # per-asset counts of files to sync, shown at most every COUNTER_REFRESH_INTERVAL ms
+        self.asset_counters = AssetCounterStore()
+        self._counter_timer = QtCore.QTimer(self)
+        self._counter_timer.setSingleShot(True)
+        self._counter_timer.setInterval(COUNTER_REFRESH_INTERVAL)
+        self._counter_timer.timeout.connect(self.refresh_sync_counters)
 
         # if not self.prefs.data.get('force_sync'):
         #     self.prefs.data['force_sync'] = False
         #     self.prefs.write()
         #     self.prefs.read()
-        self.threadpool = QtCore.QThreadPool.globalInstance()
-        self.threadpool.setMaxThreadCount(min(24, self.threadpool.maxThreadCount()))
+        # dedicated pool so that outstanding work can be cancelled when the dialog
+        # closes without affecting anything else using the global pool.  Its size follows
+        # the concurrency controller of the server once that's known, see size_threadpool
+        self.threadpool = QtCore.QThreadPool(self)
+        self.threadpool.setMaxThreadCount(max(1, min(DEFAULT_INITIAL, self.fw.get_setting("sync_max_threads", 8))))
+        self.concurrency_updated.connect(self.show_concurrency)
+        # the Perforce stage of a scan gets a thread of its own, the SG stage workers on the
+        # main pool block while its queue is full and must not be able to starve it
+        self._plan_threadpool = QtCore.QThreadPool(self)
+        self._plan_threadpool.setMaxThreadCount(1)
+        # every pool thread keeps its Perforce connection until the dialog closes, so the
+        # threads mustn't expire in between
+        for pool in (self.threadpool, self._plan_threadpool):
+            pool.setExpiryTimeout(-1)
+        self.connection_pool = self.fw.connection.ThreadConnectionProvider()
+        self._scan_workers = []
+        self._sync_workers = []
+        self._publish_lookup_worker = None
+        self._sync_plan_worker = None
+        self._sync_scheduler = None
+        self._sync_progress = None
+        self._concurrency = None
+        self._template_resolvers = []
+        self._scanning = False
+        self._syncing = False
+        self._cancelling = False
+        self._completed_files = []
+        self._failed_files = []
+        self._cancelled_files = []
+        self._journal = None
+        self._journal_lookup_worker = None
+        self._workspace = None
+        self._server = None
+        self._scan_filter = None
+        self.scan_cache = None
+
+        # load the status icons once, before the views start asking for them
+        get_icon_registry().warm()
 
         # creat UI elements and arrange them
         self.make_widgets()
         self.setup_ui()
 
-        # add assets and what we want to sync into the view
+        # look for an interrupted sync once the dialog is showing, the assets are added to
+        # the view once the lookup answers unless the interrupted sync is resumed
+        QtCore.QTimer.singleShot(0, self.look_for_interrupted_sync)
+
+    def scan_selection(self):
+        """
+        Add the assets and what there is to sync for them into the view
+        """
         if self.entities_to_sync:
             self.populate_assets()
         else:
@@ -95,9 +162,73 @@ class SyncForm(QtGui.QWidget):
             self.set_progress_message("Please use Perforce Sync with a chosen context. None detected.", percentf=" ")
 
     def rescan(self):
-        self._asset_tree.clear()
+        self.cancel_scans()
+        self._sync_model.clear()
+        self.filter_index.clear()
+        self.asset_counters.clear()
+        self._asset_items = {}
         self.populate_assets()
 
+    def cancel_scans(self):
+        """
+        Cancel any asset scans that are queued or still running
+        """
+        self.threadpool.clear()
+        self._plan_threadpool.clear()
+        for worker in self._scan_workers:
+            worker.cancel()
+            # drop anything the worker still emits, it's no longer relevant
+            worker.signaller.blockSignals(True)
+        self._scan_workers = []
+        if self._sync_plan_worker:
+            self._sync_plan_worker.cancel()
+            self._sync_plan_worker.signaller.blockSignals(True)
+            self._sync_plan_worker = None
+        if self._publish_lookup_worker:
+            self._publish_lookup_worker.signaller.blockSignals(True)
+            self._publish_lookup_worker = None
+        if self._journal_lookup_worker:
+            self._journal_lookup_worker.signaller.blockSignals(True)
+            self._journal_lookup_worker = None
+        if self._sync_scheduler:
+            self._sync_scheduler.cancel()
+            self._sync_scheduler = None
+        self.stop_sync_progress()
+        for worker in self._sync_workers:
+            worker.cancel()
+            worker.signaller.blockSignals(True)
+        self._sync_workers = []
+        if self._journal:
+            # keep what's left in the journal so the sync can be resumed later
+            self._journal.close()
+            self._journal = None
+        self._syncing = False
+        self._cancelling = False
+        self._sync_plan_worker = None
+        self._template_resolvers = []
+        self._scanning = False
+        self.scan_cache = None
+
+    def closeEvent(self, event):
+        """
+        Stop outstanding work and release pooled connections when the dialog closes
+        """
+        try:
+            # filter toggles are only kept in memory until the dialog closes
+            self.save_ui_state()
+            self.prefs.flush()
+            self.cancel_scans()
+            self.threadpool.waitForDone(5000)
+            self._plan_threadpool.waitForDone(5000)
+            self.connection_pool.close()
+            if self._concurrency:
+                # the controller outlives the dialog, it's shared by the whole session
+                self._concurrency.remove_listener(self.concurrency_changed)
+                self._concurrency = None
+        except Exception as e:
+            self.log_error(e)
+        QtGui.QWidget.closeEvent(self, event)
+
     @property
     def fw(self):
         """
@@ -110,11 +241,11 @@ class SyncForm(QtGui.QWidget):
     @property
     def p4(self):
         """
-        initializes p4 as connection setup if it doesnt exist. Passes existing if it does. 
+        The Perforce connection of the calling thread, connected the first time it's used.
+        It must not be handed to other threads, workers get their own from connection_pool
         """
-        if not self._p4:
-            self._p4 = self.fw.connection.connect()
-        return self._p4
+        with self.connection_pool.connection() as p4:
+            return p4
 
     def make_widgets(self):
         """
@@ -126,9 +257,9 @@ class SyncForm(QtGui.QWidget):
         # self.search_line_edit = search_widget.GlobalSearchWidget(self)    
 
         self._do = QtGui.QPushButton("Sync")
-        self._asset_tree = QtGui.QTreeWidget()
-
-        self._asset_tree.clear()
+        self._asset_tree = QtGui.QTreeView()
+        self._sync_model = SyncTreeModel(icon_factory=self.make_icon, parent=self)
+        self._asset_tree.setModel(self._sync_model)
         self._progress_bar = QtGui.QProgressBar()
         self._list = QtGui.QListWidget()
         self._line_edit = QtGui.QLineEdit()
@@ -140,7 +271,13 @@ class SyncForm(QtGui.QWidget):
         self._force_sync = QtGui.QCheckBox()
         self._force_sync.setText("Force Sync")
 
+        self._server_filter = QtGui.QCheckBox()
+        self._server_filter.setText("Filter on server")
+        self._server_filter.setToolTip("Only scan for the files the Step, Type and Ext filters show.\n"
+                                       "Extensions that weren't found before are left out as well.")
+
         self._rescan = QtGui.QPushButton("Rescan")
+        self._cancel = QtGui.QPushButton("Cancel")
 
   
 
@@ -161,13 +298,12 @@ class SyncForm(QtGui.QWidget):
         self._progress_bar.setVisible(False)
 
         # asset tree setup
-        self.tree_header = ["Asset Name", "Status", "Detail"]
+        self.tree_header = SyncTreeModel.HEADER
         for h in self.tree_header:
             setattr(self, h.replace(' ', "_").upper(), self.tree_header.index(h))
 
         self._asset_tree.setAnimated(True)
-        self._asset_tree_header = QtGui.QTreeWidgetItem(self.tree_header)
-        self._asset_tree.setHeaderItem(self._asset_tree_header)  
+        self._asset_tree.setUniformRowHeights(True)
         self._asset_tree.setWordWrap(True)
         self._asset_tree.setColumnWidth(0, 150)
         self._asset_tree.setColumnWidth(1, 160)
@@ -181,6 +317,10 @@ class SyncForm(QtGui.QWidget):
         self._force_sync.stateChanged.connect(self.rescan)
         self._force_sync.setChecked(self.prefs.data.get('force_sync'))
 
+        self._server_filter.setChecked(bool(self.prefs.data.get('server_filter')))
+        self._server_filter.stateChanged.connect(self.save_ui_state)
+        self._server_filter.stateChanged.connect(self.rescan)
+
 
         self._menu_layout.addWidget(self._hide_syncd)
         self._menu_layout.addStretch()
@@ -189,6 +329,8 @@ class SyncForm(QtGui.QWidget):
         self.sync_layout = QtGui.QHBoxLayout()
         self.sync_layout.addWidget(self._rescan,  3)
         self.sync_layout.addWidget(self._do,  10)
+        self.sync_layout.addWidget(self._cancel,  3)
+        self.sync_layout.addWidget(self._server_filter, 1)
         self.sync_layout.addWidget(self._force_sync, 1)
 
         # arrange widgets in layout
@@ -199,7 +341,7 @@ class SyncForm(QtGui.QWidget):
 
         # css
         self.setStyleSheet("""
-            QTreeWidget::item { padding: 5px; }
+            QTreeView::item { padding: 5px; }
             QAction  { padding: 10px; }
         """ )
         
@@ -213,12 +355,17 @@ class SyncForm(QtGui.QWidget):
         self._asset_tree.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
         self._asset_tree.customContextMenuRequested.connect(self.open_context_menu)
 
+        # file rows are exposed to the view lazily, apply the filters as they come in
+        self._sync_model.rowsInserted.connect(self.apply_hidden_rows)
+
         self._rescan.clicked.connect(self.rescan)
+        self._cancel.clicked.connect(self.cancel_work)
         self.set_ui_interactive(False)
 
         if self.specific_files:
             self._rescan.setVisible(False)
             self._force_sync.setVisible(False)
+            self._server_filter.setVisible(False)
 
 
     def button_menu_factory(self, name= None ):
@@ -249,10 +396,13 @@ class SyncForm(QtGui.QWidget):
 
     def resizeEvent( self, event ):
         """
-        Keep track of window_size
+        Keep track of window_size.  It's only kept in memory here, the preferences are
+        written once the resizing settles or the dialog closes
         """
         QtGui.QWidget.resizeEvent( self, event )
-        self.save_ui_state()
+        if getattr(self, "prefs", None):
+            self.prefs.data['window_size'] = [self.width(), self.height()]
+            self.prefs.write()
 
 
 
@@ -269,13 +419,20 @@ class SyncForm(QtGui.QWidget):
             if sys.platform in os_filebrowser_map.keys():
                 os_filebrowser = os_filebrowser_map[sys.platform]
             
-            tree_item = self._asset_tree.itemAt(point)
-            path_to_open = os.path.dirname(tree_item.data(2, QtCore.Qt.UserRole))
+            tree_index = self._asset_tree.indexAt(point)
+            path_to_open = os.path.dirname(tree_index.data(QtCore.Qt.UserRole))
         
 
             menu = QtGui.QMenu()
             action = menu.addAction("Open path in {}".format(os_filebrowser), 
                                     partial(open_browser, path_to_open))
+
+            # let the user bump an asset that's still waiting to sync to the front
+            node = tree_index.internalPointer() if tree_index.isValid() else None
+            if node and self._sync_scheduler and self._sync_scheduler.pending:
+                asset_name = node.name if node.is_asset else node.parent.name
+                menu.addAction("Sync {} next".format(asset_name),
+                               partial(self._sync_scheduler.promote, asset_name))
                 
             menu.exec_(self._asset_tree.mapToGlobal(point))
 
@@ -289,12 +446,13 @@ class SyncForm(QtGui.QWidget):
         """
         Sync UI state and prefs locally to use for persistent UI features
         """
-        self.fw.log_info("Saving state for UI: {}".format(state_str))
+        self.fw.log_debug("Saving state for UI: {}".format(state_str))
         try:
             data = self.prefs.read()
             data["hide_syncd"] = self._hide_syncd.isChecked()
             data['window_size'] = [self.width(), self.height()]
             data["force_sync"] = self._force_sync.isChecked()
+            data["server_filter"] = self._server_filter.isChecked()
 
             # save step filters~
             for f in self.use_filters:
@@ -313,8 +471,9 @@ class SyncForm(QtGui.QWidget):
                             filter_data[k] = v.isChecked()
 
                 data[filter_name] = filter_data
-            
-                self.prefs.write(data)
+
+            # written to disk once changes settle, see PrefFile
+            self.prefs.write(data)
         except Exception as e:
             self.log_error(e)
 
@@ -331,7 +490,7 @@ class SyncForm(QtGui.QWidget):
                 if asset_status == "Syncd":
 
                     tree_item = asset_dict.get("tree_widget")
-                    tree_item.setHidden(hide_syncd_checkstate)
+                    self.set_row_hidden(tree_item, hide_syncd_checkstate)
                     if hide_syncd_checkstate is True:
                         hid += 1
             checkbox_text = "Hide if nothing to sync"
@@ -347,47 +506,56 @@ class SyncForm(QtGui.QWidget):
     
     def filter_items(self):
         """
-        Filter sync items away based on the step check-boxes
+        Refresh the filter indicators and the per-asset counts from the filter index.
+        Rows are hidden and shown as they're added or as filters are toggled, so this
+        doesn't need to visit every row
         """
         try:
-            self._filtered_away = {}
-            self._filtered_away['paths'] = []
-            self.prefs.read()
-
-            for f in self.use_filters:
-                f = f.lower()
-                self._filtered_away[f] = []
-                filters = self.prefs.data.get('{}_filters'.format(f))
-
-                for asset_name, asset_dict in self._asset_items.items():
-
-                    if asset_dict.get('status') != "Syncd":
-                    
-                        for sync_path, sync_widget in asset_dict['child_widgets'].items():
-
-                            if sync_path not in self._filtered_away['paths']:
-                                filter_term = asset_dict['child_{}s'.format(f)].get(sync_path)
-                                if filter_term:
-
-                                    if filter_term in filters.keys():
-                
-
-                                        #self.fw.log_info("setting sync widget {} to {} : {}".format(sync_path, (not filters.get(filter_term)), filter_term))
-                                        sync_widget.setHidden(not filters.get(filter_term))
-
-                                        # keep track for user of what isnt being shown to them
-                                        if (not filters.get(filter_term)) is True:
-                                            self._filtered_away[f].append(sync_path)
-                                            self._filtered_away['paths'].append(sync_path)
-
-                        self.update_sync_counter(asset_name) 
+            for asset_name, asset_dict in self._asset_items.items():
+                if asset_dict.get('status') != "Syncd":
+                    self.update_sync_counter(asset_name)
+            self.update_filter_indicators()
+        except Exception as e:
+            self.log_error(e)
 
-                # indicate to user that items being filtered from view
-                if len(self._filtered_away[f]) > 0:
-                    getattr(self, "_{}_filter".format(f)).setIcon(self.make_icon("filter"))
-                else:
-                    getattr(self, "_{}_filter".format(f)).setIcon(QtGui.QIcon())     
+    def update_filter_indicators(self):
+        """
+        Indicate to user that items are being filtered from view
+        """
+        for f in self.use_filters:
+            f = f.lower()
+            narrowed = self._scan_filter is not None and self._scan_filter.narrows(f)
+            if self.filter_index.filtered_count(f) > 0 or narrowed:
+                getattr(self, "_{}_filter".format(f)).setIcon(self.make_icon("filter"))
+            else:
+                getattr(self, "_{}_filter".format(f)).setIcon(QtGui.QIcon())
 
+    def apply_filter_changes(self, sync_widgets):
+        """
+        Show or hide rows whose visibility changed in the filter index and update the
+        counts of the assets they belong to
+        """
+        assets = set()
+        for sync_widget in sync_widgets:
+            self.set_row_hidden(sync_widget, self.filter_index.is_hidden(sync_widget))
+            assets.add(sync_widget.parent.name)
+        for asset_name in assets:
+            self.update_sync_counter(asset_name)
+
+    def filter_toggled(self, filter_type, filter_value, checked):
+        """
+        Handle a filter value being switched on or off from its menu, only the rows with
+        that value are visited
+        """
+        try:
+            changed = self.filter_index.set_enabled(filter_type, filter_value, checked)
+            if checked and self._scan_filter and self._scan_filter.is_left_out(filter_type, filter_value):
+                # the files with the value weren't scanned at all
+                self.save_ui_state()
+                self.rescan()
+                return
+            self.apply_filter_changes(changed)
+            self.update_filter_indicators()
         except Exception as e:
             self.log_error(e)
 
@@ -403,31 +571,58 @@ class SyncForm(QtGui.QWidget):
         self._hide_syncd.setEnabled(state)
         self._do.setEnabled(state)  
         self._force_sync.setEnabled(state)
+        self._server_filter.setEnabled(state)
+        # there's only something to cancel while the UI is locked
+        self._cancel.setEnabled(not state)
 
     def update_sync_counter(self, asset_name):
         """
-        Update the top-level count of how many items there are to sync for an asset upon filters being applied
+        Mark the top-level count of how many items there are to sync for an asset as changed.
+        The counts are refreshed from the counter store at most every COUNTER_REFRESH_INTERVAL ms
         """
-        asset_dict = self._asset_items.get(asset_name)
-        tree_widget = asset_dict.get("tree_widget")
-        unfiltered_sync_count = len(asset_dict.get('child_widgets').keys())
-        items_to_sync = [i for i,w in asset_dict.get('child_widgets').items() if not w.isHidden()]
-
-        count_to_sync = len(items_to_sync)
-
-        parent_asset_status = "{} to sync"
-        plurality = ""
+        self.asset_counters.mark_dirty(asset_name)
+        self.schedule_counter_refresh()
 
-        filtered = unfiltered_sync_count-count_to_sync
+    def schedule_counter_refresh(self):
+        if not self._counter_timer.isActive():
+            self._counter_timer.start()
 
-        status = parent_asset_status.format(count_to_sync)
-        if count_to_sync > 0:
-            # set asset parent's status regarding count-left-to-sync
-            tree_widget.setText(1, status)
-            tree_widget.setIcon(1, self.make_icon('load'))
-        if filtered:
-            tree_widget.setText(1, "{} ({} filtered)".format(status, filtered))
-            tree_widget.setIcon(1, self.make_icon('validate'))
+    def refresh_sync_counters(self):
+        """
+        Update the status of the assets whose counters changed since the last refresh
+        """
+        try:
+            for asset_name in self.asset_counters.take_dirty():
+                asset_dict = self._asset_items.get(asset_name)
+                if not asset_dict:
+                    continue
+                tree_widget = asset_dict.get("tree_widget")
+                counters = self.asset_counters.get(asset_name)
+
+                if counters.sync_started:
+                    count_left_to_sync = counters.pending + counters.in_flight
+                    if count_left_to_sync > 0:
+                        # set asset parent's status regarding count-left-to-sync
+                        plurality = "s" if count_left_to_sync > 1 else ""
+                        tree_widget.status = "{} item{} to sync".format(count_left_to_sync, plurality)
+                    elif counters.failed:
+                        tree_widget.icon = "error"
+                        tree_widget.status = "{} failed to sync".format(counters.failed)
+                    else:
+                        # when all sync's are done...
+                        tree_widget.icon = "validate"
+                        tree_widget.status = "Asset in Sync"
+                else:
+                    status = "{} to sync".format(counters.pending)
+                    if counters.pending > 0:
+                        tree_widget.status = status
+                        tree_widget.icon = 'load'
+                    if counters.filtered:
+                        tree_widget.status = "{} ({} filtered)".format(status, counters.filtered)
+                        tree_widget.icon = 'validate'
+                self._sync_model.asset_changed(tree_widget)
+        except Exception as e:
+            self.log_error(e)
 
 
     def update_available_filters(self, filter_info):
@@ -446,17 +641,12 @@ class SyncForm(QtGui.QWidget):
                 
                 action.setCheckable(True)
 
-                self.prefs.read()
-                filters = self.prefs.data.get('{}_filters'.format(filter_type))
-                check_state = True
-                if filter_value in filters.keys():
-                    check_state = filters[filter_value]
-                
+                # the index holds the saved state of the filters, values default to shown
+                check_state = self.filter_index.is_enabled(filter_type, filter_value)
 
                 action.setChecked(check_state)
                 action.setText(str(filter_value))
-                action.triggered.connect(self.save_ui_state)
-                action.triggered.connect(self.filter_items)
+                action.triggered.connect(partial(self.filter_toggled, filter_type, filter_value))
 
                 getattr(self, "_{}_menu".format(filter_type)).addAction(action)
                 actions[filter_value] = action
@@ -465,79 +655,95 @@ class SyncForm(QtGui.QWidget):
             self.log_error(e)
 
     
+    def set_row_hidden(self, node, hidden):
+        """
+        Show or hide an asset or file row of the sync tree.  Files the view doesn't know
+        about yet are hidden when they're fetched (see apply_hidden_rows)
+        """
+        if not node.is_asset and node.hidden != hidden:
+            self.asset_counters.set_hidden(node.parent.name, node.state, hidden)
+            self.schedule_counter_refresh()
+        node.hidden = hidden
+        index = self._sync_model.index_for(node)
+        if index.isValid():
+            self._asset_tree.setRowHidden(index.row(), index.parent(), hidden)
+
+    def apply_hidden_rows(self, parent, first, last):
+        """
+        Hide newly inserted file rows that are filtered away
+        """
+        if not parent.isValid():
+            return
+        asset = parent.internalPointer()
+        for node in asset.children[first:last + 1]:
+            if node.hidden:
+                self._asset_tree.setRowHidden(node.row, parent, True)
+
     def make_top_level_tree_item(self, asset_name=None, status=None, details=None, icon=None, root_path=None):
         """
-        Creates QTreeWidgetItem to display asset information
+        Creates asset row in the sync tree to display asset information
         """
-        tree_item = QtGui.QTreeWidgetItem(self._asset_tree)
+        tree_item = self._sync_model.add_asset(asset_name, status=status, details=details,
+                                               icon=icon, root_path=root_path)
 
         # if user has chosen to not see these 
         if self._hide_syncd.isChecked() and status == "Syncd":
-            tree_item.setHidden(True)
-
-        tree_item.setText(self.ASSET_NAME, asset_name)
-        tree_item.setText(self.STATUS, status)
-        tree_item.setText(self.DETAIL, details)
-        tree_item.setIcon(self.STATUS, self.make_icon(icon))
+            self.set_row_hidden(tree_item, True)
 
-        if root_path:
-            tree_item.setData(2, QtCore.Qt.UserRole, root_path)
-
-        self._asset_tree.addTopLevelItem(tree_item)
-
-        
         return tree_item
 
 
-    def make_sync_tree_item(self, sync_item_info):
+    def make_sync_tree_items(self, sync_items_info):
         """
-        Creates child QTreeWidgetItem under asset item to display filename and status of the sync
+        Creates file rows under an asset row to display filename and status of the sync,
+        for a batch of files found by the scan
         """
-        #self.fw.log_info('trying to make child item for {}'.format(sync_item_info))
+        #self.fw.log_info('trying to make child items for {}'.format(sync_items_info))
         try:
-            asset_name = sync_item_info.get("asset_name")
-            item_found = sync_item_info.get("item_found")
-            status = sync_item_info.get('status')
-            step = sync_item_info.get('step')
-            file_type = sync_item_info.get('type')
-
-            tree_item = self._asset_items[asset_name].get("tree_widget")
-
-            child_tree_item = QtGui.QTreeWidgetItem(tree_item)
-
-            asset_file_path = item_found.get('clientFile') 
-            asset_file_name = os.path.basename(item_found.get('clientFile'))
-
-
-            filtered = None
-
-            for f in self.use_filters:
-                f = f.lower()
-                if sync_item_info.get(f):
-                    filter_term = sync_item_info.get(f)
-                    filters = self.prefs.data.get('{}_filters'.format(f))
-                    if filter_term in filters.keys():
-                        if not filtered:
-                            child_tree_item.setHidden(not filters.get(filter_term))
-                            filtered = True
-                            self.update_sync_counter(asset_name)
-                    child_filter_term = self._asset_items[asset_name].get("child_{}s".format(f))  
-                    child_filter_term[asset_file_path] = filter_term
-
-
-            child_tree_item.setText(self.ASSET_NAME, asset_file_name) #If it is not clientFile specifically it seems like the name is within that info at least the correct wording is probably in clientFile
-            child_tree_item.setText(self.STATUS, status.title())
-            child_tree_item.setText(self.DETAIL, asset_file_path) #after testing it works as intended but we need to link it to the actual names the correct wording is probably in depotFile
-            child_tree_item.setIcon(self.STATUS, self.make_icon("load"))
-            child_tree_item.setData(2, QtCore.Qt.UserRole, asset_file_path)
-
-            child_tree_item.status = status
-            
-            child_widgets = self._asset_items[asset_name].get("child_widgets")
-            child_widgets[ asset_file_path ] = child_tree_item
+            if not sync_items_info:
+                return
+            asset_name = sync_items_info[0].get("asset_name")
+            asset_dict = self._asset_items[asset_name]
+            tree_item = asset_dict.get("tree_widget")
+
+            child_widgets = asset_dict.get("child_widgets")
+            child_sizes = asset_dict.get("child_sizes")
+            child_revs = asset_dict.get("child_revs")
+
+            files = []
+            filter_values = []
+            for sync_item_info in sync_items_info:
+                item_found = sync_item_info.get("item_found")
+                status = sync_item_info.get('status')
+                asset_file_path = item_found.get('clientFile') 
+
+                values = {}
+                for f in self.use_filters:
+                    f = f.lower()
+                    if sync_item_info.get(f):
+                        filter_term = sync_item_info.get(f)
+                        values[f] = filter_term
+                        child_filter_term = asset_dict.get("child_{}s".format(f))  
+                        child_filter_term[asset_file_path] = filter_term
+                filter_values.append(values)
+
+                files.append((asset_file_path, status.title(), "load"))
+
+                # keep track of file sizes so syncs can be split into size-balanced batches
+                child_sizes[ asset_file_path ] = int(item_found.get('fileSize') or 0)
+                child_revs[ asset_file_path ] = item_found.get('rev')
+
+                # keep what's needed to look up the publish for the file once the scan completes
+                asset_dict["child_depot_files"][asset_file_path] = sync_item_info.get("depot_file")
+                asset_dict["child_publish_ids"][asset_file_path] = sync_item_info.get("publish_id")
+
+            for child_tree_item, values in zip(self._sync_model.add_files(tree_item, files), filter_values):
+                child_widgets[ child_tree_item.path ] = child_tree_item
+                child_tree_item.state = STATE_PENDING
+                self.asset_counters.add(asset_name, STATE_PENDING)
+                if self.filter_index.add(child_tree_item, values):
+                    self.set_row_hidden(child_tree_item, True)
 
-            #self.filter_items
-            
         except Exception as e:
             self.log_error(e)
         
@@ -560,7 +766,12 @@ class SyncForm(QtGui.QWidget):
             asset_UI_mapping['tree_widget']= tree_widget
             asset_UI_mapping['asset_info']= info_processed_dict.get("asset_item")
             asset_UI_mapping['status'] = info_processed_dict.get("status")
+            asset_UI_mapping['root_path'] = info_processed_dict.get("root_path")
             asset_UI_mapping['child_widgets'] = {}
+            asset_UI_mapping['child_sizes'] = {}
+            asset_UI_mapping['child_revs'] = {}
+            asset_UI_mapping['child_depot_files'] = {}
+            asset_UI_mapping['child_publish_ids'] = {}
 
             for f in self.use_filters:
                 asset_UI_mapping['child_{}s'.format(f.lower())] = {}
@@ -576,25 +787,95 @@ class SyncForm(QtGui.QWidget):
         self._progress_bar.setFormat("{}{}".format(message, percentf))
 
 
-    def iterate_progress(self, message=None):
+    def iterate_progress(self, message=None, count=1):
         """
         Iterate global progress counter and update the progressbar widget
         Detect if progress is globally complete and handle hiding the progress widget
         """
         self._progress_bar.setVisible(True)
-        self.progress += 1
+        self.progress += count
         
         self._progress_bar.setValue(self.progress)
         self.set_progress_message(message)
         if self._progress_bar.value() == self._progress_bar.maximum():
-            self.set_progress_message("{} complete".format(message))
-            self._progress_bar.setVisible(False)
+            self.progress_complete(message)
 
-            self.set_ui_interactive(True)
+    def progress_complete(self, message=None):
+        """
+        Hide the progress bar and hand the UI back to the user once a scan or sync has completed
+        """
+        self.set_progress_message("{} complete".format(message))
+        self._progress_bar.setVisible(False)
+
+        self.set_ui_interactive(True)
+
+        self.filter_items()
+        self.filter_syncd_items()
 
+        if self._syncing:
+            self._syncing = False
+            self.stop_sync_progress()
+            self.finish_journal()
+            if self._concurrency:
+                self.fw.log_info(self.concurrency_summary(self._concurrency.metrics()))
+            self.size_threadpool()
+            if self._cancelling:
+                self.report_cancelled_sync()
 
-            self.filter_items()
+        if self._scanning:
+            self._scanning = False
+            self.start_publish_lookup()
+
+    def start_publish_lookup(self):
+        """
+        Look up the PublishedFile entities for all files found by the scan in one go, so
+        that the Step and Type filters can be populated
+        """
+        depot_files = []
+        publish_ids = []
+        for asset_name, asset_dict in self._asset_items.items():
+            depot_files.extend(f for f in asset_dict['child_depot_files'].values() if f)
+            publish_ids.extend(i for i in asset_dict['child_publish_ids'].values() if i)
+
+        if not depot_files and not publish_ids:
+            return
+
+        self._publish_lookup_worker = PublishLookupWorker(app=self.app,
+                                                          depot_files=depot_files,
+                                                          publish_ids=publish_ids,
+                                                          framework=self.fw)
+        self._publish_lookup_worker.setAutoDelete(False)
+        self._publish_lookup_worker.index_ready.connect(self.apply_publish_index)
+        self._publish_lookup_worker.status_update.connect(self.fw.log_debug)
+        self.threadpool.start(self._publish_lookup_worker)
+
+    def apply_publish_index(self, publish_index):
+        """
+        Assign the step and type of each file found by the scan from the publish index
+        and re-apply the filters
+        """
+        try:
+            changed = []
+            for asset_name, asset_dict in self._asset_items.items():
+                publish_ids = asset_dict['child_publish_ids']
+                child_widgets = asset_dict['child_widgets']
+                for sync_path, depot_file in asset_dict['child_depot_files'].items():
+                    publish_id = publish_ids.get(sync_path)
+                    step = publish_index.step(depot_file, publish_id)
+                    file_type = publish_index.publish_type(depot_file, publish_id)
+                    for filter_type, value in [("step", step), ("type", file_type)]:
+                        if not value:
+                            continue
+                        asset_dict['child_{}s'.format(filter_type)][sync_path] = value
+                        self.update_available_filters((filter_type, value))
+                        if self.filter_index.set_value(child_widgets[sync_path], filter_type, value):
+                            changed.append(child_widgets[sync_path])
+
+            self.apply_filter_changes(changed)
+            self.update_filter_indicators()
             self.filter_syncd_items()
+        except Exception as e:
+            self.log_error(e)
 
 
     def populate_assets(self):
@@ -610,25 +891,54 @@ class SyncForm(QtGui.QWidget):
             self.sync_order = []
             self.progress = 0
 
+            self.set_ui_interactive(False)
+            self._scanning = True
             self.progress_maximum = len(self.entities_to_sync)
             self._progress_bar.setRange(0, self.progress_maximum)
             self._progress_bar.setValue(0)
             self.set_progress_message("Requesting asset information for SG selection...")
 
+            # resolvers are cached per entity for the session, so rescans don't repeat
+            # folder creation or context lookups.  Codes are prefetched in bulk by the
+            # first worker that needs them, off the UI thread
+            self._template_resolvers = [TemplateResolver(app=self.app, entity=entity)
+                                        for entity in self.entities_to_sync]
+            prefetcher = EntityPrefetcher(self.app, self.entities_to_sync)
+
+            self._scan_filter = self.make_scan_filter()
+
+            # the dry runs are planned as the assets resolve, rather than once all of them are
+            self._sync_plan_worker = SyncPlanWorker(asset_count=len(self.entities_to_sync),
+                                                    force_sync=self._force_sync.isChecked(),
+                                                    framework=self.fw,
+                                                    connection_pool=self.connection_pool,
+                                                    app=self.app,
+                                                    scan_filter=self._scan_filter)
+            self._sync_plan_worker.setAutoDelete(False)
+            self._sync_plan_worker.planned.connect(self.sync_planned)
+            self._sync_plan_worker.reattributed.connect(self.files_reattributed)
+            self._sync_plan_worker.status_update.connect(self.set_progress_message)
+            self._plan_threadpool.start(self._sync_plan_worker)
+
             # self.fw.log_info(len(self.entities_to_sync))
             # iterate all parent assets
-            for entity_to_sync in self.entities_to_sync:
+            for entity_to_sync, template_resolver in zip(self.entities_to_sync, self._template_resolvers):
 
                 asset_info_gather_worker = AssetInfoGatherWorker(app=self.app,
                                                                 entity=entity_to_sync,
-                                                                framework=self.fw)
+                                                                framework=self.fw,
+                                                                template_resolver=template_resolver,
+                                                                plan_worker=self._sync_plan_worker,
+                                                                prefetcher=prefetcher)
+                # keep ownership of the worker so it can still be cancelled while it's running
+                asset_info_gather_worker.setAutoDelete(False)
 
                 if self._force_sync.isChecked():
                     asset_info_gather_worker.force_sync = True
 
                 asset_info_gather_worker.info_gathered.connect( self.asset_info_handler )
                 asset_info_gather_worker.progress.connect( self.iterate_progress )
-                asset_info_gather_worker.item_found_to_sync.connect(self.make_sync_tree_item)
+                asset_info_gather_worker.items_found_to_sync.connect(self.make_sync_tree_items)
                 asset_info_gather_worker.status_update.connect(self.set_progress_message)
                 asset_info_gather_worker.includes.connect(self.update_available_filters)
 
@@ -636,17 +946,78 @@ class SyncForm(QtGui.QWidget):
                 #     if self.child_asset_ids:
                 #         if entity_to_sync.get('id') in self.child_asset_ids:
                 #             asset_info_gather_worker.child = True
-                asset_info_gather_worker.run()
-                # self.threadpool.start(asset_info_gather_worker)
+                self._scan_workers.append(asset_info_gather_worker)
+                self.threadpool.start(asset_info_gather_worker)
+        except Exception as e:
+            self.log_error(e)
+
+    def make_scan_filter(self):
+        """
+        Narrow the scan to the files the filters show when filtering on the server.  The
+        values that are switched off are listed in the filter menus up front, as the scan
+        won't find them, so they can be switched back on.
+
+        :returns ScanFilter:    The filter, None when filtering on the client
+        """
+        if not self._server_filter.isChecked() or self.specific_files:
+            return None
+        states = self.filter_index.states()
+        for filter_type, values in states.items():
+            for value, enabled in values.items():
+                if not enabled:
+                    self.update_available_filters((filter_type, value))
+        return ScanFilter.from_states(states)
+
+    def files_reattributed(self, reattributed_info):
+        """
+        Remove the files an asset listed that an asset with a more specific root, planned
+        later in the scan, has taken over
+        """
+        try:
+            asset_name = reattributed_info.get("asset_name")
+            asset_dict = self._asset_items.get(asset_name)
+            if not asset_dict:
+                return
+            child_widgets = asset_dict['child_widgets']
+
+            nodes = []
+            for path in reattributed_info.get("paths"):
+                node = child_widgets.pop(path, None)
+                if node is None:
+                    continue
+                nodes.append(node)
+                for key, values in asset_dict.items():
+                    if key.startswith("child_") and isinstance(values, dict):
+                        values.pop(path, None)
+                self.asset_counters.add(asset_name, node.state, hidden=node.hidden, count=-1)
+                self.filter_index.remove(node)
+
+            tree_widget = asset_dict['tree_widget']
+            self._sync_model.remove_files(tree_widget, nodes)
+            if not child_widgets:
+                tree_widget.status = "Syncd"
+                tree_widget.icon = "success"
+                tree_widget.details = reattributed_info.get("detail")
+                asset_dict['status'] = tree_widget.status
+                self._sync_model.asset_changed(tree_widget)
+            else:
+                self.update_sync_counter(asset_name)
         except Exception as e:
             self.log_error(e)
 
+    def sync_planned(self, plan_info):
+        """
+        Keep the scan cache used by the plan so synced roots can be invalidated
+        """
+        self.scan_cache = plan_info.get("scan_cache")
+
 
     def make_icon(self, name):
         """
-        Helper to return QIcon from our limited icon schema used. 
+        Helper to return QIcon from our limited icon schema used, the icons are shared
+        through the process-wide icon registry
         """
-        return QtGui.QIcon(os.path.join(basepath, 'resources', "status_{}.png".format(name)))
+        return get_icon_registry().status_icon(name)
 
 
     def sync_in_progress(self, sync_item):
@@ -656,109 +1027,508 @@ class SyncForm(QtGui.QWidget):
         """
 
         asset_name = sync_item.get('asset_name')
-        sync_path = sync_item.get("sync_path")
+        sync_paths = sync_item.get("sync_paths")
 
-        sync_item_widget = self._asset_items[asset_name].get('child_widgets').get(sync_path)
+        child_widgets = self._asset_items[asset_name].get('child_widgets')
         asset_item_widget = self._asset_items[asset_name].get('tree_widget')
 
-        icon  = self.make_icon("syncing")
-        sync_item_widget.setIcon(1, icon)
-        sync_item_widget.setText(1, "Syncing")
-
-        self._asset_tree.scrollTo(self._asset_tree.indexFromItem(sync_item_widget))
-        asset_item_widget.setExpanded(True)
+        if self._journal:
+            self._journal.record_started(sync_paths)
+
+        sync_item_widgets = []
+        for sync_path in sync_paths:
+            sync_item_widget = child_widgets.get(sync_path)
+            sync_item_widget.icon = "syncing"
+            sync_item_widget.status = "Syncing"
+            self.set_sync_state(sync_item_widget, STATE_IN_FLIGHT)
+            sync_item_widgets.append(sync_item_widget)
+        self._sync_model.files_changed(sync_item_widgets)
+
+        self._asset_tree.setExpanded(self._sync_model.index_for(asset_item_widget), True)
+        # only follow the sync through rows the view already has, the rest are fetched
+        # when the user scrolls to them
+        for sync_item_widget in reversed(sync_item_widgets):
+            index = self._sync_model.index_for(sync_item_widget)
+            if index.isValid():
+                self._asset_tree.scrollTo(index)
+                break
     
 
+    def set_sync_state(self, sync_item_widget, state):
+        """
+        Move a file to a new sync state and update the counters of its asset
+        """
+        self.asset_counters.move(sync_item_widget.parent.name, sync_item_widget.state, state,
+                                 hidden=sync_item_widget.hidden)
+        sync_item_widget.state = state
+        self.schedule_counter_refresh()
+
     def item_syncd(self, sync_item):
         """
         Handle signal from SyncWorker.progress to display sync status in sync_item_widget. 
         This sync_item_widget is looked up from our global asset dictionary using the signal payload arg [dict]
         """
 
-        # log status of sync for this item
+        # log status of sync for the items in this batch of results
         asset_name = sync_item.get('asset_name')
-        sync_path = sync_item.get("sync_path")
-        response = sync_item.get('response')
-
-        # self.fw.log_debug(sync_path)
+        results = sync_item.get('results')
 
         # look up the sync-item object since we're passing only a topic/string around via signal
         child_widgets = self._asset_items[asset_name].get('child_widgets')
-        sync_item_widget = child_widgets.get(sync_path)
-        asset_item_widget = self._asset_items[asset_name].get('tree_widget')
-        
-        # since we're getting this                                                                
-        icon  = self.make_icon("success")
-        sync_item_widget.setIcon(1, icon)
-        sync_item_widget.setText(1, "Syncd")
-
-        # check how many asset children are still needing to be synced
-        count_left_to_sync = len([sync_widget for sync_path,sync_widget in child_widgets.items() if sync_widget.text(1)=="Ready"])
-
-        # set parent
-        parent_asset_status = "{} item{} to sync"
-        plurality = ""
-        if count_left_to_sync > 0:
-            if count_left_to_sync > 1:
-                plurality = "s"
-
-            # set asset parent's status regarding count-left-to-sync
-            asset_item_widget.setText(1, parent_asset_status.format(count_left_to_sync, plurality))
-        else:
-            # when all sync's are done...
-            icon  = self.make_icon("validate")
-            asset_item_widget.setIcon(1, icon)
-            asset_item_widget.setText(1,"Asset in Sync" )
 
-        self.iterate_progress(message="Syncing {}".format(sync_item_widget.text(0)))
+        sync_item_widgets = []
+        for result in results:
+            sync_item_widget = child_widgets.get(result.get("sync_path"))
+            if result.get('status') == STATUS_ERROR:
+                sync_item_widget.icon = "error"
+                sync_item_widget.status = "Error"
+                sync_item_widget.tooltip = str(result.get('response'))
+                self.set_sync_state(sync_item_widget, STATE_FAILED)
+                self._failed_files.append(sync_item_widget.path)
+            elif result.get('status') == STATUS_CANCELLED:
+                sync_item_widget.icon = "warning"
+                sync_item_widget.status = "Cancelled"
+                self.set_sync_state(sync_item_widget, STATE_PENDING)
+                self._cancelled_files.append(sync_item_widget.path)
+            else:
+                sync_item_widget.icon = "success"
+                sync_item_widget.status = "Syncd"
+                self.set_sync_state(sync_item_widget, STATE_DONE)
+                self._completed_files.append(sync_item_widget.path)
+            sync_item_widgets.append(sync_item_widget)
+        self._sync_model.files_changed(sync_item_widgets)
+
+        if self._journal:
+            self._journal.record_completed([(result.get("sync_path"), result.get("status"), self.synced_revision(result))
+                                            for result in results])
+
+        # the progress bar follows the bytes transferred, see sync_progress_updated, the sync
+        # is complete once every file has been reported
+        self.progress += len(sync_item_widgets)
+        if self.progress >= self.progress_maximum:
+            self.progress_complete("Syncing {}".format(sync_item_widgets[-1].name))
+
+    def sync_progress_updated(self, snapshot):
+        """
+        Show the overall progress of the running sync.  Called at most 10 times a second by
+        the ProgressAggregator of the sync with a snapshot of the bytes transferred so far
 
+        :param snapshot:    The snapshot dictionary, see ProgressAggregator.snapshot
+        """
+        if not self._syncing or self._cancelling:
+            return
+        self._progress_bar.setValue(int(snapshot["percent"] * 10))
+        message = "Syncing {} of {} files, {} of {}".format(
+            snapshot["files_done"], snapshot["files_total"],
+            sizeof_fmt(snapshot["transferred"] / 1024.0), sizeof_fmt(snapshot["total"] / 1024.0))
+        if snapshot["eta"] is not None:
+            message += " at {}/s, {} left".format(sizeof_fmt(snapshot["rate"] / 1024.0),
+                                                  format_time_remaining(snapshot["eta"]))
+        self.set_progress_message(message)
+
+    def stop_sync_progress(self):
+        """
+        Stop following the progress of the sync, the workers of a cancelled sync may still
+        report to the aggregator for a while
+        """
+        if self._sync_progress:
+            self._sync_progress.blockSignals(True)
+            self._sync_progress.stop()
+            self._sync_progress = None
+
+
+    def cancel_work(self):
+        """
+        Stop the scan or sync that's running.  Queued batches are dropped, running syncs are
+        aborted and pooled connections are disconnected once their commands have stopped
+        """
+        try:
+            if self._syncing:
+                self.cancel_sync()
+                return
+
+            self.cancel_scans()
+            self.connection_pool.drain()
+            self._progress_bar.setRange(0, 1)
+            self._progress_bar.setValue(0)
+            self.set_progress_message("Scan cancelled", percentf=" ")
+            self.set_ui_interactive(True)
+        except Exception as e:
+            self.log_error(e)
+
+    def cancel_sync(self):
+        """
+        Cancel the running sync.  Files that were syncing come back from the workers as
+        cancelled, the files of batches that hadn't started are marked here
+        """
+        if self._cancelling:
+            return
+        self._cancelling = True
+        self._cancel.setEnabled(False)
+        self.set_progress_message("Cancelling sync...")
+
+        dropped = self._sync_scheduler.cancel() if self._sync_scheduler else []
+        for worker in self._sync_workers:
+            worker.cancel()
+        self.connection_pool.drain()
+
+        for batch in dropped:
+            self.item_syncd({
+                "asset_name" : batch.group,
+                "results" : [{"sync_path" : path, "status" : STATUS_CANCELLED, "response" : None}
+                             for path in batch.paths]
+            })
+
+    def report_cancelled_sync(self):
+        """
+        Tell the user how far the cancelled sync got, the files that completed are logged
+        """
+        self._cancelling = False
+        message = "Sync cancelled: {} file{} synced, {} failed, {} not synced".format(
+            len(self._completed_files), "" if len(self._completed_files) == 1 else "s",
+            len(self._failed_files), len(self._cancelled_files))
+        self.fw.log_info(message)
+        if self._completed_files:
+            self.fw.log_info("Files synced before the sync was cancelled:\n{}".format("\n".join(self._completed_files)))
+        self._progress_bar.setVisible(True)
+        self.set_progress_message(message, percentf=" ")
+
+    def synced_revision(self, result):
+        """
+        :returns:    The revision a file was synced to, from the tagged output of the sync
+        """
+        response = result.get("response")
+        if isinstance(response, dict):
+            return response.get("rev")
+        return None
+
+    def start_journal(self, files_by_asset):
+        """
+        Record the files about to be synced in the session's journal, so that the sync can
+        be resumed if it's interrupted
+        """
+        try:
+            if not self._journal:
+                self._journal = SyncJournal.create(get_journal_directory(self.fw),
+                                                   workspace=self.journal_workspace(),
+                                                   force=self._force_sync.isChecked())
+            entries = []
+            for asset_name, files in files_by_asset.items():
+                asset_dict = self._asset_items[asset_name]
+                for sync_path, size in files:
+                    entries.append({
+                        "asset" : asset_name,
+                        "root_path" : asset_dict.get('root_path'),
+                        "path" : sync_path,
+                        "size" : size,
+                        "depot_file" : asset_dict['child_depot_files'].get(sync_path),
+                        "rev" : asset_dict['child_revs'].get(sync_path),
+                        "ext" : asset_dict['child_exts'].get(sync_path),
+                        "type" : asset_dict['child_types'].get(sync_path),
+                    })
+            self._journal.record_planned(entries)
+        except Exception as e:
+            # syncing without a journal only loses the ability to resume
+            self.log_error(e)
+            self._journal = None
+
+    def finish_journal(self):
+        """
+        Compact the journal once the sync is over, it's removed if everything was synced
+        """
+        if not self._journal:
+            return
+        try:
+            remaining = len(self._journal.remaining())
+            self._journal.finish()
+            if not remaining:
+                self._journal = None
+        except Exception as e:
+            self.log_error(e)
+            self._journal = None
+
+    def journal_workspace(self):
+        """
+        :returns str:    The workspace journals are recorded for, journals are only resumed into
+                         the workspace they were made in
+        """
+        if not self._workspace:
+            with self.connection_pool.connection() as p4:
+                self._workspace = "{}@{}".format(p4.client, p4.port)
+        return self._workspace
+
+    def look_for_interrupted_sync(self):
+        """
+        Have a sync of this workspace that didn't complete looked up on the threadpool, the
+        journals are read and Perforce is queried there rather than on the UI thread
+        """
+        try:
+            self.set_progress_message("Looking for interrupted syncs...")
+            worker = JournalLookupWorker(framework=self.fw, connection_pool=self.connection_pool)
+            worker.setAutoDelete(False)
+            worker.found.connect(self.interrupted_sync_found)
+            self._journal_lookup_worker = worker
+            self.threadpool.start(worker)
+        except Exception as e:
+            self.log_error(e)
+            self.scan_selection()
+
+    def interrupted_sync_found(self, lookup):
+        """
+        Handle the result of the JournalLookupWorker: resume the interrupted sync it found,
+        or scan the selection
+        """
+        self._journal_lookup_worker = None
+        self._workspace = lookup.get("workspace")
+        self._server = lookup.get("server")
+        if self._server:
+            self.concurrency_controller(self.max_transfers())
+            self.size_threadpool()
+        journal = lookup.get("journal")
+        if journal and self.resume_interrupted_sync(journal):
+            return
+        self.scan_selection()
+
+    def resume_interrupted_sync(self, journal):
+        """
+        Offer to sync the files a sync of this workspace that didn't complete had left,
+        without scanning again
+
+        :param journal:   The SyncJournal of the interrupted sync
+        :returns bool:    True if the interrupted sync is being resumed
+        """
+        remaining = journal.remaining()
+        started = time.strftime("%Y-%m-%d %H:%M", time.localtime(journal.session.get("created", 0)))
+        answer = QtGui.QMessageBox.question(
+            self,
+            "Resume Sync",
+            "A sync started {} didn't complete, {} file{} still need syncing.\n\n"
+            "Resume syncing the remaining files?".format(started, len(remaining), "s" if len(remaining) > 1 else ""),
+            QtGui.QMessageBox.Yes | QtGui.QMessageBox.No,
+            QtGui.QMessageBox.Yes
+        )
+        if answer != QtGui.QMessageBox.Yes:
+            journal.discard()
+            return False
+
+        self.resume_sync(journal)
+        return True
+
+    def resume_sync(self, journal):
+        """
+        Rebuild the sync tree from the files an interrupted sync had left and sync them
+        """
+        try:
+            self._journal = journal
+            self._force_sync.setChecked(bool(journal.session.get("force")))
+
+            files_by_asset = {}
+            for entry in journal.remaining():
+                files_by_asset.setdefault(entry.get("asset"), []).append(entry)
+
+            for asset_name, entries in files_by_asset.items():
+                self.asset_info_handler({
+                    "asset_name" : asset_name,
+                    "status" : "Resuming",
+                    "details" : entries[0].get("root_path"),
+                    "icon" : "load",
+                    "root_path" : entries[0].get("root_path"),
+                })
+                filter_values = set()
+                sync_items_info = []
+                for entry in entries:
+                    for filter_type in ["type", "ext"]:
+                        if entry.get(filter_type):
+                            filter_values.add((filter_type, entry.get(filter_type)))
+                    sync_items_info.append({
+                        "asset_name" : asset_name,
+                        "item_found" : {
+                            "clientFile" : entry.get("path"),
+                            "depotFile" : entry.get("depot_file"),
+                            "fileSize" : entry.get("size"),
+                            "rev" : entry.get("rev"),
+                        },
+                        "depot_file" : entry.get("depot_file"),
+                        "publish_id" : None,
+                        "step" : None,
+                        "type" : entry.get("type"),
+                        "ext" : entry.get("ext"),
+                        "status" : "resuming"
+                    })
+                for filter_info in sorted(filter_values):
+                    self.update_available_filters(filter_info)
+                self.make_sync_tree_items(sync_items_info)
+
+            self.set_progress_message("Resuming interrupted sync...")
+            self.start_sync()
+        except Exception as e:
+            self.log_error(e)
 
     def start_sync(self):
         """ 
-        Iterate through assets and their sync items to start workers for all paths that require syncs. 
-        Utilize a global threadpool to process
+        Iterate through assets and their sync items to queue prioritized batches of paths that require syncs. 
+        Utilize the form's threadpool to run workers that sync the queued batches concurrently
         """
         try:
             self.set_ui_interactive(False)
 
-            workers = []
+            # group the visible files per asset, big assets get split into size-balanced batches
+            files_by_asset = {}
             for asset_name, asset_dict in self._asset_items.items():
+                child_sizes = asset_dict['child_sizes']
                 for sync_path, sync_widget in asset_dict['child_widgets'].items():
-                    if not sync_widget.isHidden():
-                        sync_worker = SyncWorker()
-                        sync_worker.path_to_sync = sync_path
-                        sync_worker.asset_name = asset_name
-
-                        sync_worker.fw = self.fw
-                        
-                        sync_worker.started.connect(self.sync_in_progress)
-                        # worker.finished.connect(self.sync_completed)
-                        sync_worker.progress.connect(self.item_syncd)
-
-                        workers.append(sync_worker)
-                    
+                    # files synced earlier in the session, e.g. before a cancel, are skipped
+                    if not sync_widget.hidden and sync_widget.state != STATE_DONE:
+                        files_by_asset.setdefault(asset_name, []).append((sync_path, child_sizes.get(sync_path, 0)))
+
+            # sync the selected assets first, then by publish type and small files first
+            selected_assets = set()
+            for index in self._asset_tree.selectionModel().selectedIndexes():
+                node = index.internalPointer()
+                selected_assets.add(node.name if node.is_asset else node.parent.name)
+            publish_types = {}
+            for asset_name in files_by_asset:
+                publish_types.update(self._asset_items[asset_name]['child_types'])
+
+            max_transfers = self.max_transfers()
+            concurrency = self.concurrency_controller(max_transfers)
+            bandwidth_limit = self.fw.get_setting("sync_bandwidth_limit", 0) * 1024 * 1024
+            priority = SyncPriority(selected_groups=selected_assets,
+                                    type_order=self.fw.get_setting("sync_type_priority", []))
+            scheduler = SyncScheduler(max_transfers=max_transfers,
+                                      bandwidth_limit=bandwidth_limit or None,
+                                      priority=priority,
+                                      concurrency=concurrency)
+            batches = scheduler.add(files_by_asset, publish_types)
+            scheduler.close()
+            file_count = sum(len(batch) for batch in batches)
+
+            # one aggregator adds up the bytes of every file in the sync, it's told the size
+            # of each file up front so the progress covers the files that haven't started
+            sync_progress = ProgressAggregator()
+            for files in files_by_asset.values():
+                for sync_path, size in files:
+                    sync_progress.update(sync_path, total=size)
+
+            workers = []
+            for _ in range(min(max_transfers, len(batches))):
+                sync_worker = SyncWorker()
+                sync_worker.scheduler = scheduler
+                sync_worker.force_sync = self._force_sync.isChecked()
+                sync_worker.connection_pool = self.connection_pool
+                sync_worker.progress_aggregator = sync_progress
+                sync_worker.fw = self.fw
+
+                sync_worker.started.connect(self.sync_in_progress)
+                # worker.finished.connect(self.sync_completed)
+                sync_worker.progress.connect(self.item_syncd)
+
+                workers.append(sync_worker)
+
+            if not workers:
+                self.set_ui_interactive(True)
+                return
+            self._sync_scheduler = scheduler
+            self.start_journal(files_by_asset)
+            self._syncing = True
+            self.size_threadpool()
+            self._cancelling = False
+            self._completed_files = []
+            self._failed_files = []
+            self._cancelled_files = []
+
+            # the have list of these roots is about to change so their cached scans are stale
+            if self.scan_cache:
+                self.scan_cache.synced([self._asset_items[name].get('root_path') for name in files_by_asset])
+
             self.progress = 0
 
-            self.progress_maximum = len(workers)
-            self._progress_bar.setRange(0, self.progress_maximum)
+            self.progress_maximum = file_count
+            # per mille of the bytes to sync
+            self._progress_bar.setRange(0, 1000)
             self._progress_bar.setValue(0)
             self._progress_bar.setVisible(True)
             self._progress_bar.setFormat("%p%")
+            self._sync_progress = sync_progress
+            sync_progress.updated.connect(self.sync_progress_updated)
+            sync_progress.start()
 
-            # make threadpool to take all workers and multithread their execution
-            # self.threadpool = QtCore.QThreadPool.globalInstance()
-            # self.threadpool.setMaxThreadCount(min(24, self.threadpool.maxThreadCount()))
-
-            # self.fw.log_debug("Starting Threaded P4 Sync...")
-
-            # setup workers for multiprocessing
-
+            # run the batches concurrently on the form's threadpool
+            self._sync_workers = workers
             for sync_worker in workers:
-                sync_worker.run()
+                sync_worker.setAutoDelete(False)
+                self.threadpool.start(sync_worker)
         except Exception as e:
             self.log_error(e)
 
 
+    def concurrency_controller(self, max_transfers):
+        """
+        Get the session-wide controller adapting the number of batches synced at once to the
+        load of the server, with the current settings
+
+        :param max_transfers:    Highest number of batches synced at once
+        :returns:                A ConcurrencyController instance
+        """
+        concurrency = get_concurrency_controller(
+            self._server or self.p4.port,
+            floor=self.fw.get_setting("sync_min_transfers", DEFAULT_FLOOR),
+            ceiling=max_transfers,
+            target_latency=self.fw.get_setting("sync_target_latency", DEFAULT_TARGET_LATENCY))
+        if concurrency is not self._concurrency:
+            if self._concurrency:
+                self._concurrency.remove_listener(self.concurrency_changed)
+            concurrency.add_listener(self.concurrency_changed)
+            self._concurrency = concurrency
+        return concurrency
+
+    def concurrency_changed(self, metrics):
+        """
+        Called from the sync workers' threads when the number of batches synced at once changes,
+        the metrics are handed over to the UI thread
+        """
+        self.concurrency_updated.emit(metrics)
+
+    def show_concurrency(self, metrics):
+        """
+        Follow a change of the number of batches synced at once: the threadpool is resized and
+        the metrics are shown in the tooltip of the progress bar
+        """
+        summary = self.concurrency_summary(metrics)
+        self.fw.log_debug(summary)
+        self._progress_bar.setToolTip(summary)
+        self.size_threadpool()
+
+    def concurrency_summary(self, metrics):
+        """
+        :param metrics:    ConcurrencyController.metrics()
+        :returns str:      The metrics in a sentence
+        """
+        latency = "{}s".format(metrics["latency"]) if metrics["latency"] is not None else "unknown"
+        return "Syncing up to {} batches at once ({}-{}), average latency {} over {} syncs, " \
+               "{} overload errors".format(metrics["limit"], metrics["floor"], metrics["ceiling"], latency,
+                                           metrics["commands"], metrics["overloads"])
+
+    def max_transfers(self):
+        """
+        :returns int:    Highest number of batches synced at once, the ceiling of the concurrency controller
+        """
+        return max(1, self.fw.get_setting("sync_max_transfers", DEFAULT_CEILING))
+
+    def size_threadpool(self):
+        """
+        Size the threadpool from the concurrency controller of the server.  A sync gets a thread
+        for as many batches as the controller may let sync at once, scans follow its current
+        limit up to sync_max_threads
+        """
+        if not self._concurrency:
+            return
+        if self._syncing:
+            thread_count = self._concurrency.ceiling
+        else:
+            thread_count = min(self._concurrency.limit, self.fw.get_setting("sync_max_threads", 8))
+        self.threadpool.setMaxThreadCount(max(1, thread_count))
+
     def log(self, msg, error=0):
         if logger:
             if error:
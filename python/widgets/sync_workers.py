@@ -3,10 +3,30 @@ from sgtk.platform.qt import QtCore, QtGui
 import os
 import traceback
 import pprint
+import queue
 import random
+import threading
 import time
 
-from ..sync.resolver import TemplateResolver
+from ..sync.resolver import TemplateResolver, published_file_path
+from ..sync.executor import run_sync_batch, SyncCancelled, STATUS_ERROR, STATUS_CANCELLED
+from ..sync.concurrency import LatencyProbe
+from ..sync.journal import SyncJournal, get_journal_directory
+from ..sync.publish_index import PublishIndex
+from ..sync.scan_cache import get_scan_cache, get_highest_change
+from ..sync.planner import SyncPlanner, normalize_root, PLAN_ITEMS, PLAN_NO_FILES, PLAN_UP_TO_DATE, PLAN_ERROR
+
+# maximum number of files sent back to the main thread in a single signal
+ITEM_BATCH_SIZE = 1000
+
+# minimum time in seconds between sync progress signals of a worker
+PROGRESS_EMIT_INTERVAL = 0.1
+
+# maximum number of resolved assets waiting for the Perforce stage of a scan
+PLAN_QUEUE_SIZE = 64
+
+# time in seconds the scan stages wait on each other before checking for cancellation
+PLAN_QUEUE_POLL_INTERVAL = 0.1
 
 
 class SyncSignaller(QtCore.QObject):
@@ -15,7 +35,28 @@ class SyncSignaller(QtCore.QObject):
     """
     started = QtCore.Signal(dict)
     finished = QtCore.Signal()
-    progress = QtCore.Signal(dict) # (path to sync, p4 sync response)
+    progress = QtCore.Signal(dict) # (asset name, [path synced, status, p4 sync response])
+
+class SyncPlanSignaller(QtCore.QObject):
+    """
+    Create signaller class for SyncPlan Worker, required for using signals due to QObject inheritance
+    """
+    planned = QtCore.Signal(dict)
+    reattributed = QtCore.Signal(dict)
+    status_update = QtCore.Signal(str)
+
+class PublishLookupSignaller(QtCore.QObject):
+    """
+    Create signaller class for PublishLookup Worker, required for using signals due to QObject inheritance
+    """
+    index_ready = QtCore.Signal(object)
+    status_update = QtCore.Signal(str)
+
+class JournalLookupSignaller(QtCore.QObject):
+    """
+    Create signaller class for JournalLookup Worker, required for using signals due to QObject inheritance
+    """
+    found = QtCore.Signal(dict)
 
 class AssetInfoGatherSignaller(QtCore.QObject):
     """
@@ -24,23 +65,25 @@ class AssetInfoGatherSignaller(QtCore.QObject):
     progress = QtCore.Signal(str)
     root_path_resolved = QtCore.Signal(str)
     info_gathered = QtCore.Signal(dict) 
-    item_found_to_sync = QtCore.Signal(dict)
+    items_found_to_sync = QtCore.Signal(list)
     status_update = QtCore.Signal(str)
     includes = QtCore.Signal(tuple)
 
 class SyncWorker(QtCore.QRunnable):
 
-    # structurally anticipate basic p4 calls, which will route to the main form. 
-    p4 = None 
     fw = None
-    path_to_sync = None
+    paths_to_sync = None
     asset_name = None
-
-
+    force_sync = False
+    connection_pool = None
+    scheduler = None
+    progress_aggregator = None
 
     def __init__(self):
         """
-        Handles syncing specific file from perforce depot to local workspace on disk
+        Handles syncing a batch of files from perforce depot to local workspace on disk
+        with a single sync command.  When a scheduler is set, the worker keeps taking
+        batches from it, in priority order, until there are none left
         """
         super(SyncWorker, self).__init__()
         self.signaller = SyncSignaller()
@@ -51,48 +94,433 @@ class SyncWorker(QtCore.QRunnable):
         self.finished = self.signaller.finished
         self.progress = self.signaller.progress
 
+        self._results = []
+        self._reported = set()
+        self._last_emit = 0
+        self._cancelled = threading.Event()
+        self._probe = None
+
     def log_error(self, e):
         self.fw.log_error(str(e))
         self.fw.log_error(traceback.format_exc())
 
-    @QtCore.Slot()
-    def run(self):
-        
+    def cancel(self):
         """
-        Ryn syncs from perforce, signals information back to main thread. 
+        Request that the worker stops as soon as possible.  The running sync is aborted and
+        no more batches are taken.  Safe to call from any thread.
         """
-        self.p4 = self.fw.connection.connect()
+        self._cancelled.set()
 
-        # self.fw.log_debug("starting thread in pool to sync {}".format(self.path_to_sync))
-        self.started.emit({
-            "asset_name" : self.asset_name,
-            "sync_path" : self.path_to_sync
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def file_synced(self, path, status, response):
+        """
+        Collect the result for a single file in the batch, results are sent back to the
+        main thread together at most every PROGRESS_EMIT_INTERVAL seconds
+        """
+        self._reported.add(path)
+        if self._probe and status != STATUS_CANCELLED:
+            self._probe.answered(response if status == STATUS_ERROR else None)
+        self._results.append({
+            "sync_path" : path,
+            "status" : status,
+            "response" : response
             }
         )
+        if time.monotonic() - self._last_emit >= PROGRESS_EMIT_INTERVAL:
+            self.flush_results()
 
-        # run the syncs
-        p4_response = self.p4.run("sync", ["-f"], "{}#head".format(self.path_to_sync))
-        self.fw.log_debug(p4_response)
+    def throttle(self, nbytes):
+        """
+        Hold the running sync back while it's ahead of the bandwidth limit, until the
+        worker is cancelled
+        """
+        self.scheduler.throttle(nbytes, cancelled=self._cancelled.is_set)
 
-        # emit item key and p4 response to main thread
+    def flush_results(self):
+        """
+        Emit the results collected since the last emit back to the main thread
+        """
+        self._last_emit = time.monotonic()
+        if not self._results:
+            return
+        results, self._results = self._results, []
         self.progress.emit({
             "asset_name" : self.asset_name,
-            "sync_path" : self.path_to_sync, 
-            "response" : p4_response
+            "results" : results
             }
         )
 
+    @QtCore.Slot()
+    def run(self):
+        
+        """
+        Run syncs from perforce, signals information back to main thread. 
+        """
+        if not self.scheduler:
+            self.sync_batch()
+            self.finished.emit()
+            return
+
+        while not self.cancelled:
+            batch = self.scheduler.get()
+            if batch is None:
+                break
+            self._probe = LatencyProbe()
+            try:
+                self.asset_name = batch.group
+                self.paths_to_sync = batch.paths
+                self.sync_batch()
+            finally:
+                # cancelled batches say nothing about the load of the server
+                if self.cancelled:
+                    self.scheduler.task_done(batch)
+                else:
+                    self.scheduler.task_done(batch, self._probe.latency, self._probe.error)
+                self._probe = None
+        self.finished.emit()
+
+    def sync_batch(self):
+        """
+        Sync the current batch of paths
+        """
+        self._reported = set()
+        try:
+            self.started.emit({
+                "asset_name" : self.asset_name,
+                "sync_paths" : self.paths_to_sync
+                }
+            )
+
+            # run the sync for the whole batch, results are reported per-file as they arrive.
+            # The connection is the one of the pool thread the worker runs on
+            with self.connection_pool.connection() as p4:
+                run_sync_batch(p4, self.paths_to_sync, force=self.force_sync, on_file=self.file_synced,
+                               cancelled=self._cancelled.is_set, progress=self.progress_aggregator,
+                               throttle=self.throttle if self.scheduler else None, probe=self._probe)
+        except Exception as e:
+            status = STATUS_CANCELLED if self.cancelled else STATUS_ERROR
+            if not self.cancelled:
+                self.log_error(e)
+            for path in self.paths_to_sync:
+                if path not in self._reported:
+                    self.file_synced(path, status, str(e))
+
+        self.flush_results()
+
+
+
+class SyncPlanWorker(QtCore.QRunnable):
+
+    def __init__(self, asset_count=0, force_sync=False, framework=None, connection_pool=None,
+                 queue_size=PLAN_QUEUE_SIZE, app=None, scan_filter=None):
+        """
+        Perforce stage of a scan.  The AssetInfoGatherWorkers resolve their assets in SG
+        concurrently and hand them over through a bounded queue with submit().  This worker
+        runs the dry-run sync for whatever has been handed over so far and lets each of
+        those assets signal its results straight away, while the others are still resolving.
+        Overlapping roots within a batch are only scanned once and roots with nothing new
+        submitted since their last scan reuse the cached result.
+
+        :param asset_count:        Number of assets that will be submitted
+        :param force_sync:         True if the scan is a forced (-f) dry run
+        :param framework:          This framework
+        :param connection_pool:    ThreadConnectionProvider or ConnectionPool to get a Perforce connection from
+        :param queue_size:         Maximum number of resolved assets waiting to be planned
+        :param app:                The app the sync was launched from
+        :param scan_filter:        Optional ScanFilter narrowing the dry runs to the filtered files
+        """
+        super(SyncPlanWorker, self).__init__()
+        self.asset_count = asset_count
+        self.force_sync = force_sync
+        self.fw = framework
+        self.connection_pool = connection_pool
+        self.app = app
+        self.scan_filter = scan_filter
+        self._cancelled = threading.Event()
+        self._queue = queue.Queue(maxsize=queue_size)
+
+        self.scan_cache = None
+        self.scan_change = None
+        # files already signalled for an asset planned in an earlier batch -> (that asset's
+        # worker, its normalized root)
+        self._claimed = {}
+
+        self.signaller = SyncPlanSignaller()
+        self.planned = self.signaller.planned
+        self.reattributed = self.signaller.reattributed
+        self.status_update = self.signaller.status_update
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def submit(self, worker):
+        """
+        Hand a resolved asset over to be planned.  Blocks while the queue is full, so the
+        SG stage can't run arbitrarily far ahead of Perforce.  Called from the threads of
+        the AssetInfoGatherWorkers.
+
+        :param worker:     The resolved AssetInfoGatherWorker
+        :returns bool:     False if the scan was cancelled before the asset was queued
+        """
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(worker, timeout=PLAN_QUEUE_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def next_batch(self, limit):
+        """
+        Wait for the next resolved asset and take the others that are already queued along
+
+        :param limit:      Maximum number of assets to take
+        :returns list:     The AssetInfoGatherWorkers to plan, empty if the scan was cancelled
+        """
+        batch = []
+        while not batch:
+            if self._cancelled.is_set():
+                return []
+            try:
+                batch.append(self._queue.get(timeout=PLAN_QUEUE_POLL_INTERVAL))
+            except queue.Empty:
+                pass
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    @QtCore.Slot()
+    def run(self):
+        """
+        Plan the assets batch by batch as they're resolved, until all of them are planned
+        """
+        remaining = self.asset_count
+        p4 = None
+        try:
+            while remaining > 0:
+                batch = self.next_batch(remaining)
+                if not batch:
+                    return
+                remaining -= len(batch)
+
+                plan = {}
+                try:
+                    to_scan = [worker for worker in batch if worker.needs_dry_run]
+                    if to_scan:
+                        if p4 is None:
+                            p4 = self.connection_pool.acquire()
+                            self.start_scan(p4)
+                        plan = self.plan_batch(p4, to_scan)
+                except SyncCancelled:
+                    return
+                except Exception as e:
+                    self.fw.log_error(str(e))
+                    self.fw.log_error(traceback.format_exc())
+                    for worker in batch:
+                        if worker.needs_dry_run:
+                            worker.asset_item["error"] = str(e)
+
+                for worker in batch:
+                    if self._cancelled.is_set():
+                        return
+                    worker.apply_plan(plan.get(id(worker)))
+        finally:
+            if p4 is not None:
+                self.connection_pool.release(p4)
+
+    def start_scan(self, p4):
+        """
+        Look up the scan cache and the change the scan is made at, with the first connection
+        """
+        self.scan_cache = get_scan_cache(p4.port, p4.client)
+        # the change is queried before the first dry run starts so a submit that lands
+        # during the scan is picked up by the next one
+        self.scan_change = get_highest_change(p4)
+        self.planned.emit({"scan_cache": self.scan_cache})
+
+    def plan_batch(self, p4, workers):
+        """
+        Run the dry-run sync for a batch of resolved assets
+
+        :param p4:         The Perforce connection to use
+        :param workers:    The AssetInfoGatherWorkers that need a dry run
+        :returns dict:     id() of each worker -> its entry from SyncPlanner.run
+        """
+        root_paths = [worker.root_path for worker in workers]
+        if self.scan_filter and self.scan_filter.excludes_publishes:
+            try:
+                self.scan_filter.prefetch(lambda: self.app.shotgun, [worker.entity for worker in workers])
+            except Exception as e:
+                # the files are still hidden by the filters once their publishes are looked up
+                self.fw.log_error("Failed to look up the publishes to leave out of the scan: {}".format(e))
+
+        self.status_update.emit("Scanning Perforce for {} asset roots...".format(len(root_paths)))
+        scope = self.scan_filter.scope if self.scan_filter else None
+        current_roots = self.scan_cache.refresh(p4, root_paths, self.force_sync, scope)
+
+        planner = SyncPlanner(force=self.force_sync,
+                              scan_cache=self.scan_cache,
+                              scan_change=self.scan_change,
+                              current_roots=current_roots,
+                              scan_filter=self.scan_filter)
+        for index, root_path in enumerate(root_paths):
+            planner.add_request(index, root_path)
+        plan = planner.run(p4, cancelled=self._cancelled.is_set)
+
+        for entry in plan.values():
+            if entry.get("covered_by") is not None:
+                entry["detail"] = "Files under [{}] are listed with {}".format(
+                    entry.get("root_path"), workers[entry["covered_by"]].asset_name)
+        return dict((id(workers[index]), self.unclaimed(workers[index], entry)) for index, entry in plan.items())
+
+    def unclaimed(self, worker, plan_entry):
+        """
+        Give the files of a plan entry to the asset only if no asset of an earlier batch
+        has a root at least as specific, so that nested roots planned in different batches
+        don't list a file twice.  Files an earlier asset with a less specific root listed
+        are taken over by this one, and the earlier asset is told with the reattributed
+        signal before this one signals them.  Within a batch the planner gives each file to
+        the most specific root.
+        """
+        root, _ = normalize_root(plan_entry.get("root_path") or "")
+        items = []
+        taken_over = {}
+        for item in plan_entry.get("items") or []:
+            path = item.get("clientFile")
+            claim = self._claimed.get(path)
+            if claim is not None:
+                owner, owner_root = claim
+                # roots containing another one end with a '/', so they're its prefix
+                if root == owner_root or not root.startswith(owner_root):
+                    continue
+                taken_over.setdefault(id(owner), (owner, []))[1].append(path)
+            self._claimed[path] = (worker, root)
+            items.append(item)
+
+        for owner, paths in taken_over.values():
+            self.reattributed.emit({"asset_name": owner.asset_name, "paths": paths,
+                                    "detail": "Files under [{}] are listed with {}".format(
+                                        owner.root_path, worker.asset_name)})
+
+        if plan_entry.get("status") == PLAN_ITEMS and not items:
+            plan_entry["status"] = PLAN_UP_TO_DATE
+            plan_entry["detail"] = "Files under [{}] are listed with another asset".format(plan_entry.get("root_path"))
+        plan_entry["items"] = items
+        return plan_entry
+
+
+class PublishLookupWorker(QtCore.QRunnable):
+
+    def __init__(self, app=None, depot_files=None, publish_ids=None, framework=None):
+        """
+        Looks up the PublishedFile entities for every file found across a scan with a few
+        bulk queries, and hands the resulting PublishIndex back to the main thread.
+
+        :param app:            The app the sync was launched from
+        :param depot_files:    Depot paths of all files found by the scan
+        :param publish_ids:    Ids of PublishedFile entities that were scanned directly
+        :param framework:      This framework
+        """
+        super(PublishLookupWorker, self).__init__()
+        self.app = app
+        self.depot_files = depot_files or []
+        self.publish_ids = publish_ids or []
+        self.fw = framework
+
+        self.signaller = PublishLookupSignaller()
+        self.index_ready = self.signaller.index_ready
+        self.status_update = self.signaller.status_update
+
+    @QtCore.Slot()
+    def run(self):
+        """
+        Query ShotGrid in chunked, parallel batches and signal the index back
+        """
+        try:
+            self.status_update.emit("Looking up publish information for {} files...".format(len(self.depot_files)))
+            index = PublishIndex.fetch(lambda: self.app.shotgun,
+                                       depot_paths=self.depot_files,
+                                       publish_ids=self.publish_ids)
+        except Exception as e:
+            self.fw.log_error(str(e))
+            self.fw.log_error(traceback.format_exc())
+            index = PublishIndex()
+        self.index_ready.emit(index)
+
+
+class JournalLookupWorker(QtCore.QRunnable):
+
+    def __init__(self, framework=None, connection_pool=None):
+        """
+        Looks up the workspace of the pool's Perforce connection and the newest journal of
+        a sync of that workspace that didn't complete, off the UI thread.  Older incomplete
+        journals of the workspace are superseded by it and discarded.
+
+        :param framework:          This framework
+        :param connection_pool:    ThreadConnectionProvider or ConnectionPool to get a Perforce connection from
+        """
+        super(JournalLookupWorker, self).__init__()
+        self.fw = framework
+        self.connection_pool = connection_pool
+
+        self.signaller = JournalLookupSignaller()
+        self.found = self.signaller.found
+
+    @QtCore.Slot()
+    def run(self):
+        """
+        Signal the workspace, server and incomplete journal (None if there isn't one) back
+        """
+        lookup = {"workspace": None, "server": None, "journal": None}
+        try:
+            with self.connection_pool.connection() as p4:
+                lookup["server"] = p4.port
+                lookup["workspace"] = "{}@{}".format(p4.client, p4.port)
+            journals = [journal for journal in SyncJournal.find_incomplete(get_journal_directory(self.fw))
+                        if journal.session.get("workspace") == lookup["workspace"]]
+            if journals:
+                lookup["journal"] = journals[0]
+                for older_journal in journals[1:]:
+                    older_journal.discard()
+        except Exception as e:
+            self.fw.log_error(str(e))
+            self.fw.log_error(traceback.format_exc())
+        self.found.emit(lookup)
+
 
 class AssetInfoGatherWorker(QtCore.QRunnable):
 
-    def __init__(self, app=None, entity=None, framework=None):
+    def __init__(self, app=None, entity=None, framework=None, template_resolver=None, plan_worker=None,
+                 prefetcher=None):
         """
-        Handles gathering information about specific asset from SG and gets related Perforce information
+        Handles gathering information about specific asset from SG.  Once resolved, the asset
+        is handed to the SyncPlanWorker, which runs the related Perforce dry run along with
+        the other assets resolved by then and hands the asset its share of the plan through
+        apply_plan().
+
+        :param app:                  The app the sync was launched from
+        :param entity:               The SG entity to gather sync information for
+        :param framework:            This framework
+        :param template_resolver:    Optional TemplateResolver for the entity
+        :param plan_worker:          The SyncPlanWorker of the scan
+        :param prefetcher:           Optional EntityPrefetcher looking up the entities of the scan in bulk
         """
         super(AssetInfoGatherWorker, self).__init__()
 
         self.app = app
         self.entity = entity
+        self.template_resolver = template_resolver
+        self.plan_worker = plan_worker
+        self.prefetcher = prefetcher
+        self._cancelled = threading.Event()
+        self._asset_name = None
+        self._asset_name_resolved = False
 
         self.force_sync = False
 
@@ -109,7 +537,7 @@ class AssetInfoGatherWorker(QtCore.QRunnable):
         self.info_gathered = self.signaller.info_gathered
         self.progress = self.signaller.progress
         self.root_path_resolved = self.signaller.root_path_resolved
-        self.item_found_to_sync = self.signaller.item_found_to_sync
+        self.items_found_to_sync = self.signaller.items_found_to_sync
         self.status_update = self.signaller.status_update
         self.includes = self.signaller.includes
 
@@ -119,8 +547,27 @@ class AssetInfoGatherWorker(QtCore.QRunnable):
         self.fw.log_error(str(e))
         self.fw.log_error(traceback.format_exc())
 
+    def cancel(self):
+        """
+        Request that the worker stops as soon as possible.  Safe to call from any thread.
+        """
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
     @property
     def asset_name(self):
+        """
+        Name of the asset, looked up once the asset is resolved and reused afterwards
+        """
+        if not self._asset_name_resolved and self.asset_item is not None:
+            self._asset_name = self.lookup_asset_name()
+            self._asset_name_resolved = True
+        return self._asset_name
+
+    def lookup_asset_name(self):
         try:
             name = None
             if self.asset_item.get('context'):
@@ -140,11 +587,20 @@ class AssetInfoGatherWorker(QtCore.QRunnable):
         
     @property
     def root_path(self):
+        if not self.asset_item:
+            return None
         rp = self.asset_item.get('root_path')
         if self.entity.get('type') in ["PublishedFile"]:
-            # TODO: this needs to become dynamic
-            rp = "B:/" + self.entity.get('path_cache')
+            rp = published_file_path(self.entity)
         return rp
+
+    @property
+    def needs_dry_run(self):
+        """
+        True if the asset resolved to a root that needs to be scanned in Perforce
+        """
+        return bool(self.asset_item and not self.asset_item.get('error') and self.root_path
+                    and self.entity.get('type') not in ['PublishedFile'])
     
     @property
     def status(self):
@@ -155,12 +611,12 @@ class AssetInfoGatherWorker(QtCore.QRunnable):
         return self._status
 
 
-    def collect_and_map_info(self):
+    def collect_and_map_info(self, plan_entry=None):
         """
-        Call perforce for response and form data we will signal back
+        Form data we will signal back from the asset's share of the sync plan
         """
-        if self.status != 'error':
-            self.get_perforce_sync_dry_reponse()
+        if self.status != 'Error':
+            self.map_sync_plan(plan_entry)
 
         # payload that we'll send back to the main thread to make UI item with
         self.info_to_signal = {
@@ -174,37 +630,29 @@ class AssetInfoGatherWorker(QtCore.QRunnable):
         }
 
 
-    def get_perforce_sync_dry_reponse(self):
+    def map_sync_plan(self, plan_entry):
         """
-        Get a response from perforce about our wish to sync a specific asset root path,
-        Contextually use response to drive our status that we show the user. 1
+        Use the dry-run result planned for our asset root path to drive the status that
+        we show the user.
         """
-        if self.root_path and (self.entity.get('type') not in ['PublishedFile']):
-            self.p4 = self.fw.connection.connect()
-            
-            arguments = ["-n"]
-            if self.force_sync:
-                arguments.append("-f")
-            sync_response = self.p4.run("sync", arguments, "{}#head".format(self.root_path))
-            
-
-            if not sync_response:
+        if plan_entry and (self.entity.get('type') not in ['PublishedFile']):
+            if plan_entry.get("status") == PLAN_NO_FILES:
                 self._status = "Not In Depot"
                 self._icon = "error"
                 self._detail = "Nothing in depot resolves [{}]".format(self.root_path)
 
-            elif len(sync_response) is 1 and type(sync_response[0]) is str:
+            elif plan_entry.get("status") == PLAN_UP_TO_DATE:
                 self._status = "Syncd"
                 self._icon = "success"
-                self._detail = "Nothing new to sync for [{}]".format(self.root_path)
+                self._detail = plan_entry.get("detail") or "Nothing new to sync for [{}]".format(self.root_path)
             else:
                 # if the response from p4 has items... make UI elements for them
-                self._items_to_sync = [i for i in sync_response if type(i) != str]
+                self._items_to_sync = plan_entry.get("items")
                 self._status = "{} items to Sync".format(len(self._items_to_sync))
                 self._icon = "load"
                 self._detail = self.root_path
         if self.entity.get('type') in ['PublishedFile']:
-            self._items_to_sync = [{"clientFile" : "B:/" + self.entity.get('path_cache')}]
+            self._items_to_sync = [{"clientFile" : published_file_path(self.entity)}]
             self._status = "Exact Path"
             self._detail = "Exact path specified: [{}]".format(self.root_path)
             self._icon = "load"
@@ -214,19 +662,47 @@ class AssetInfoGatherWorker(QtCore.QRunnable):
     def run(self):
 
         """
-        Checks if there are errors in the item, signals that, or if not, gets info regarding what there is to sync. 
+        Resolves the asset's template, context, root path and name and hands the asset to
+        the SyncPlanWorker to be planned.
         """
+        if self.cancelled:
+            return
+
         try:
-            self.template_resolver = TemplateResolver(app=self.app,
-                                                entity=self.entity )
+            if self.prefetcher:
+                self.prefetcher.ensure()
+            if not self.template_resolver:
+                self.template_resolver = TemplateResolver(app=self.app,
+                                                    entity=self.entity )
 
             self.asset_item = self.template_resolver.entity_info
-            progress_status_string = ""
 
+            if self.cancelled:
+                return
             self.status_update.emit("Requesting sync information for {}".format(self.asset_name))
+        except Exception as e:
+            self.log_error(e)
+            self.asset_item = {"error": str(e)}
+
+        self.plan_worker.submit(self)
+
+    def apply_plan(self, plan_entry=None):
+        """
+        Checks if there are errors in the item, signals that, or if not, signals what there is to sync
+        according to the plan.  Called by the SyncPlanWorker once the dry run has completed.
+
+        :param plan_entry:    The asset's entry from SyncPlanner.run, None if the asset wasn't planned
+        """
+        if self.cancelled:
+            return
 
+        progress_status_string = ""
+        try:
+            if plan_entry and plan_entry.get("status") == PLAN_ERROR:
+                # only this asset's root failed the dry run, the others of the batch were planned
+                self.asset_item["error"] = plan_entry.get("error")
             #self.fw.log_info(self.asset_item)
-            self.collect_and_map_info()
+            self.collect_and_map_info(plan_entry)
             
             self.info_gathered.emit(self.info_to_signal)
             if self.status == 'Syncd':
@@ -236,60 +712,48 @@ class AssetInfoGatherWorker(QtCore.QRunnable):
             if self.status != "Error":
                 
                 if self._items_to_sync:
-                    # make lookup list for SG api call for published files to correlate. 
-                    depot_files = [i.get('depotFile') for i in self._items_to_sync]
-                    find_fields = [
-                        "sg_p4_change_number"
-                        "code", 
-                        "entity.Asset.code"
-                        "sg_p4_depo_path",
-                        "task.Task.step.Step.code",
-                        "published_file_type.PublishedFileType.code",
-                        ]
-                    
-                    sg_filter = ["sg_p4_depo_path", "in", depot_files]
+                    # step and type come from the PublishedFile entities, which are looked up for
+                    # all scanned assets at once when the scan completes (see PublishLookupWorker)
+                    publish_id = None
                     if self.entity.get('type') in ["PublishedFile"]:
-                        sg_filter = ["id", "in", self.entity.get('id')]
-                    published_files = self.app.shotgun.find('PublishedFile', [sg_filter], find_fields )
-                    published_file_by_depot_file = {i.get('sg_p4_depo_path'):i for i in published_files}
-                    # self.fw.log_info(published_file_by_depot_file)
-                    for item in self._items_to_sync:
-
-                        published_file = published_file_by_depot_file.get(item.get('depotFile'))
-                        step = None
-
-                        file_type = None
-                        if published_file:
-                            #self.fw.log_info(published_file_by_depot_file)
+                        publish_id = self.entity.get('id')
 
-                            step = published_file.get("task.Task.step.Step.code")
-                            file_type = published_file.get("published_file_type.PublishedFileType.code")
-
-
-                            if file_type:
-                                self.includes.emit(("type", file_type))
-
-                        if step:
-                            self.includes.emit(("step", step))
+                    # send files back in batches rather than one signal per file
+                    asset_name = self.asset_name
+                    extensions = set()
+                    batch = []
+                    for item in self._items_to_sync:
 
                         ext = None
                         if "." in item.get("clientFile"):
-                            ext = os.path.basename(item.get("clientFile")).split('.')[-1]
-                            self.includes.emit(("ext", ext.lower()))
+                            ext = os.path.basename(item.get("clientFile")).split('.')[-1].lower()
+                            extensions.add(ext)
 
                         status = item.get('action')
                         if self.entity.get('type') in ["PublishedFile"]:
                             status = "Exact File"
 
-                        self.item_found_to_sync.emit( {
-                            "asset_name" : self.asset_name,
+                        batch.append( {
+                            "asset_name" : asset_name,
                             "item_found" : item,
-                            "step" : step,
-                            "type" : file_type,
-                            "ext" : ext.lower(),
+                            "depot_file" : item.get('depotFile'),
+                            "publish_id" : publish_id,
+                            "step" : None,
+                            "type" : None,
+                            "ext" : ext,
                             "status" : status
                             }
                         )
+                        if len(batch) >= ITEM_BATCH_SIZE:
+                            if self.cancelled:
+                                return
+                            self.items_found_to_sync.emit(batch)
+                            batch = []
+
+                    for ext in sorted(extensions):
+                        self.includes.emit(("ext", ext))
+                    if batch:
+                        self.items_found_to_sync.emit(batch)
             else:
                 progress_status_string = " (Encountered error. See details)"
             self.fw.log_info(progress_status_string)
@@ -1,27 +1,92 @@
 import os
 import json
+import tempfile
 import webbrowser
 
+import sgtk
+from sgtk.platform.qt import QtCore
+
+logger = sgtk.platform.get_logger(__name__)
+
+# milliseconds to wait for further changes before writing the preferences to disk
+PREF_WRITE_DELAY = 1000
+
 class PrefFile:
-    def __init__(self):
+    """
+    Sync dialog preferences, stored as JSON in ~/.p4syncpref.  The file is only read
+    once, the preferences are kept in memory and changes are written back by a
+    single-shot timer PREF_WRITE_DELAY ms after the last change, or when flush() is
+    called.  The preferences belong to the UI thread, they mustn't be changed from
+    other threads.
+    """
+    def __init__(self, delay=PREF_WRITE_DELAY, parent=None):
+        """
+        :param delay:     Milliseconds to wait for further changes before writing
+        :param parent:    Optional QObject owning the write timer, e.g. the dialog
+        """
         self.root_dir = os.path.expanduser("~")
         self.pref_file = os.path.join(self.root_dir, ".p4syncpref")
-        
+
+        self._dirty = False
+        self._timer = QtCore.QTimer(parent)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(delay)
+        self._timer.timeout.connect(self.flush)
+        self.data = None
+
         self.read()
 
     def write(self, data=None):
-        if not data:
-            data = self.data
-        with open(self.pref_file, "w") as file_obj:
-            json.dump(data, file_obj, indent=4)
+        """
+        Update the preferences and schedule them to be written to disk.  Each change
+        restarts the timer, so a burst of changes is written once
+        """
+        if data is not None:
+            self.data = data
+        self._dirty = True
+        self._timer.start()
 
     def read(self):
-        if not os.path.isfile(self.pref_file):
+        """
+        Return the preferences, they're only loaded from disk the first time
+        """
+        if self.data is None:
             self.data = {}
-            self.write(self.data)
-        with open(self.pref_file, "r") as file_obj:
-            self.data = json.load(file_obj)
-            return self.data
+            if os.path.isfile(self.pref_file):
+                try:
+                    with open(self.pref_file, "r") as file_obj:
+                        self.data = json.load(file_obj)
+                except ValueError:
+                    # corrupt file, start over with default preferences
+                    self.data = {}
+        return self.data
+
+    def flush(self):
+        """
+        Write pending changes to disk straight away.  A failed write is logged and tried
+        again with the next flush
+        """
+        self._timer.stop()
+        if not self._dirty:
+            return
+        self._dirty = False
+
+        # write to a temporary file and rename it over the preferences, so that
+        # a crash mid-write can't leave a truncated file behind
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(prefix=".p4syncpref.", dir=self.root_dir)
+            with os.fdopen(fd, "w") as file_obj:
+                json.dump(self.data, file_obj, indent=4)
+            os.replace(temp_path, self.pref_file)
+        except OSError as e:
+            logger.warning("Failed to save the sync preferences to %s: %s" % (self.pref_file, e))
+            self._dirty = True
+            if temp_path and os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
 
 
 def open_browser(path):
@@ -0,0 +1,62 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Sync the Perforce files of ShotGrid entities from the command line, e.g. on farm
+nodes and build agents:
+
+    python p4_sync.py --project 123 --entity Asset:1234 --published-file 5678
+
+tk-core must be importable and the framework must be configured for the tk-shell
+engine of the project.  The script user to connect to ShotGrid with is taken from
+the SHOTGUN_HOST, SHOTGUN_SCRIPT_NAME and SHOTGUN_SCRIPT_KEY environment variables.
+Pass --help along with --project for the sync options.  See python/sync/cli.py for the exit codes.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+FRAMEWORK_NAME = "tk-framework-perforce"
+
+
+def main():
+    # everything but the project is passed on to the sync command line
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--project", type=int, required=True, help="Id of the ShotGrid project")
+    args, sync_argv = parser.parse_known_args()
+
+    try:
+        import sgtk
+
+        authenticator = sgtk.authentication.ShotgunAuthenticator()
+        user = authenticator.create_script_user(api_script=os.environ["SHOTGUN_SCRIPT_NAME"],
+                                                api_key=os.environ["SHOTGUN_SCRIPT_KEY"],
+                                                host=os.environ["SHOTGUN_HOST"])
+        manager = sgtk.bootstrap.ToolkitManager(sg_user=user)
+        manager.plugin_id = "basic.shell"
+        engine = manager.bootstrap_engine("tk-shell", entity={"type": "Project", "id": args.project})
+
+        frameworks = [fw for fw in engine.frameworks.values() if fw.name == FRAMEWORK_NAME]
+        if not frameworks:
+            raise RuntimeError("%s is not configured for the tk-shell engine" % FRAMEWORK_NAME)
+    except Exception as e:
+        sys.stdout.write(json.dumps({"event": "error", "error": str(e)}) + "\n")
+        return 1
+
+    try:
+        return frameworks[0].sync.run_cli(sync_argv)
+    finally:
+        engine.destroy()
+
+
+if __name__ == "__main__":
+    sys.exit(main())